@@ -0,0 +1,95 @@
+"""
+Compares the text and binary framings of Cinemasync.
+
+Reports the cost of decoding and validating incoming requests, of
+encoding outgoing responses, and the size of each frame on the wire.
+
+    python -m benchmarks.codec
+"""
+
+import sys
+import timeit
+from typing import Callable
+
+from src.rpc.codec import BINARY_CODEC, TEXT_CODEC, Codec, Frame
+from src.rpc.requests.base import RPCRequest
+from src.rpc.requests.enqueue import Enqueue
+from src.rpc.requests.hello import Hello
+from src.rpc.requests.pause import Pause
+from src.rpc.requests.resume import Resume
+from src.rpc.requests.seek import Seek
+from src.rpc.responses.base import RPCResponse
+from src.rpc.responses.enqueued import Enqueued
+from src.rpc.responses.ok import Ok
+from src.rpc.responses.pausing import Pausing
+from src.rpc.responses.seeking import Seeking
+from src.rpc.responses.sync import Sync
+
+ROUNDS = 20_000
+
+REQUESTS: list[tuple[int, str, str, type[RPCRequest]]] = [
+    (1, "HELLO", '{"name":"someone","passwd":null}', Hello),
+    (2, "ENQUEUE", '{"url":"https://www.youtube.com/watch?v=dQw4w9WgXcQ"}', Enqueue),
+    (3, "PAUSE", "{}", Pause),
+    (4, "RESUME", "{}", Resume),
+    (5, "SEEK", '{"position":1234.5}', Seek),
+]
+
+
+def bench(fn: Callable[[], object]) -> float:
+    return min(timeit.repeat(fn, number=ROUNDS, repeat=5)) / ROUNDS * 1e9
+
+
+def parse(codec: Codec, frame: Frame, cls: type[RPCRequest]):
+    rid, _, payload = codec.decode(frame)
+    cls.model_validate_json(payload).set_rid(rid)
+
+
+def reset(resp: RPCResponse):
+    resp.__pydantic_private__.update(_payload=None, _frame=None, _binary_frame=None)
+
+
+def main() -> int:
+    print("parsing requests")
+    print(f"{'method':<12}{'text ns':>10}{'bin ns':>10}{'text B':>10}{'bin B':>10}")
+    for rid, method, payload, cls in REQUESTS:
+        text = TEXT_CODEC.encode(rid, method, payload)
+        binary = BINARY_CODEC.encode(rid, method, payload)
+        print(
+            f"{method:<12}{bench(lambda: parse(TEXT_CODEC, text, cls)):>10.0f}"
+            f"{bench(lambda: parse(BINARY_CODEC, binary, cls)):>10.0f}"
+            f"{len(text.encode('utf-8')):>10}{len(binary):>10}"
+        )
+
+    ok = Ok()
+    ok.set_rid(1)
+    responses: list[RPCResponse] = [
+        ok,
+        Pausing(position=1234.5),
+        Seeking(position=1234.5),
+        Sync(position=1234.5, paused=False),
+        Enqueued(
+            url="https://www.youtube.com/watch?v=dQw4w9WgXcQ", submitted_by="someone"
+        ),
+    ]
+    print("\nserializing responses")
+    print(f"{'method':<12}{'text ns':>10}{'bin ns':>10}{'text B':>10}{'bin B':>10}")
+    for resp in responses:
+
+        def text():
+            reset(resp)
+            return resp.to_frame()
+
+        def binary():
+            reset(resp)
+            return resp.to_binary_frame()
+
+        print(
+            f"{resp._method:<12}{bench(text):>10.0f}{bench(binary):>10.0f}"
+            f"{len(text().encode('utf-8')):>10}{len(binary()):>10}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
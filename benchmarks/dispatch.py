@@ -0,0 +1,166 @@
+"""
+Throughput of the RPC dispatch engine, in messages per second per core.
+
+Feeds a stream of PAUSE, RESUME, SEEK and DEQUE requests through
+`RPCManager.perform_dispatch` over a fake WebSocket seated in a theater,
+so every message is read, decoded, handled, answered and broadcast, with
+the writes themselves being free. Reports the cost of decoding each of
+the fixed-shape requests with pydantic and with their own decoders, and
+the throughput of the whole dispatch with either of them, in both
+framings, and for requests that are turned away with an ERR.
+
+    python -m benchmarks.dispatch [messages]
+"""
+
+import asyncio
+import logging
+import sys
+import time
+import timeit
+from typing import Any, Callable
+
+import structlog
+from fastapi.datastructures import State
+
+from src.models.mediainfo import MediaInfo
+from src.models.queueitem import QueueItem
+from src.models.theater import Theater
+from src.rpc.codec import BINARY_CODEC, TEXT_CODEC, Codec, Frame
+from src.rpc.manager import RPCManager
+from src.rpc.requests.base import RPCRequest
+from src.rpc.requests.deque import Deque
+from src.rpc.requests.groups import GROUP_V0
+from src.rpc.requests.pause import Pause
+from src.rpc.requests.resume import Resume
+from src.rpc.requests.seek import Seek
+
+ROUNDS = 20_000
+MESSAGES = 50_000
+# how often the fake socket gives the writer tasks a turn, well under the
+# outbox watermark so nobody gets disconnected for falling behind
+YIELD_EVERY = 32
+
+REQUESTS: list[tuple[str, str, type[RPCRequest]]] = [
+    ("PAUSE", "{}", Pause),
+    ("RESUME", "{}", Resume),
+    ("SEEK", '{"position":42.5}', Seek),
+    ("DEQUE", '{"index":1000}', Deque),
+]
+MALFORMED: list[tuple[str, str]] = [
+    # a method only the server sends, so there is no handler for it
+    ("SYNC", "{}"),
+    ("SEEK", '{"position":"ahead"}'),
+    ("DEQUE", "{"),
+]
+
+
+class FakeWebSocket:
+    state: State
+    sent: int
+    __frames: list[Frame]
+    __next: int
+
+    def __init__(self, codec: Codec, frames: list[Frame]):
+        self.state = State()
+        self.state.codec = codec
+        self.sent = 0
+        self.__frames = frames
+        self.__next = 0
+
+    async def receive(self) -> dict[str, Any]:
+        frame = self.__frames[self.__next % len(self.__frames)]
+        self.__next += 1
+        if self.__next % YIELD_EVERY == 0:
+            await asyncio.sleep(0)
+        if isinstance(frame, str):
+            return {"type": "websocket.receive", "text": frame}
+        return {"type": "websocket.receive", "bytes": frame}
+
+    async def send_text(self, _: str):
+        self.sent += 1
+
+    async def send_bytes(self, _: bytes):
+        self.sent += 1
+
+
+def theater() -> Theater:
+    room = Theater(appstate=State(), name="Bench", passwd=None, auth_req=False)
+    item = QueueItem(
+        media=MediaInfo(url="https://example.com/1", title="Video", duration=600.0),
+        submitted_by="someone",
+    )
+    room.reset([], item, 0.0, False)
+    return room
+
+
+def pydantic_decode(cls: type[RPCRequest], payload: Frame, rid: int) -> RPCRequest:
+    request = cls.model_validate_json(payload)
+    request.set_rid(rid)
+    return request
+
+
+DECODERS = {cls: vars(cls)["decode"] for _, _, cls in REQUESTS}
+
+
+def use_pydantic(enabled: bool):
+    for cls, decoder in DECODERS.items():
+        cls.decode = classmethod(pydantic_decode) if enabled else decoder
+
+
+async def throughput(codec: Codec, requests: list[tuple[str, str]], amt: int) -> float:
+    frames = [
+        codec.encode(rid, method, payload)
+        for rid, (method, payload) in enumerate(requests, 1)
+    ]
+    rpc = RPCManager()
+    rpc.import_handlers(GROUP_V0.export_handlers())
+    room = theater()
+    ws = FakeWebSocket(codec, frames)
+    room.enter(ws)
+    started = time.process_time()
+    for _ in range(amt):
+        await rpc.perform_dispatch(room, ws)
+    elapsed = time.process_time() - started
+    room.leave(ws)
+    room.close()
+    return amt / elapsed
+
+
+def bench(fn: Callable[[], object]) -> float:
+    return min(timeit.repeat(fn, number=ROUNDS, repeat=5)) / ROUNDS * 1e9
+
+
+def main() -> int:
+    amt = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGES
+    # every request that is turned away is logged at debug, which would
+    # be most of what gets measured
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.INFO)
+    )
+
+    print("decoding requests")
+    print(f"{'method':<12}{'pydantic ns':>14}{'decoder ns':>14}{'speedup':>10}")
+    for method, payload, cls in REQUESTS:
+        slow = bench(lambda: pydantic_decode(cls, payload, 1))
+        fast = bench(lambda: cls.decode(payload, 1))
+        print(f"{method:<12}{slow:>14.0f}{fast:>14.0f}{slow / fast:>9.1f}x")
+
+    mix = [(method, payload) for method, payload, _ in REQUESTS]
+    print()
+    print(f"dispatching {amt} messages, per second of cpu")
+    print(f"{'workload':<20}{'text':>12}{'binary':>12}")
+    for name, requests, pydantic in (
+        ("mix, pydantic", mix, True),
+        ("mix, decoders", mix, False),
+        ("turned away", MALFORMED, False),
+    ):
+        use_pydantic(pydantic)
+        text = asyncio.run(throughput(TEXT_CODEC, requests, amt))
+        binary = asyncio.run(throughput(BINARY_CODEC, requests, amt))
+        print(f"{name:<20}{text:>12.0f}{binary:>12.0f}")
+    use_pydantic(False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Micro-benchmark for building response frames.
+
+Compares the old way of sending a response, which ran pydantic and an
+f-string for every recipient, with the cached `to_frame()` fast paths.
+
+    python -m benchmarks.frames [occupants]
+"""
+
+import sys
+import timeit
+from typing import Callable
+
+from pydantic import BaseModel
+
+from src.rpc.responses.base import RPCResponse
+from src.rpc.responses.join import Join
+from src.rpc.responses.nowplaying import NowPlaying
+from src.rpc.responses.ok import Ok
+from src.rpc.responses.pausing import Pausing
+from src.rpc.responses.results import Results
+from src.rpc.responses.resuming import Resuming
+from src.rpc.responses.seeking import Seeking
+
+ROUNDS = 20_000
+
+
+class Output(BaseModel):
+    occupants: list[str]
+    position: float
+
+
+def legacy_frame(resp: RPCResponse) -> str:
+    if isinstance(resp, Results) and isinstance(resp.output, BaseModel):
+        # went through the field_serializer and a dict round trip
+        resp.output.model_dump()
+    return f"{resp._rid} {resp._method} {RPCResponse.payload_json(resp)}"
+
+
+def reset(resp: RPCResponse):
+    resp.__pydantic_private__.update(_payload=None, _frame=None, _binary_frame=None)
+
+
+def fresh_frame(resp: RPCResponse) -> str:
+    reset(resp)
+    return resp.to_frame()
+
+
+def bench(fn: Callable[[], object]) -> float:
+    return min(timeit.repeat(fn, number=ROUNDS, repeat=5)) / ROUNDS * 1e9
+
+
+def main() -> int:
+    occupants = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    ok = Ok()
+    ok.set_rid(1)
+    responses: list[RPCResponse] = [
+        ok,
+        NowPlaying(media="https://www.youtube.com/watch?v=dQw4w9WgXcQ"),
+        Pausing(position=132.25),
+        Resuming(),
+        Seeking(position=42.5),
+        Join(user="someone"),
+        Results(output=Output(occupants=["a", "b", "c"], position=1.0)),
+    ]
+
+    print(f"{'opcode':<12}{'legacy ns':>12}{'frame ns':>12}{'speedup':>10}", end="")
+    print(f"{'legacy x' + str(occupants):>14}{'cached x' + str(occupants):>14}")
+    for resp in responses:
+        legacy = bench(lambda: legacy_frame(resp))
+        fresh = bench(lambda: fresh_frame(resp))
+
+        # a broadcast used to serialize once per occupant, now it
+        # serializes once and every other occupant hits the cache
+        def legacy_fanout():
+            for _ in range(occupants):
+                legacy_frame(resp)
+
+        def cached_fanout():
+            reset(resp)
+            for _ in range(occupants):
+                resp.to_frame()
+
+        print(
+            f"{resp._method:<12}{legacy:>12.0f}{fresh:>12.0f}"
+            f"{legacy / fresh:>9.1f}x"
+            f"{bench(legacy_fanout):>14.0f}{bench(cached_fanout):>14.0f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""
+Load generator for a whole server, over real WebSockets.
+
+Starts the server with the stub media resolver, so nothing goes out to
+the network, unless --url points at one that is already running. Then
+seats --clients occupants over --theaters theaters and has one occupant
+of every theater drive a mix of ENQUEUE, SEEK, PAUSE and RESUME, while
+every other occupant times how long the broadcasts took to reach it.
+
+Reports the end-to-end broadcast latency, the messages per second, and
+the CPU and RSS of the server, its workers included (read from /proc, so
+only on Linux), and of the load generator itself, which is worth keeping
+an eye on as it can run out of CPU before the server does.
+
+    python -m benchmarks.loadgen [--clients 2000] [--theaters 100] [--duration 30]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import httpx
+import ujson
+import websockets
+
+# what each action is, what it is broadcast as, and how often it is done
+MIX: list[tuple[str, str, int]] = [
+    ("SEEK", "SEEKING", 4),
+    ("PAUSE", "PAUSING", 2),
+    ("RESUME", "RESUMING", 2),
+    ("ENQUEUE", "ENQUEUED", 2),
+]
+BROADCASTS = {broadcast for _, broadcast, _ in MIX}
+HANDSHAKES = 100
+
+
+@dataclass
+class Stats:
+    measuring: bool = False
+    sent: int = 0
+    received: int = 0
+    errors: int = 0
+    # per theater, when the action behind each broadcast was sent
+    sent_at: dict[str, dict[int, float]] = field(default_factory=dict)
+    # per theater, every broadcast received by an occupant and when
+    received_at: dict[str, list[tuple[int, float]]] = field(default_factory=dict)
+
+    def latencies(self) -> list[float]:
+        latencies = []
+        for theater, received in self.received_at.items():
+            sent_at = self.sent_at.get(theater, {})
+            for seq, at in received:
+                sent = sent_at.get(seq)
+                if sent is not None:
+                    latencies.append(at - sent)
+        return sorted(latencies)
+
+
+class Processes:
+    """CPU time and RSS of a process and all of its children."""
+
+    pid: int
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def pids(self) -> list[int]:
+        parents: dict[int, int] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # the process name can hold spaces, the fields after it can't
+            parents[int(entry)] = int(stat.rsplit(")", 1)[1].split()[1])
+        pids = [self.pid]
+        for pid in pids:
+            pids.extend([child for child, parent in parents.items() if parent == pid])
+        return pids
+
+    def cpu(self) -> float:
+        ticks = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            ticks += int(fields[11]) + int(fields[12])
+        return ticks / os.sysconf("SC_CLK_TCK")
+
+    def rss(self) -> int:
+        rss = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            rss += int(line.split()[1]) * 1024
+            except OSError:
+                continue
+        return rss
+
+
+async def occupant(
+    url: str,
+    theater: str,
+    name: str,
+    stats: Stats,
+    seated: asyncio.Semaphore,
+    ready: "asyncio.Queue[None]",
+    stop: asyncio.Event,
+    rate: Optional[float],
+):
+    async with seated:
+        ws = await websockets.connect(
+            f"{url}/api/v0/theaters/{theater}/rpc/ws", max_queue=None
+        )
+    try:
+        await ws.send(f"1 HELLO {ujson.dumps({'name': name, 'page_size': 25})}")
+        while True:
+            frame = await ws.recv()
+            if isinstance(frame, str) and frame.startswith("1 RESULTS "):
+                break
+        await ready.put(None)
+
+        # the driver's actions that were not broadcast yet, as their rid,
+        # the broadcast they are expected to come back as, and when sent
+        expected: "deque[tuple[int, str, float]]" = deque()
+        tasks = [
+            asyncio.ensure_future(
+                receive(ws, theater, stats, None if rate is None else expected)
+            )
+        ]
+        if rate is not None:
+            tasks.append(asyncio.ensure_future(drive(ws, rate, expected, stats, stop)))
+        await stop.wait()
+        for task in tasks:
+            _ = task.cancel()
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        await ws.close()
+
+
+async def receive(
+    ws: websockets.WebSocketClientProtocol,
+    theater: str,
+    stats: Stats,
+    expected: "Optional[deque[tuple[int, str, float]]]",
+):
+    received = stats.received_at.setdefault(theater, [])
+    sent_at = stats.sent_at.setdefault(theater, {})
+    try:
+        async for frame in ws:
+            at = time.perf_counter()
+            if not stats.measuring or not isinstance(frame, str):
+                continue
+            stats.received += 1
+            rid, method, _ = frame.split(" ", 2)
+            if method == "ERR":
+                stats.errors += 1
+                # a failed action is never broadcast
+                if expected is not None:
+                    settle(expected, lambda action: action[0] == int(rid))
+            elif method not in BROADCASTS:
+                continue
+            elif expected is None:
+                received.append((int(rid), at))
+            else:
+                # enqueues wait on the resolver, so actions of different
+                # kinds can be broadcast in another order than they were sent
+                action = settle(expected, lambda action: action[1] == method)
+                if action is not None:
+                    sent_at[int(rid)] = action[2]
+    except websockets.ConnectionClosed:
+        pass
+
+
+def settle(
+    expected: "deque[tuple[int, str, float]]",
+    matches: Callable[[tuple[int, str, float]], bool],
+) -> Optional[tuple[int, str, float]]:
+    for action in expected:
+        if matches(action):
+            expected.remove(action)
+            return action
+    return None
+
+
+async def drive(
+    ws: websockets.WebSocketClientProtocol,
+    rate: float,
+    expected: "deque[tuple[int, str, float]]",
+    stats: Stats,
+    stop: asyncio.Event,
+):
+    rid = 1
+    actions = [action for action in MIX for _ in range(action[2])]
+    while not stop.is_set():
+        await asyncio.sleep(random.expovariate(rate))
+        if not stats.measuring:
+            continue
+        method, broadcast, _ = random.choice(actions)
+        rid += 1
+        if method == "SEEK":
+            payload = ujson.dumps({"position": random.uniform(0.0, 50.0)})
+        elif method == "ENQUEUE":
+            payload = ujson.dumps({"url": f"https://example.com/{rid}"})
+        else:
+            payload = "{}"
+        expected.append((rid, broadcast, time.perf_counter()))
+        stats.sent += 1
+        await ws.send(f"{rid} {method} {payload}")
+
+
+def spawn(args: argparse.Namespace) -> subprocess.Popen[bytes]:
+    env = os.environ | {
+        "CINEMA_HOST": "127.0.0.1",
+        "CINEMA_PORT": f"{args.port}",
+        "CINEMA_WORKERS": f"{args.workers}",
+        "MEDIA_RESOLVER": "stub",
+        "DEFAULT_THEATER_AMT": f"{args.theaters}",
+        "DEFAULT_THEATER_MAX_OCCUPANCY": f"{-(-args.clients // args.theaters)}",
+        "MAX_THEATERS": f"{args.theaters * 2}",
+        # every action needs a broadcast of its own to be timed by
+        "COALESCE_WINDOW": "0",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "src.main"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def theater_ids(url: str, amt: int) -> list[str]:
+    ids: list[str] = []
+    async with httpx.AsyncClient(base_url=url.replace("ws", "http", 1)) as client:
+        for _ in range(100):
+            try:
+                resp = await client.get("/api/v0/theaters", params={"limit": 500})
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+        else:
+            raise RuntimeError("the server never came up")
+        while True:
+            ids.extend([theater["id"] for theater in resp.json()])
+            cursor = resp.headers.get("x-next-cursor")
+            if cursor is None or len(ids) >= amt:
+                return ids[:amt]
+            resp = await client.get(
+                "/api/v0/theaters", params={"limit": 500, "cursor": cursor}
+            )
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+async def run(args: argparse.Namespace, url: str, server: Optional[Processes]):
+    theaters = await theater_ids(url, args.theaters)
+    stats = Stats()
+    stop = asyncio.Event()
+    ready: "asyncio.Queue[None]" = asyncio.Queue()
+    seated = asyncio.Semaphore(HANDSHAKES)
+    clients = [
+        asyncio.ensure_future(
+            occupant(
+                url,
+                theaters[i % len(theaters)],
+                f"load{i}",
+                stats,
+                seated,
+                ready,
+                stop,
+                # the first occupant of every theater drives it
+                args.rate if i < len(theaters) else None,
+            )
+        )
+        for i in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for _ in range(args.clients):
+        await ready.get()
+    print(f"seated {args.clients} occupants in {time.perf_counter() - started:.1f}s")
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    server_cpu = 0.0 if server is None else server.cpu()
+    stats.measuring = True
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stats.measuring = False
+    elapsed = time.perf_counter() - started
+    server_cpu = 0.0 if server is None else server.cpu() - server_cpu
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    own_cpu = used.ru_utime + used.ru_stime - own.ru_utime - own.ru_stime
+    rss = 0 if server is None else server.rss()
+
+    stop.set()
+    _ = await asyncio.gather(*clients, return_exceptions=True)
+
+    latencies = stats.latencies()
+    print(f"{'actions':<20}{stats.sent / elapsed:>12.0f} /s")
+    print(f"{'messages in':<20}{stats.received / elapsed:>12.0f} /s")
+    print(f"{'errors':<20}{stats.errors:>12}")
+    print(f"{'broadcasts timed':<20}{len(latencies):>12}")
+    for name, p in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)):
+        print(f"{'latency ' + name:<20}{percentile(latencies, p) * 1e3:>12.2f} ms")
+    if server is not None:
+        print(f"{'server cpu':<20}{server_cpu / elapsed * 100:>12.0f} %")
+        print(f"{'server rss':<20}{rss / 1e6:>12.1f} MB")
+    print(f"{'loadgen cpu':<20}{own_cpu / elapsed * 100:>12.0f} %")
+    if (server_cpu + own_cpu) / elapsed > 0.9 * (os.cpu_count() or 1):
+        print("the machine ran out of CPU, the latencies are mostly queueing")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--theaters", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument(
+        "--rate", type=float, default=2.0, help="actions per second per theater"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=5070)
+    parser.add_argument("--url", help="ws:// url of a server that is already up")
+    args = parser.parse_args()
+
+    # every occupant is a socket on both ends
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    proc = None if args.url is not None else spawn(args)
+    url = args.url or f"ws://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(run(args, url, None if proc is None else Processes(proc.pid)))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            _ = proc.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
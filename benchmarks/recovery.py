@@ -0,0 +1,97 @@
+"""
+Measures how long a restart takes to read the theaters back in.
+
+Fills 10k theaters with 100 queued items each, compacts them into a
+snapshot, leaves a tail of mutations in the write-ahead log, and then
+times recovering all of it into a fresh manager.
+
+    python -m benchmarks.recovery
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from fastapi.datastructures import State
+
+from src.models.mediainfo import MediaInfo
+from src.models.queueitem import QueueItem
+from src.models.theater import SQIDS_GEN, Theater, TheaterManager
+from src.persistence.journal import SNAPSHOT_FILE, WAL_FILE, Journal
+
+THEATERS = 10_000
+QUEUE_LEN = 100
+WAL_TAIL = 20_000
+
+
+def fill(appstate: State, rooms: TheaterManager):
+    for i in range(THEATERS):
+        theater = Theater(
+            appstate=appstate,
+            id=SQIDS_GEN.encode([i]),
+            name=f"Theater {i + 1}",
+            passwd=None,
+            auth_req=False,
+        )
+        rooms.insert(theater)
+        items = [
+            QueueItem(
+                media=MediaInfo(
+                    url=f"https://www.youtube.com/watch?v={i:05}{n:06}",
+                    title=f"Some video number {n} in theater {i}",
+                    duration=180.0 + n,
+                ),
+                submitted_by="someone",
+            )
+            for n in range(QUEUE_LEN)
+        ]
+        theater.reset(items[1:], items[0], 12.5, False)
+
+
+async def write(path: str) -> float:
+    appstate = State()
+    rooms = TheaterManager()
+    journal = Journal(path, rooms, compact_after=WAL_TAIL * 2)
+    appstate.journal = journal
+    fill(appstate, rooms)
+    started = time.perf_counter()
+    await journal.compact()
+    elapsed = time.perf_counter() - started
+
+    theaters = list(rooms.get_all())
+    for n in range(WAL_TAIL):
+        theater = theaters[n % len(theaters)]
+        if n % 2:
+            theater.seek_media(30.0)
+        else:
+            theater.deque(0)
+    await journal.flush()
+    journal.close()
+    return elapsed
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as path:
+        print(f"{THEATERS} theaters with {QUEUE_LEN} items, {WAL_TAIL} log entries")
+        compacted = asyncio.run(write(path))
+        for name in (SNAPSHOT_FILE, WAL_FILE):
+            size = os.path.getsize(os.path.join(path, name))
+            print(f"{name:<12}{size / 1e6:>10.1f} MB")
+        print(f"{'compaction':<12}{compacted:>10.2f} s")
+
+        appstate = State()
+        rooms = TheaterManager()
+        journal = Journal(path, rooms)
+        appstate.journal = journal
+        started = time.perf_counter()
+        recovered = journal.recover(appstate)
+        elapsed = time.perf_counter() - started
+        journal.close()
+        print(f"{'recovery':<12}{elapsed:>10.2f} s  ({recovered} theaters)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
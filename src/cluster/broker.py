@@ -0,0 +1,88 @@
+import asyncio
+import sys
+from asyncio import StreamReader, StreamWriter
+from typing import Final
+
+import structlog
+
+from .resp import (
+    RespError,
+    encode_bulk,
+    encode_command,
+    encode_error,
+    encode_int,
+    read_value,
+)
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+
+
+class Broker:
+    """
+    Minimal pub/sub server on a Unix socket, for running a few nodes on the
+    same machine without a redis. It only knows SUBSCRIBE, PUBLISH and PING,
+    just like redis it fans every published message out to the channel's
+    subscribers and forgets about it.
+    """
+
+    __channels: dict[bytes, set[StreamWriter]]
+
+    def __init__(self):
+        self.__channels = {}
+
+    async def serve(self, path: str):
+        server = await asyncio.start_unix_server(self.__handle, path)
+        LOGGER.info("broker listening", path=path)
+        async with server:
+            await server.serve_forever()
+
+    def publish(self, channel: bytes, message: bytes) -> int:
+        subscribers = self.__channels.get(channel, set())
+        frame = encode_command(b"message", channel, message)
+        for subscriber in subscribers:
+            subscriber.write(frame)
+        return len(subscribers)
+
+    async def __handle(self, reader: StreamReader, writer: StreamWriter):
+        subscribed: set[bytes] = set()
+        try:
+            while True:
+                command = await read_value(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(encode_error("expected a command"))
+                    continue
+                name = command[0]
+                args = command[1:]
+                if not isinstance(name, bytes) or not all(
+                    isinstance(arg, bytes) for arg in args
+                ):
+                    writer.write(encode_error("expected bulk strings"))
+                    continue
+                name = name.upper()
+                if name == b"PUBLISH" and len(args) == 2:
+                    writer.write(encode_int(self.publish(args[0], args[1])))
+                elif name == b"SUBSCRIBE" and args:
+                    for channel in args:
+                        self.__channels.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(
+                            b"*3\r\n"
+                            + encode_bulk(b"subscribe")
+                            + encode_bulk(channel)
+                            + encode_int(len(subscribed))
+                        )
+                elif name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                else:
+                    writer.write(encode_error(f"unsupported command {name!r}"))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, RespError, ValueError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.__channels[channel].discard(writer)
+            writer.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(Broker().serve(sys.argv[1]))
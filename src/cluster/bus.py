@@ -0,0 +1,195 @@
+import asyncio
+from abc import ABC, abstractmethod
+from asyncio import CancelledError, Queue, StreamReader, StreamWriter, Task
+from collections.abc import Awaitable
+from typing import Callable, Final, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import structlog
+
+from .resp import encode_command, read_value
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+DEFAULT_CHANNEL: Final[str] = "cinema"
+RECONNECT_DELAY: Final[float] = 1.0
+
+# receives every message published on the bus, its own ones included
+Handler = Callable[[str], None]
+Connector = Callable[[], Awaitable[tuple[StreamReader, StreamWriter]]]
+Session = Callable[[StreamReader, StreamWriter], Awaitable[None]]
+
+
+class EventBus(ABC):
+    """
+    Fans messages out to every node subscribed to the same bus. Delivery
+    is ordered per publisher but not guaranteed, anything that matters
+    has to notice a missing message on its own.
+    """
+
+    @abstractmethod
+    async def start(self, handler: Handler):
+        ...
+
+    @abstractmethod
+    def publish(self, message: str):
+        ...
+
+    @abstractmethod
+    def close(self):
+        ...
+
+
+class LocalHub:
+    __buses: list["LocalBus"]
+
+    def __init__(self):
+        self.__buses = []
+
+    def attach(self, bus: "LocalBus"):
+        self.__buses.append(bus)
+
+    def detach(self, bus: "LocalBus"):
+        self.__buses.remove(bus)
+
+    def deliver(self, message: str):
+        for bus in self.__buses:
+            bus.receive(message)
+
+
+LOCAL_HUB: Final[LocalHub] = LocalHub()
+
+
+class LocalBus(EventBus):
+    """
+    Bus between nodes living in the same process. Messages are handed over
+    on the next loop iteration, never from within the publishing call.
+    """
+
+    __hub: LocalHub
+    __handler: Optional[Handler] = None
+
+    def __init__(self, hub: LocalHub = LOCAL_HUB):
+        self.__hub = hub
+
+    async def start(self, handler: Handler):
+        self.__handler = handler
+        self.__hub.attach(self)
+
+    def publish(self, message: str):
+        _ = asyncio.get_running_loop().call_soon(self.__hub.deliver, message)
+
+    def receive(self, message: str):
+        if self.__handler is not None:
+            self.__handler(message)
+
+    def close(self):
+        if self.__handler is not None:
+            self.__hub.detach(self)
+            self.__handler = None
+
+
+class RespBus(EventBus):
+    """
+    Bus over a RESP speaking pub/sub server, either redis itself or the
+    bundled broker. Publishing only queues the message up, one connection
+    writes them out while another one sits subscribed to the channel.
+    Both reconnect on their own, whatever was lost in between is lost.
+    """
+
+    __connect: Connector
+    __channel: str
+    __outgoing: "Queue[str]"
+    __handler: Optional[Handler] = None
+    __tasks: list[Task[None]]
+
+    def __init__(self, connect: Connector, channel: str = DEFAULT_CHANNEL):
+        self.__connect = connect
+        self.__channel = channel
+        self.__outgoing = Queue()
+        self.__tasks = []
+
+    async def start(self, handler: Handler):
+        self.__handler = handler
+        self.__tasks = [
+            asyncio.create_task(self.__reconnecting(self.__subscriber)),
+            asyncio.create_task(self.__reconnecting(self.__publisher)),
+        ]
+
+    def publish(self, message: str):
+        self.__outgoing.put_nowait(message)
+
+    def close(self):
+        for task in self.__tasks:
+            _ = task.cancel()
+        self.__tasks = []
+
+    async def __reconnecting(self, session: Session):
+        while True:
+            try:
+                reader, writer = await self.__connect()
+                try:
+                    await session(reader, writer)
+                finally:
+                    writer.close()
+            except CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.warn("lost the connection to the bus", err=e)
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def __subscriber(self, reader: StreamReader, writer: StreamWriter):
+        writer.write(encode_command("SUBSCRIBE", self.__channel))
+        await writer.drain()
+        while True:
+            reply = await read_value(reader)
+            if not isinstance(reply, list) or len(reply) != 3:
+                continue
+            kind, _, message = reply
+            if kind == b"message" and isinstance(message, bytes):
+                assert self.__handler is not None
+                self.__handler(message.decode("utf-8"))
+
+    async def __publisher(self, reader: StreamReader, writer: StreamWriter):
+        acks = asyncio.create_task(self.__drain_acks(reader))
+        try:
+            while True:
+                message = await self.__outgoing.get()
+                writer.write(encode_command("PUBLISH", self.__channel, message))
+                # batch everything that piled up into a single write
+                while not self.__outgoing.empty():
+                    message = self.__outgoing.get_nowait()
+                    writer.write(encode_command("PUBLISH", self.__channel, message))
+                await writer.drain()
+                if acks.done():
+                    # the server hung up or replied with garbage
+                    acks.result()
+                    return
+        finally:
+            _ = acks.cancel()
+
+    async def __drain_acks(self, reader: StreamReader):
+        while True:
+            _ = await read_value(reader)
+
+
+def open_bus(url: str) -> EventBus:
+    """
+    `local` for nodes within the same process, `unix:///path/to/socket`
+    or `unix:///path/to/socket?channel=name` for the bundled broker, and
+    `redis://host:port/channel` for redis or anything speaking its pub/sub
+    commands.
+    """
+    if url == "local":
+        return LocalBus()
+    parts = urlsplit(url)
+    if parts.scheme == "unix":
+        path = parts.path
+        # the path is taken by the socket, the channel goes in the query
+        channel = parse_qs(parts.query).get("channel", [DEFAULT_CHANNEL])[0]
+        return RespBus(lambda: asyncio.open_unix_connection(path), channel)
+    channel = parts.path.strip("/") or DEFAULT_CHANNEL
+    if parts.scheme == "redis":
+        host = parts.hostname or "127.0.0.1"
+        port = parts.port or 6379
+        return RespBus(lambda: asyncio.open_connection(host, port), channel)
+    raise ValueError(f"unsupported bus url {url}")
@@ -0,0 +1,291 @@
+import asyncio
+import itertools
+import re
+from asyncio import StreamReader, StreamWriter
+from typing import Final, Optional
+from urllib.parse import parse_qs, parse_qsl, urlsplit
+
+import httpx
+import structlog
+import ujson
+
+from ..models.theater import DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, NEXT_CURSOR_HEADER
+from ..routers.theaters import MAX_POLL_TIMEOUT, etag_matches
+from ..rpc.metrics import CONTENT_TYPE
+from .hashring import HashRing
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+MAX_HEAD_LEN: Final[int] = 16 * 1024
+CHUNK_LEN: Final[int] = 64 * 1024
+THEATER_PATH: Final[re.Pattern[str]] = re.compile(r"^/api/v0/theaters/([^/]+)")
+LIST_PATH: Final[str] = "/api/v0/theaters"
+CHANGES_PATH: Final[str] = "/api/v0/theaters/changes"
+METRICS_PATH: Final[str] = "/metrics"
+
+
+class Dispatcher:
+    """
+    Front of a sharded server. Reads just enough of every connection to
+    find the theater id in the request path, then splices the connection
+    through to the worker owning that theater, WebSocket upgrades
+    included. Listing theaters is answered by merging every worker's list,
+    and so are the metrics, each sample labelled with its worker.
+
+    Plain HTTP requests are forced to `Connection: close`, as a kept-alive
+    connection could otherwise carry the next request to the wrong worker.
+    """
+
+    __ring: HashRing
+    __workers: dict[str, tuple[str, int]]
+    __any_worker: "itertools.cycle[str]"
+    __client: Optional[httpx.AsyncClient] = None
+
+    def __init__(self, ring: HashRing, workers: dict[str, tuple[str, int]]):
+        self.__ring = ring
+        self.__workers = workers
+        self.__any_worker = itertools.cycle(workers)
+
+    async def serve(self, host: str, port: int):
+        self.__client = httpx.AsyncClient()
+        server = await asyncio.start_server(
+            self.__handle, host, port, limit=MAX_HEAD_LEN
+        )
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.__client.aclose()
+
+    def route(self, path: str) -> str:
+        match = THEATER_PATH.match(path)
+        if match is None:
+            return next(self.__any_worker)
+        return self.__ring.owner(match.group(1))
+
+    async def __handle(self, reader: StreamReader, writer: StreamWriter):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line = head[: head.index(b"\r\n")].decode("latin-1")
+            method, target, _ = request_line.split(" ", 2)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            writer.close()
+            return
+
+        path = urlsplit(target).path
+        try:
+            if method == "GET" and path.rstrip("/") == LIST_PATH:
+                await self.__list(writer, target, header(head, b"if-none-match"))
+            elif method == "GET" and path == CHANGES_PATH:
+                await self.__changes(writer, target)
+            elif method == "GET" and path == METRICS_PATH:
+                await self.__metrics(writer)
+            else:
+                await self.__splice(self.route(path), head, reader, writer)
+        except (ConnectionError, httpx.HTTPError) as e:
+            LOGGER.warn("could not reach worker", path=path, err=e)
+        finally:
+            writer.close()
+
+    async def __splice(
+        self, node: str, head: bytes, reader: StreamReader, writer: StreamWriter
+    ):
+        if b"\r\nupgrade:" not in head.lower():
+            head = force_close(head)
+        upstream_reader, upstream_writer = await asyncio.open_connection(
+            *self.__workers[node]
+        )
+        upstream_writer.write(head)
+        # whichever side hangs up first ends the whole connection
+        pipes = {
+            asyncio.create_task(pipe(reader, upstream_writer)),
+            asyncio.create_task(pipe(upstream_reader, writer)),
+        }
+        try:
+            _, pending = await asyncio.wait(pipes, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                _ = task.cancel()
+        finally:
+            upstream_writer.close()
+
+    async def __list(
+        self, writer: StreamWriter, target: str, if_none_match: Optional[str]
+    ):
+        assert self.__client is not None
+        responses = await asyncio.gather(
+            *[
+                self.__client.get(f"http://{host}:{port}{target}")
+                for host, port in self.__workers.values()
+            ]
+        )
+        # a worker refusing the request (a bad limit, say) refuses it for
+        # all of them, hand its answer back as it is
+        for resp in responses:
+            if resp.status_code != 200:
+                status = f"{resp.status_code} {resp.reason_phrase}"
+                respond(
+                    writer,
+                    status.encode("latin-1"),
+                    {},
+                    resp.content,
+                    resp.headers.get("content-type", "application/json"),
+                )
+                return await writer.drain()
+
+        # the whole list only changed if one of the workers' lists did
+        etag = '"%s"' % ".".join(resp.headers["etag"].strip('"') for resp in responses)
+        if etag_matches(if_none_match, etag):
+            respond(writer, b"304 Not Modified", {"etag": etag})
+            return await writer.drain()
+
+        # every worker answered with its own first page after the cursor,
+        # the first page of them all is somewhere among those
+        theaters = sorted(
+            (theater for resp in responses for theater in resp.json()),
+            key=lambda theater: theater["id"],
+        )
+        limit = page_limit(target)
+        page = theaters[:limit]
+        more = len(theaters) > limit or any(
+            NEXT_CURSOR_HEADER in resp.headers for resp in responses
+        )
+        headers = {"etag": etag}
+        if more and page:
+            headers[NEXT_CURSOR_HEADER] = page[-1]["id"]
+        respond(writer, b"200 OK", headers, ujson.dumps(page).encode("utf-8"))
+        await writer.drain()
+
+    async def __changes(self, writer: StreamWriter, target: str):
+        assert self.__client is not None
+        client = self.__client
+        params = dict(parse_qsl(urlsplit(target).query))
+        # the cursor of the whole cluster is made up of every worker's own
+        since = params.pop("since", None)
+        cursors: list[Optional[str]] = [None] * len(self.__workers)
+        if since is not None:
+            cursors = since.split(".")
+            if len(cursors) != len(self.__workers):
+                cursors = ["reset"] * len(self.__workers)
+
+        def poll(i: int, host: str, port: int, timeout: Optional[str]):
+            query = dict(params)
+            if cursors[i] is not None:
+                query["since"] = cursors[i]
+            if timeout is not None:
+                query["timeout"] = timeout
+            return asyncio.ensure_future(
+                client.get(
+                    f"http://{host}:{port}{CHANGES_PATH}",
+                    params=query,
+                    timeout=MAX_POLL_TIMEOUT + 5.0,
+                )
+            )
+
+        workers = list(self.__workers.values())
+        polls = [poll(i, host, port, None) for i, (host, port) in enumerate(workers)]
+        try:
+            # as soon as one worker has something, the rest is asked
+            # for whatever they have right now instead of waiting on them
+            _, pending = await asyncio.wait(polls, return_when=asyncio.FIRST_COMPLETED)
+            for i, (host, port) in enumerate(workers):
+                if polls[i] in pending:
+                    _ = polls[i].cancel()
+                    polls[i] = poll(i, host, port, "0")
+            batches = [(await p).json() for p in polls]
+        finally:
+            for p in polls:
+                _ = p.cancel()
+
+        body = ujson.dumps(
+            {
+                "cursor": ".".join(batch["cursor"] for batch in batches),
+                "reset": any(batch["reset"] for batch in batches),
+                "changed": [t for batch in batches for t in batch["changed"]],
+                "removed": [id for batch in batches for id in batch["removed"]],
+            }
+        ).encode("utf-8")
+        respond(writer, b"200 OK", {}, body)
+        await writer.drain()
+
+    async def __metrics(self, writer: StreamWriter):
+        assert self.__client is not None
+        responses = await asyncio.gather(
+            *[
+                self.__client.get(f"http://{host}:{port}{METRICS_PATH}")
+                for host, port in self.__workers.values()
+            ]
+        )
+        # the samples of a metric have to stay together, under a single
+        # set of HELP and TYPE lines, no matter which worker they are from
+        families: dict[str, list[str]] = {}
+        for node, resp in zip(self.__workers, responses):
+            family: list[str] = []
+            for line in resp.text.splitlines():
+                if line.startswith("#"):
+                    family = families.setdefault(line.split(" ", 3)[2], [])
+                    if line not in family:
+                        family.append(line)
+                elif line:
+                    family.append(add_label(line, f'worker="{node}"'))
+        body = "".join(
+            f"{line}\n" for family in families.values() for line in family
+        ).encode("utf-8")
+        respond(writer, b"200 OK", {}, body, CONTENT_TYPE)
+        await writer.drain()
+
+
+def add_label(sample: str, label: str) -> str:
+    brace = sample.find("{")
+    space = sample.find(" ")
+    if 0 <= brace < space:
+        return f"{sample[: brace + 1]}{label},{sample[brace + 1 :]}"
+    return f"{sample[:space]}{{{label}}}{sample[space:]}"
+
+
+def header(head: bytes, name: bytes) -> Optional[str]:
+    for line in head[:-4].split(b"\r\n")[1:]:
+        key, _, value = line.partition(b":")
+        if key.strip().lower() == name:
+            return value.strip().decode("latin-1")
+    return None
+
+
+def respond(
+    writer: StreamWriter,
+    status: bytes,
+    headers: dict[str, str],
+    body: bytes = b"",
+    content_type: str = "application/json",
+):
+    head = b"HTTP/1.1 %s\r\n" % status
+    if body:
+        head += b"content-type: %s\r\n" % content_type.encode("latin-1")
+    head += b"content-length: %d\r\nconnection: close\r\n" % len(body)
+    for key, value in headers.items():
+        head += b"%s: %s\r\n" % (key.encode("latin-1"), value.encode("latin-1"))
+    writer.write(head + b"\r\n" + body)
+
+
+def page_limit(target: str) -> int:
+    try:
+        limit = int(parse_qs(urlsplit(target).query)["limit"][-1])
+    except (KeyError, ValueError):
+        limit = DEFAULT_PAGE_LIMIT
+    return min(max(limit, 1), MAX_PAGE_LIMIT)
+
+
+def force_close(head: bytes) -> bytes:
+    lines = head[:-4].split(b"\r\n")
+    kept = [line for line in lines if not line.lower().startswith(b"connection:")]
+    return b"\r\n".join([*kept, b"connection: close", b"", b""])
+
+
+async def pipe(reader: StreamReader, writer: StreamWriter):
+    try:
+        while True:
+            chunk = await reader.read(CHUNK_LEN)
+            if not chunk:
+                return
+            writer.write(chunk)
+            await writer.drain()
+    except ConnectionError:
+        return
@@ -0,0 +1,35 @@
+import hashlib
+from bisect import bisect
+from typing import Final, Sequence
+
+DEFAULT_REPLICAS: Final[int] = 64
+
+
+def hash_key(key: str) -> int:
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring, every node is placed on the ring `replicas`
+    times so keys spread out evenly, and adding or removing a node only
+    moves the keys that node owns. The ring is the same in every process
+    given the same node names.
+    """
+
+    __points: list[int]
+    __nodes: list[str]
+
+    def __init__(self, nodes: Sequence[str], replicas: int = DEFAULT_REPLICAS):
+        if len(nodes) == 0:
+            raise ValueError("a hash ring needs at least one node")
+        ring = sorted(
+            (hash_key(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self.__points = [point for point, _ in ring]
+        self.__nodes = [node for _, node in ring]
+
+    def owner(self, key: str) -> str:
+        i = bisect(self.__points, hash_key(key)) % len(self.__points)
+        return self.__nodes[i]
@@ -0,0 +1,203 @@
+import time
+from dataclasses import dataclass
+from typing import Any, Final
+
+import structlog
+import ujson
+
+from ..models.theater import RNG, Theater, TheaterManager
+from .bus import EventBus
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+# asks the addressed node for its whole state of a theater
+RESYNC: Final[str] = "resync"
+SNAPSHOT: Final[str] = "snapshot"
+RESYNC_BACKOFF: Final[float] = 1.0
+
+
+@dataclass
+class Event:
+    origin: str
+    # the process behind the origin, a node that comes back under the
+    # same name numbers its events from the start again
+    incarnation: str
+    theater: str
+    # per origin and theater, the control events carry 0
+    seq: int
+    kind: str
+    data: dict[str, Any]
+
+    def encode(self) -> str:
+        return ujson.dumps(
+            [
+                self.origin,
+                self.incarnation,
+                self.theater,
+                self.seq,
+                self.kind,
+                self.data,
+            ],
+            ensure_ascii=False,
+        )
+
+    @staticmethod
+    def decode(message: str) -> "Event":
+        try:
+            origin, incarnation, theater, seq, kind, data = ujson.loads(message)
+        except (ValueError, TypeError) as e:
+            raise ValueError("malformed event") from e
+        return Event(origin, incarnation, theater, seq, kind, data)
+
+
+class Replicator:
+    """
+    Keeps the theaters of every node on the bus in step. Each node applies
+    its own mutations and broadcasts first, then publishes them, and the
+    other nodes replay them onto their copy of the theater and fan the
+    broadcasts out to their own occupants.
+
+    Events of a theater are numbered per origin, so a node that missed
+    one stops listening to that origin and asks it for a snapshot of the
+    theater instead of drifting apart from it. The same goes for an
+    origin that started over, under a new incarnation or with numbers it
+    already used.
+    """
+
+    node: str
+    incarnation: str
+    __bus: EventBus
+    __rooms: TheaterManager
+    __sent: dict[str, int]
+    __seen: dict[tuple[str, str], int]
+    # the incarnation each origin was last heard from as
+    __incarnations: dict[str, str]
+    # (theater, origin) waiting on a snapshot, and when it was asked for
+    __resyncing: dict[tuple[str, str], float]
+
+    def __init__(self, node: str, bus: EventBus, rooms: TheaterManager):
+        self.node = node
+        self.incarnation = f"{RNG.getrandbits(32):08x}"
+        self.__bus = bus
+        self.__rooms = rooms
+        self.__sent = {}
+        self.__seen = {}
+        self.__incarnations = {}
+        self.__resyncing = {}
+
+    async def start(self):
+        await self.__bus.start(self.__receive)
+
+    def close(self):
+        self.__bus.close()
+
+    def publish(self, theater: str, kind: str, data: dict[str, Any]):
+        seq = self.__sent.get(theater, 0) + 1
+        self.__sent[theater] = seq
+        self.__bus.publish(self.__event(theater, seq, kind, data))
+
+    # drops the bookkeeping of a theater that no longer exists
+    def forget(self, theater: str):
+        _ = self.__sent.pop(theater, None)
+        for key in [key for key in self.__seen if key[0] == theater]:
+            del self.__seen[key]
+        for key in [key for key in self.__resyncing if key[0] == theater]:
+            del self.__resyncing[key]
+
+    def __control(self, theater: str, kind: str, data: dict[str, Any]):
+        self.__bus.publish(self.__event(theater, 0, kind, data))
+
+    def __event(self, theater: str, seq: int, kind: str, data: dict[str, Any]) -> str:
+        return Event(self.node, self.incarnation, theater, seq, kind, data).encode()
+
+    def __receive(self, message: str):
+        try:
+            event = Event.decode(message)
+        except ValueError as e:
+            LOGGER.warn("dropping a malformed replication event", err=e)
+            return
+        if event.origin == self.node:
+            return
+        if self.__incarnations.get(event.origin) != event.incarnation:
+            self.__reincarnated(event.origin, event.incarnation)
+        try:
+            theater = self.__rooms.get(event.theater)()
+        except IndexError:
+            return
+        if theater is None:
+            return
+
+        try:
+            if event.kind == RESYNC:
+                if event.data["to"] == self.node:
+                    self.__send_snapshot(theater, event.origin)
+            elif event.kind == SNAPSHOT:
+                self.__restore(theater, event)
+            else:
+                self.__apply(theater, event)
+        except (KeyError, TypeError, ValueError) as e:
+            LOGGER.warn("could not apply a replication event", kind=event.kind, err=e)
+
+    def __apply(self, theater: Theater, event: Event):
+        key = (event.theater, event.origin)
+        last = self.__seen.get(key, 0)
+        if event.seq <= last:
+            # the origin numbers this theater's events from the start
+            # again, it was forgotten and set up anew over there
+            LOGGER.info(
+                "replication events went backwards",
+                theater=key[0],
+                origin=key[1],
+                seq=event.seq,
+                last=last,
+            )
+            del self.__seen[key]
+            self.__request_snapshot(key)
+            return
+        if key in self.__resyncing or event.seq > last + 1:
+            self.__request_snapshot(key)
+            return
+        self.__seen[key] = event.seq
+        theater.apply(event.kind, event.data)
+
+    # forgets what was seen of an origin before it restarted, and asks it
+    # for a snapshot of every theater heard of from it so far
+    def __reincarnated(self, origin: str, incarnation: str):
+        if origin in self.__incarnations:
+            LOGGER.info("replication origin restarted", origin=origin)
+        self.__incarnations[origin] = incarnation
+        keys = [key for key in self.__seen if key[1] == origin]
+        for key in keys:
+            del self.__seen[key]
+        for key in [key for key in self.__resyncing if key[1] == origin]:
+            del self.__resyncing[key]
+        for key in keys:
+            self.__request_snapshot(key)
+
+    def __request_snapshot(self, key: tuple[str, str]):
+        now = time.monotonic()
+        if now - self.__resyncing.get(key, -RESYNC_BACKOFF) < RESYNC_BACKOFF:
+            return
+        LOGGER.info(
+            "missed replication events, resyncing", theater=key[0], origin=key[1]
+        )
+        self.__resyncing[key] = now
+        self.__control(key[0], RESYNC, {"to": key[1]})
+
+    def __send_snapshot(self, theater: Theater, to: str):
+        self.__control(
+            theater.id,
+            SNAPSHOT,
+            {
+                "to": to,
+                "seq": self.__sent.get(theater.id, 0),
+                "state": theater.snapshot(),
+            },
+        )
+
+    def __restore(self, theater: Theater, event: Event):
+        key = (event.theater, event.origin)
+        if event.data["to"] != self.node or key not in self.__resyncing:
+            return
+        theater.restore(event.data["state"])
+        self.__seen[key] = event.data["seq"]
+        del self.__resyncing[key]
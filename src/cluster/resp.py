@@ -0,0 +1,52 @@
+from asyncio import StreamReader
+from typing import Final, Union
+
+# the small subset of RESP2 spoken between the nodes and a pub/sub
+# server, enough for SUBSCRIBE and PUBLISH against redis or the broker
+Value = Union[bytes, int, None, list["Value"]]
+
+CRLF: Final[bytes] = b"\r\n"
+
+
+class RespError(Exception):
+    pass
+
+
+def encode_bulk(part: Union[str, bytes]) -> bytes:
+    data = part.encode("utf-8") if isinstance(part, str) else part
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def encode_command(*parts: Union[str, bytes]) -> bytes:
+    return b"*%d\r\n" % len(parts) + b"".join(encode_bulk(part) for part in parts)
+
+
+def encode_int(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+def encode_error(message: str) -> bytes:
+    return b"-ERR %s\r\n" % message.encode("utf-8")
+
+
+async def read_value(reader: StreamReader) -> Value:
+    line = await reader.readuntil(CRLF)
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body
+    if kind == b"-":
+        raise RespError(body.decode("utf-8", errors="replace"))
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_value(reader) for _ in range(length)]
+    raise RespError(f"unknown reply type {kind!r}")
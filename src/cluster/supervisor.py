@@ -0,0 +1,62 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+from typing import Final
+
+import structlog
+
+from .dispatcher import Dispatcher
+from .hashring import HashRing
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+WORKER_HOST: Final[str] = "127.0.0.1"
+
+
+def worker_nodes(count: int) -> list[str]:
+    return [f"worker-{i}" for i in range(count)]
+
+
+async def supervise(host: str, port: int, count: int) -> int:
+    """
+    Spawns `count` workers, each running the whole app on a private port
+    and owning the theaters that hash to it, and dispatches incoming
+    connections to them until the dispatcher is stopped.
+    """
+    nodes = worker_nodes(count)
+    workers = {node: (WORKER_HOST, port + 1 + i) for i, node in enumerate(nodes)}
+    procs: list[subprocess.Popen[bytes]] = []
+    for i, (node, (worker_host, worker_port)) in enumerate(workers.items()):
+        LOGGER.info("spawning worker", node=node, port=worker_port)
+        env = os.environ | {
+            "CINEMA_WORKER_INDEX": f"{i}",
+            "CINEMA_HOST": worker_host,
+            "CINEMA_PORT": f"{worker_port}",
+        }
+        procs.append(subprocess.Popen([sys.executable, "-m", "src.main"], env=env))
+
+    serving = asyncio.ensure_future(
+        Dispatcher(HashRing(nodes), workers).serve(host, port)
+    )
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    stopped = asyncio.ensure_future(stopping.wait())
+    try:
+        _ = await asyncio.wait({serving, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        _ = stopped.cancel()
+        # the workers drain their theaters first, while the
+        # dispatcher is still there to carry their RECONNECTs
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            _ = await asyncio.to_thread(proc.wait)
+        _ = serving.cancel()
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+    return 0
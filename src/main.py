@@ -1,35 +1,119 @@
 import asyncio
+import os
 import signal
+import socket
 import sys
 from os import getenv
-from typing import Final
+from typing import Callable, Final, TypeVar
 
 import anyio
 import structlog
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 
+from .cluster.bus import open_bus
+from .cluster.hashring import HashRing
+from .cluster.replication import Replicator
+from .cluster.supervisor import supervise, worker_nodes
+from .media.cache import (
+    DEFAULT_CAPACITY,
+    DEFAULT_TTL,
+    MediaInfoCache,
+    MediaInfoStore,
+)
+from .media.prefetch import (
+    DEFAULT_PREFETCH_CONCURRENCY,
+    DEFAULT_PREFETCH_DEPTH,
+    DEFAULT_PREFETCH_INTERVAL,
+    DEFAULT_REFRESH_MARGIN,
+    StreamPrefetcher,
+)
+from .media.resolver import (
+    DEFAULT_MAX_PENDING,
+    DEFAULT_TIMEOUT,
+    DEFAULT_WORKERS,
+    MediaResolver,
+    extract_media_info,
+    extract_stream_info,
+    stub_media_info,
+    stub_stream_info,
+)
+from .models.cachestats import CacheStats
+from .models.drain import (
+    DEFAULT_DRAIN_GRACE,
+    DEFAULT_RECONNECT_SPREAD,
+    Drainer,
+    DrainingServer,
+)
+from .models.heartbeat import DEFAULT_DRIFT, DEFAULT_TICK, SyncHeartbeat
 from .models.problem import Problem
+from .models.reaper import DEFAULT_IDLE_TIMEOUT, DEFAULT_REAP_INTERVAL, TheaterReaper
+from .models.scheduler import SCHEDULER
 from .models.serverinfo import ServerInfo
-from .models.theater import Theater, TheaterManager
+from .models.syncmode import SyncMode
+from .models.theater import (
+    DEFAULT_COALESCE_WINDOW,
+    DEFAULT_EVENT_BUFFER_LEN,
+    DEFAULT_SYNC_INTERVAL,
+    SQIDS_GEN,
+    Theater,
+    TheaterManager,
+)
+from .persistence.journal import DEFAULT_COMPACT_AFTER, DEFAULT_FLUSH_DELAY, Journal
 from .routers import theaters
+from .rpc.compression import DEFAULT_THRESHOLD, CompressingWebSocketProtocol
 from .rpc.manager import RPCManager
+from .rpc.metrics import (
+    CONTENT_TYPE,
+    METRICS,
+    THEATER_OCCUPANCY,
+    THEATER_OUTBOX_DEPTH,
+)
+from .rpc.outbox import DEFAULT_WATERMARK, OverflowPolicy
+from .rpc.ratelimit import (
+    DEFAULT_CONNECTION_BURST,
+    DEFAULT_CONNECTION_RATE,
+    DEFAULT_METHOD_LIMITS,
+    DEFAULT_THEATER_BURST,
+    DEFAULT_THEATER_RATE,
+    Limit,
+    RateLimits,
+    parse_limits,
+)
 from .rpc.requests import (  # pyright: ignore[reportUnusedImport] # type: ignore # noqa F401
     deque,
     enqueue,
+    handover,
     hello,
     pause,
+    rejoin,
+    report,
     resume,
+    roomstate,
     seek,
 )
 from .rpc.requests.groups import GROUP_V0
+from .rpc.tokens import DEFAULT_TOKEN_TTL, ResumeTokens, load_secret
 
 APP: Final[FastAPI] = FastAPI()
 LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
 EVLOOP: Final[asyncio.AbstractEventLoop] = asyncio.get_event_loop()
 
+N = TypeVar("N", int, float)
+
+
+def getenv_number(key: str, default: N, conv: Callable[[str], N]) -> N:
+    try:
+        return conv(getenv(key, default=str(default)))
+    except ValueError as e:
+        LOGGER.warn(
+            f"{key} was set but was not a valid number, defaulting to {default}",
+            err=e,
+        )
+        return default
+
 
 @APP.get("/api", tags=["_openapi"])
 async def openapi():
@@ -52,13 +136,48 @@ async def info() -> ServerInfo:
     return ServerInfo()
 
 
+@APP.get("/info/media-cache", tags=["_root"])
+async def media_cache_info() -> CacheStats:
+    return APP.state.resolver.cache().stats()
+
+
+@APP.get("/metrics", tags=["_root"])
+async def metrics() -> Response:
+    # the per theater gauges are only worked out when scraped
+    THEATER_OCCUPANCY.clear()
+    THEATER_OUTBOX_DEPTH.clear()
+    for theater in APP.state.rooms.get_all():
+        THEATER_OCCUPANCY.set(len(theater.occupants), theater.id)
+        THEATER_OUTBOX_DEPTH.set(
+            sum([occupant.state.outbox.depth() for occupant in theater.occupants]),
+            theater.id,
+        )
+    return Response(METRICS.render(), headers={"Content-Type": CONTENT_TYPE})
+
+
 @APP.on_event("shutdown")
 def on_shutdown():
     APP.state.running = False
+    SCHEDULER.stop()
+    APP.state.resolver.shutdown()
+    if APP.state.replicator is not None:
+        APP.state.replicator.close()
+    if APP.state.journal is not None:
+        APP.state.journal.close()
 
 
 async def main() -> int:
+    host = getenv("CINEMA_HOST", default="0.0.0.0")
+    port = getenv_number("CINEMA_PORT", 5050, int)
+    worker_amt = getenv_number("CINEMA_WORKERS", 1, int)
+    # only set on the workers spawned by the dispatcher
+    worker_idx = getenv_number("CINEMA_WORKER_INDEX", -1, int)
+    if worker_amt > 1 and worker_idx < 0:
+        LOGGER.info("running as the dispatcher for sharded workers", amt=worker_amt)
+        return await supervise(host, port, worker_amt)
+
     APP.state.running = True
+    APP.state.draining = False
 
     #LOGGER.info("activating CORS middleware")
     #origins = ["http://localhost:3000", "http://127.0.0.1:3000"]
@@ -89,43 +208,233 @@ async def main() -> int:
     LOGGER.info("assigning handlers for RPC v0 commands")
     APP.state.rpcman.import_handlers(GROUP_V0.export_handlers())
 
-    LOGGER.info("setting up app state management")
-    APP.state.rooms = TheaterManager()
+    LOGGER.info("setting up outbound queues")
+    APP.state.outbox_watermark = getenv_number(
+        "OUTBOX_WATERMARK", DEFAULT_WATERMARK, int
+    )
+    try:
+        APP.state.outbox_policy = OverflowPolicy(
+            getenv("OUTBOX_OVERFLOW_POLICY", default=OverflowPolicy.DISCONNECT)
+        )
+    except ValueError as e:
+        LOGGER.warn(
+            "OUTBOX_OVERFLOW_POLICY was set but was not a valid policy, defaulting to disconnect",
+            err=e,
+        )
+        APP.state.outbox_policy = OverflowPolicy.DISCONNECT
 
-    LOGGER.info("setting up default rooms")
+    LOGGER.info("setting up rate limits")
     try:
-        default_room_amt = int(getenv("DEFAULT_THEATER_AMT", default=4))
+        method_limits = parse_limits(
+            getenv("RATE_LIMIT_METHODS", default=DEFAULT_METHOD_LIMITS)
+        )
     except ValueError as e:
         LOGGER.warn(
-            "DEFAULT_THEATER_AMT was set but was not a valid number, defaulting to 4",
+            f"RATE_LIMIT_METHODS was set but was not valid, defaulting to {DEFAULT_METHOD_LIMITS}",
             err=e,
         )
-        default_room_amt = 4
+        method_limits = parse_limits(DEFAULT_METHOD_LIMITS)
+    APP.state.rate_limits = RateLimits(
+        connection=Limit(
+            getenv_number("RATE_LIMIT_CONNECTION_RATE", DEFAULT_CONNECTION_RATE, float),
+            getenv_number(
+                "RATE_LIMIT_CONNECTION_BURST", DEFAULT_CONNECTION_BURST, float
+            ),
+        ),
+        theater=Limit(
+            getenv_number("RATE_LIMIT_THEATER_RATE", DEFAULT_THEATER_RATE, float),
+            getenv_number("RATE_LIMIT_THEATER_BURST", DEFAULT_THEATER_BURST, float),
+        ),
+        methods=method_limits,
+    )
+    APP.state.coalesce_window = getenv_number(
+        "COALESCE_WINDOW", DEFAULT_COALESCE_WINDOW, float
+    )
+
+    LOGGER.info("setting up app state management")
+    APP.state.event_buffer_len = getenv_number(
+        "EVENT_BUFFER_LEN", DEFAULT_EVENT_BUFFER_LEN, int
+    )
+    if worker_idx < 0:
+        APP.state.rooms = TheaterManager()
+    else:
+        LOGGER.info("owning the theaters of a shard", shard=worker_idx)
+        nodes = worker_nodes(worker_amt)
+        ring = HashRing(nodes)
+        APP.state.rooms = TheaterManager(
+            owns=lambda id: ring.owner(id) == nodes[worker_idx]
+        )
+
+    bus_url = getenv("CLUSTER_BUS")
+    if bus_url is None:
+        APP.state.replicator = None
+    else:
+        node = getenv("CLUSTER_NODE", default=f"{socket.gethostname()}-{os.getpid()}")
+        LOGGER.info("replicating theaters with other nodes", bus=bus_url, node=node)
+        APP.state.replicator = Replicator(node, open_bus(bus_url), APP.state.rooms)
+
+    LOGGER.info("setting up the media info cache")
+    cache_path = getenv("MEDIA_CACHE_PATH")
+    media_cache = MediaInfoCache(
+        capacity=getenv_number("MEDIA_CACHE_SIZE", DEFAULT_CAPACITY, int),
+        ttl=getenv_number("MEDIA_CACHE_TTL", DEFAULT_TTL, float),
+        store=None if cache_path is None else MediaInfoStore(cache_path),
+    )
+
+    LOGGER.info("setting up the media resolver pool")
+    APP.state.resolver = MediaResolver(
+        workers=getenv_number("MEDIA_RESOLVER_WORKERS", DEFAULT_WORKERS, int),
+        max_pending=getenv_number(
+            "MEDIA_RESOLVER_MAX_PENDING", DEFAULT_MAX_PENDING, int
+        ),
+        timeout=getenv_number("MEDIA_RESOLVER_TIMEOUT", DEFAULT_TIMEOUT, float),
+        use_processes=getenv("MEDIA_RESOLVER_POOL", default="thread") == "process",
+        cache=media_cache,
+        # the stub never goes out to the network, it is meant for load tests
+        extractor=(
+            stub_media_info
+            if getenv("MEDIA_RESOLVER", default="ytdlp") == "stub"
+            else extract_media_info
+        ),
+        stream_extractor=(
+            stub_stream_info
+            if getenv("MEDIA_RESOLVER", default="ytdlp") == "stub"
+            else extract_stream_info
+        ),
+    )
+
+    LOGGER.info("setting up stream prefetching")
+    prefetch_depth = getenv_number("PREFETCH_DEPTH", DEFAULT_PREFETCH_DEPTH, int)
+    APP.state.prefetcher = (
+        None
+        if prefetch_depth <= 0
+        else StreamPrefetcher(
+            APP.state.rooms,
+            APP.state.resolver,
+            depth=prefetch_depth,
+            concurrency=getenv_number(
+                "PREFETCH_CONCURRENCY", DEFAULT_PREFETCH_CONCURRENCY, int
+            ),
+            interval=getenv_number(
+                "PREFETCH_INTERVAL", DEFAULT_PREFETCH_INTERVAL, float
+            ),
+            refresh_margin=getenv_number(
+                "PREFETCH_REFRESH_MARGIN", DEFAULT_REFRESH_MARGIN, float
+            ),
+        )
+    )
+
+    recovered = 0
+    state_root = state_path = getenv("STATE_PATH")
+    if state_path is None:
+        APP.state.journal = None
+    else:
+        # every worker keeps a journal of its own theaters
+        if worker_idx >= 0:
+            state_path = os.path.join(state_path, f"worker-{worker_idx}")
+        LOGGER.info("recovering theaters from the journal", path=state_path)
+        APP.state.journal = Journal(
+            state_path,
+            APP.state.rooms,
+            flush_delay=getenv_number("STATE_FLUSH_DELAY", DEFAULT_FLUSH_DELAY, float),
+            compact_after=getenv_number(
+                "STATE_COMPACT_AFTER", DEFAULT_COMPACT_AFTER, int
+            ),
+        )
+        recovered = APP.state.journal.recover(APP.state)
+        LOGGER.info("recovered theaters", amt=recovered)
+        if APP.state.journal.needs_compaction():
+            await APP.state.journal.compact()
+
+    LOGGER.info("setting up default rooms")
+    # recovered default rooms are not set up a second time
+    default_room_amt = 0 if recovered else getenv_number("DEFAULT_THEATER_AMT", 4, int)
+    default_seat_amt = getenv_number("DEFAULT_THEATER_MAX_OCCUPANCY", 8, int)
+    sync_interval = getenv_number("SYNC_INTERVAL", DEFAULT_SYNC_INTERVAL, float)
+    APP.state.sync_interval = sync_interval
     try:
-        default_seat_amt: int = int(getenv("DEFAULT_THEATER_MAX_OCCUPANCY", default=8))
+        APP.state.sync_mode = SyncMode(getenv("SYNC_MODE", default=SyncMode.SERVER))
     except ValueError as e:
         LOGGER.warn(
-            "DEFAULT_THEATER_MAX_OCCUPANCY was set but was not a valid number, defaulting to 8",
+            "SYNC_MODE was set but was not a valid mode, defaulting to server",
             err=e,
         )
-        default_seat_amt = 8
+        APP.state.sync_mode = SyncMode.SERVER
+    APP.state.max_theaters = getenv_number("MAX_THEATERS", 1000, int)
     for i in range(default_room_amt):
-        APP.state.rooms.insert(
-            Theater(
-                appstate=APP.state,
-                name=f"Theater {i + 1}",
-                passwd=None,
-                auth_req=False,
-                seats=default_seat_amt,
-            )
+        # the default rooms are spread out over the workers
+        if worker_idx >= 0 and i % worker_amt != worker_idx:
+            continue
+        theater = Theater(
+            appstate=APP.state,
+            name=f"Theater {i + 1}",
+            passwd=None,
+            auth_req=False,
+            seats=default_seat_amt,
+            sync_interval=sync_interval,
+            pinned=True,
+            mode=APP.state.sync_mode,
         )
+        # every node has to agree on the ids of the replicated rooms
+        if APP.state.replicator is not None:
+            theater.id = SQIDS_GEN.encode([i])
+        APP.state.rooms.insert(theater)
 
-    LOGGER.info("starting the HTTP server")
-    uv_cfg = uvicorn.Config(APP, host="0.0.0.0", port=5050, log_level="debug")
-    srv = uvicorn.Server(uv_cfg)
+    LOGGER.info("setting up SYNC heartbeats")
+    # the leader's reports are held to the same threshold
+    APP.state.sync_drift = getenv_number("SYNC_DRIFT_THRESHOLD", DEFAULT_DRIFT, float)
+    APP.state.heartbeat = SyncHeartbeat(
+        APP.state.rooms,
+        tick=getenv_number("SYNC_TICK", DEFAULT_TICK, float),
+        drift=APP.state.sync_drift,
+    )
 
-    for room in APP.state.rooms.get_all():
-        LOGGER.debug("Running Theater's main loop", theater=room)
+    LOGGER.info("setting up idle theater reclamation")
+    APP.state.reaper = TheaterReaper(
+        APP.state.rooms,
+        idle_timeout=getenv_number("THEATER_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT, float),
+        interval=getenv_number("THEATER_REAP_INTERVAL", DEFAULT_REAP_INTERVAL, float),
+    )
+
+    LOGGER.info("setting up session handoff")
+    secret = getenv("RESUME_SECRET")
+    if secret is not None:
+        resume_secret = secret.encode("utf-8")
+    elif state_root is not None:
+        # shared by the workers and by whichever process picks the journal up
+        resume_secret = load_secret(state_root)
+    else:
+        LOGGER.warn(
+            "neither RESUME_SECRET nor STATE_PATH is set, "
+            "sessions can not be resumed elsewhere"
+        )
+        resume_secret = None
+    APP.state.resume_tokens = ResumeTokens(
+        resume_secret,
+        ttl=getenv_number("RESUME_TOKEN_TTL", DEFAULT_TOKEN_TTL, float),
+    )
+    drainer = Drainer(
+        APP.state,
+        APP.state.rooms,
+        spread=getenv_number("DRAIN_RECONNECT_SPREAD", DEFAULT_RECONNECT_SPREAD, float),
+        grace=getenv_number("DRAIN_GRACE", DEFAULT_DRAIN_GRACE, float),
+    )
+
+    LOGGER.info("setting up WebSocket compression")
+    threshold = getenv_number("WS_COMPRESSION_THRESHOLD", DEFAULT_THRESHOLD, int)
+    # a negative threshold turns compression off
+    CompressingWebSocketProtocol.threshold = threshold if threshold >= 0 else None
+
+    LOGGER.info("starting the HTTP server")
+    uv_cfg = uvicorn.Config(
+        APP,
+        host=host,
+        port=port,
+        log_level="debug",
+        ws=CompressingWebSocketProtocol,
+    )
+    srv = DrainingServer(uv_cfg)
+    srv.drainer = drainer
 
     async def sig_handler(scope: anyio.CancelScope) -> None:
         with anyio.open_signal_receiver(
@@ -135,13 +444,19 @@ async def main() -> int:
                 _ = scope.cancel()
                 await scope.cancel()
 
+    if APP.state.replicator is not None:
+        await APP.state.replicator.start()
+
     async with anyio.create_task_group() as tg:
         APP.state.tg = tg
         # tg.start_soon(sig_handler, tg.cancel_scope)
 
         tg.start_soon(srv.serve)
-        for room in APP.state.rooms.get_all():
-            tg.start_soon(room.main_loop)
+        tg.start_soon(SCHEDULER.run)
+        APP.state.heartbeat.start()
+        APP.state.reaper.start()
+        if APP.state.prefetcher is not None:
+            APP.state.prefetcher.start()
 
     LOGGER.info("application has finished, shutting down...")
 
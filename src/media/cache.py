@@ -0,0 +1,221 @@
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from ..models.cachestats import CacheStats
+from ..models.mediainfo import MediaInfo
+
+DEFAULT_CAPACITY: Final[int] = 1024
+DEFAULT_TTL: Final[float] = 6 * 60 * 60
+
+# query parameters that never change what media a url on one of the
+# known hosts points at
+TRACKING_PARAMS: Final[frozenset[str]] = frozenset(
+    {"feature", "si", "pp", "fbclid", "gclid", "ref", "ref_src"}
+)
+YOUTUBE_HOSTS: Final[frozenset[str]] = frozenset(
+    {"youtube.com", "music.youtube.com", "youtube-nocookie.com"}
+)
+YOUTUBE_ONLY_PARAMS: Final[frozenset[str]] = frozenset(
+    {"t", "start", "index", "list", "ab_channel"}
+)
+# providers known to serve the same media over http and https, and on
+# their www. and m. hosts alike. anywhere else those can differ.
+KNOWN_HOSTS: Final[frozenset[str]] = YOUTUBE_HOSTS | frozenset(
+    {"youtu.be", "vimeo.com", "dailymotion.com", "soundcloud.com", "twitch.tv"}
+)
+
+
+# urls that can't even be parsed are left as they are, the extractor is
+# the one to turn them down
+def canonicalize_url(url: str) -> str:
+    try:
+        return canonicalize_parsed(url)
+    except ValueError:
+        return url
+
+
+def canonicalize_parsed(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "https"
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix) and host[len(prefix) :] in KNOWN_HOSTS:
+            host = host[len(prefix) :]
+    if scheme == "http" and host in KNOWN_HOSTS:
+        scheme = "https"
+    if ":" in host:
+        host = f"[{host}]"
+    port = parts.port
+    default_port = {"http": 80, "https": 443}.get(scheme)
+    netloc = host if port is None or port == default_port else f"{host}:{port}"
+
+    # on any other host a trailing slash or a query parameter can make
+    # for another resource, only the known ones are rewritten any further
+    if host not in KNOWN_HOSTS:
+        return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+    path = parts.path.rstrip("/") or "/"
+    query = parse_qsl(parts.query, keep_blank_values=True)
+
+    # the same video can be shared in a handful of shapes, fold them
+    # all into the regular watch page so they share a cache entry
+    if host == "youtu.be" and path != "/":
+        netloc, query = "youtube.com", [("v", path[1:]), *query]
+        path = "/watch"
+    elif host in YOUTUBE_HOSTS:
+        for prefix in ("/shorts/", "/embed/", "/live/", "/v/"):
+            if path.startswith(prefix):
+                query = [("v", path[len(prefix) :]), *query]
+                path = "/watch"
+                break
+    youtube = netloc in YOUTUBE_HOSTS
+
+    kept = sorted(
+        (k, v)
+        for k, v in query
+        if k not in TRACKING_PARAMS
+        and not k.startswith("utm_")
+        and not (youtube and k in YOUTUBE_ONLY_PARAMS)
+    )
+    return urlunsplit((scheme, netloc, path, urlencode(kept), ""))
+
+
+class MediaInfoStore:
+    """
+    On-disk backing for the media cache, so lookups survive restarts.
+    Entries are expired on wall-clock time, as the monotonic clock does not
+    carry over between processes.
+
+    The database is only ever touched from a thread of its own, never from
+    the event loop. Reads are awaited, writes are handed off and left to
+    finish in the order they were made.
+    """
+
+    __db: sqlite3.Connection
+    __thread: ThreadPoolExecutor
+
+    def __init__(self, path: str):
+        self.__thread = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="media-store"
+        )
+        # only at startup, before there is anything to hold up
+        self.__thread.submit(self.__open, path).result()
+
+    def __open(self, path: str):
+        self.__db = sqlite3.connect(path)
+        _ = self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS media"
+            " (key TEXT PRIMARY KEY, info TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        _ = self.__db.execute("DELETE FROM media WHERE expires_at <= ?", (time.time(),))
+        self.__db.commit()
+
+    async def get(self, key: str) -> Optional[tuple[MediaInfo, float]]:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.__thread, self.__get, key
+        )
+
+    def __get(self, key: str) -> Optional[tuple[MediaInfo, float]]:
+        row = self.__db.execute(
+            "SELECT info, expires_at FROM media WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        info, expires_at = row
+        ttl = expires_at - time.time()
+        if ttl <= 0:
+            return None
+        return MediaInfo.model_validate_json(info), ttl
+
+    def put(self, key: str, info: MediaInfo, ttl: float):
+        _ = self.__thread.submit(
+            self.__put, key, info.model_dump_json(), time.time() + ttl
+        )
+
+    def __put(self, key: str, info: str, expires_at: float):
+        _ = self.__db.execute(
+            "INSERT OR REPLACE INTO media (key, info, expires_at) VALUES (?, ?, ?)",
+            (key, info, expires_at),
+        )
+        self.__db.commit()
+
+    # the writes still queued up are finished first
+    def close(self):
+        _ = self.__thread.submit(self.__db.close)
+        self.__thread.shutdown(wait=True)
+
+
+class MediaInfoCache:
+    """
+    LRU cache of resolved media information with a TTL, keyed on the
+    canonicalized url. Optionally falls back to a `MediaInfoStore`.
+    """
+
+    __entries: OrderedDict[str, tuple[float, MediaInfo]]
+    __capacity: int
+    __ttl: float
+    __store: Optional[MediaInfoStore]
+    __stats: CacheStats
+
+    def __init__(
+        self,
+        *,
+        capacity: int = DEFAULT_CAPACITY,
+        ttl: float = DEFAULT_TTL,
+        store: Optional[MediaInfoStore] = None,
+    ):
+        self.__entries = OrderedDict()
+        self.__capacity = capacity
+        self.__ttl = ttl
+        self.__store = store
+        self.__stats = CacheStats(capacity=capacity)
+
+    async def get(self, key: str) -> Optional[MediaInfo]:
+        entry = self.__entries.get(key)
+        if entry is not None:
+            expires_at, info = entry
+            if expires_at > time.monotonic():
+                self.__entries.move_to_end(key)
+                self.__stats.hits += 1
+                return info
+            del self.__entries[key]
+            self.__stats.expirations += 1
+
+        if self.__store is not None:
+            stored = await self.__store.get(key)
+            if stored is not None:
+                info, ttl = stored
+                self.__insert(key, info, ttl)
+                self.__stats.hits += 1
+                self.__stats.disk_hits += 1
+                return info
+
+        self.__stats.misses += 1
+        return None
+
+    def put(self, key: str, info: MediaInfo):
+        self.__insert(key, info, self.__ttl)
+        if self.__store is not None:
+            self.__store.put(key, info, self.__ttl)
+
+    def __insert(self, key: str, info: MediaInfo, ttl: float):
+        self.__entries[key] = (time.monotonic() + ttl, info)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__capacity:
+            _ = self.__entries.popitem(last=False)
+            self.__stats.evictions += 1
+
+    def coalesced(self):
+        self.__stats.coalesced += 1
+
+    def stats(self) -> CacheStats:
+        return self.__stats.model_copy(update={"size": len(self.__entries)})
+
+    def close(self):
+        if self.__store is not None:
+            self.__store.close()
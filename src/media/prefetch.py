@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import deque
+from typing import Final, Optional
+
+import structlog
+
+from ..models.scheduler import SCHEDULER
+from ..models.streaminfo import StreamInfo
+from ..models.theater import TheaterManager
+from ..rpc.metrics import STREAM_PREFETCHES
+from .cache import canonicalize_url
+from .resolver import MediaResolver, ResolverBusyError, ResolverError
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+DEFAULT_PREFETCH_DEPTH: Final[int] = 2
+DEFAULT_PREFETCH_CONCURRENCY: Final[int] = 2
+DEFAULT_PREFETCH_INTERVAL: Final[float] = 5.0
+# how long before a signed url lapses it is resolved again
+DEFAULT_REFRESH_MARGIN: Final[float] = 5 * 60.0
+# how long a stream that does not say when it lapses is trusted for
+DEFAULT_STREAM_TTL: Final[float] = 60 * 60.0
+# how long an url that could not be resolved is left alone for
+RETRY_BACKOFF: Final[float] = 60.0
+
+
+class StreamPrefetcher:
+    """
+    Resolves the streams of the next few items of every queue ahead of
+    time, so they go out with NOWPLAYING and nobody waits on the extractor
+    when the media changes. A recurring pass on the shared scheduler works
+    out which urls are wanted, nearest to playing first, forgets the
+    streams nobody wants anymore, and lines up the ones that are missing
+    or about to lapse. Those are looked up on the resolver's pool, never
+    more than `concurrency` at once, the next one starting as soon as one
+    is done. Streams lapse on wall-clock time, as signed urls do.
+    """
+
+    # how many items after the one playing get their streams resolved
+    depth: int
+    __rooms: TheaterManager
+    __resolver: MediaResolver
+    __concurrency: int
+    __interval: float
+    __margin: float
+    __ttl: float
+    # per canonicalized url, the stream and when to resolve it again
+    __streams: dict[str, tuple[StreamInfo, float]]
+    __backlog: deque[tuple[str, str]]
+    __inflight: set[str]
+    # per canonicalized url, when to try again
+    __failed: dict[str, float]
+
+    def __init__(
+        self,
+        rooms: TheaterManager,
+        resolver: MediaResolver,
+        *,
+        depth: int = DEFAULT_PREFETCH_DEPTH,
+        concurrency: int = DEFAULT_PREFETCH_CONCURRENCY,
+        interval: float = DEFAULT_PREFETCH_INTERVAL,
+        refresh_margin: float = DEFAULT_REFRESH_MARGIN,
+        ttl: float = DEFAULT_STREAM_TTL,
+    ):
+        self.depth = depth
+        self.__rooms = rooms
+        self.__resolver = resolver
+        self.__concurrency = max(concurrency, 1)
+        self.__interval = interval
+        self.__margin = refresh_margin
+        self.__ttl = ttl
+        self.__streams = {}
+        self.__backlog = deque()
+        self.__inflight = set()
+        self.__failed = {}
+
+    def start(self):
+        _ = SCHEDULER.call_later(self.__interval, self.__pass)
+
+    # the stream of an url, if it was prefetched and did not lapse yet
+    def get(self, url: str) -> Optional[StreamInfo]:
+        entry = self.__streams.get(canonicalize_url(url))
+        if entry is None:
+            return None
+        info = entry[0]
+        if info.expires_at is not None and info.expires_at <= time.time():
+            return None
+        return info
+
+    async def __pass(self):
+        try:
+            self.__plan(time.time())
+            self.__pump()
+        finally:
+            _ = SCHEDULER.call_later(self.__interval, self.__pass)
+
+    def __plan(self, now: float):
+        queues = [
+            room.queue for room in self.__rooms.get_all() if room.nowplaying is not None
+        ]
+        # the next item of every queue goes before the one after it of any
+        wanted: dict[str, str] = {}
+        for i in range(self.depth):
+            for queue in queues:
+                if i < len(queue):
+                    url = queue[i].media.url
+                    _ = wanted.setdefault(canonicalize_url(url), url)
+
+        for key in [key for key in self.__streams if key not in wanted]:
+            del self.__streams[key]
+        for key in [
+            key
+            for key, retry_at in self.__failed.items()
+            if retry_at <= now or key not in wanted
+        ]:
+            del self.__failed[key]
+        self.__backlog = deque(
+            (key, url)
+            for key, url in wanted.items()
+            if key not in self.__inflight
+            and key not in self.__failed
+            and (key not in self.__streams or self.__streams[key][1] <= now)
+        )
+
+    def __pump(self):
+        loop = asyncio.get_running_loop()
+        while self.__backlog and len(self.__inflight) < self.__concurrency:
+            key, url = self.__backlog.popleft()
+            self.__inflight.add(key)
+            _ = loop.create_task(self.__fetch(key, url))
+
+    async def __fetch(self, key: str, url: str):
+        try:
+            info = await self.__resolver.stream(url)
+        except ResolverBusyError:
+            # the pool is needed for enqueues, the rest waits for the next pass
+            self.__backlog.clear()
+            STREAM_PREFETCHES.inc("busy")
+        except ResolverError as e:
+            LOGGER.debug("could not prefetch a stream", url=url, err=e)
+            self.__failed[key] = time.time() + RETRY_BACKOFF
+            STREAM_PREFETCHES.inc("failed")
+        else:
+            now = time.time()
+            if info.expires_at is None:
+                refresh_at = now + self.__ttl
+            else:
+                # urls that are not good for much longer than the margin
+                # are still used for half of the time they have left
+                refresh_at = max(
+                    info.expires_at - self.__margin,
+                    now + (info.expires_at - now) / 2,
+                )
+            self.__streams[key] = (info, refresh_at)
+            STREAM_PREFETCHES.inc("resolved")
+        finally:
+            self.__inflight.discard(key)
+            self.__pump()
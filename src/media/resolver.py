@@ -0,0 +1,245 @@
+import asyncio
+import functools
+import time
+import zlib
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Final, Optional, TypeVar
+from urllib.parse import parse_qsl, urlsplit
+
+from yt_dlp import DownloadError, YoutubeDL
+
+from ..models.mediainfo import MediaInfo
+from ..models.streaminfo import StreamInfo
+from .cache import MediaInfoCache, canonicalize_url
+
+DEFAULT_WORKERS: Final[int] = 4
+DEFAULT_MAX_PENDING: Final[int] = 32
+DEFAULT_TIMEOUT: Final[float] = 30.0
+# stubbed media is between 1 and 10 minutes long
+STUB_MIN_DURATION: Final[float] = 60.0
+STUB_MAX_DURATION: Final[float] = 600.0
+# a single file with both audio and video, which any player can load
+# without having to put separate streams back together
+STREAM_FORMAT: Final[str] = "best[vcodec!=none][acodec!=none]/best"
+# the query parameters signed urls say when they lapse in, as unix time
+EXPIRY_PARAMS: Final[frozenset[str]] = frozenset({"expire", "expires", "Expires"})
+STUB_STREAM_TTL: Final[float] = 6 * 60 * 60
+
+T = TypeVar("T")
+
+
+class ResolverError(Exception):
+    pass
+
+
+class FetchInfoError(ResolverError):
+    pass
+
+
+class PartialInfoError(ResolverError):
+    pass
+
+
+class ResolverBusyError(ResolverError):
+    pass
+
+
+class ResolverTimeoutError(ResolverError):
+    pass
+
+
+# runs inside of a worker, so this must stay a module level function
+# for it to be picklable when a process pool is being used.
+def extract_media_info(url: str) -> MediaInfo:
+    with YoutubeDL() as ytdl:
+        try:
+            info = ytdl.extract_info(url, download=False)
+        except DownloadError as e:
+            raise FetchInfoError(f"{e}") from e
+    if info is None or type(info) is not dict:
+        raise FetchInfoError("extractor returned no information")
+
+    # not having duration is a hard-error, we rely
+    # on this information too much not to have it
+    try:
+        duration = info["duration"]
+    except KeyError as e:
+        raise PartialInfoError(f"{e}") from e
+    try:
+        if type(duration) is not float:
+            duration = float(duration)
+    except (TypeError, ValueError) as e:
+        raise PartialInfoError(f"{e}") from e
+
+    title = info.get("title", "")
+    if type(title) is not str:
+        title = ""
+    return MediaInfo(url=url, title=title, duration=duration)
+
+
+# same as above, for the stream a player would load
+def extract_stream_info(url: str) -> StreamInfo:
+    with YoutubeDL({"format": STREAM_FORMAT}) as ytdl:
+        try:
+            info = ytdl.extract_info(url, download=False)
+        except DownloadError as e:
+            raise FetchInfoError(f"{e}") from e
+    if info is None or type(info) is not dict:
+        raise FetchInfoError("extractor returned no information")
+
+    stream = info.get("url")
+    if type(stream) is not str:
+        raise PartialInfoError("extractor returned no playable stream")
+    ext, format_id = info.get("ext"), info.get("format_id")
+    return StreamInfo(
+        url=stream,
+        ext=ext if type(ext) is str else "",
+        format_id=format_id if type(format_id) is str else "",
+        expires_at=signed_expiry(stream),
+    )
+
+
+def signed_expiry(url: str) -> Optional[float]:
+    for key, value in parse_qsl(urlsplit(url).query):
+        if key in EXPIRY_PARAMS:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+# stands in for the extractor when load testing, it never touches the
+# network and always gives the same made up information for an url
+def stub_media_info(url: str) -> MediaInfo:
+    checksum = zlib.crc32(url.encode("utf-8"))
+    span = STUB_MAX_DURATION - STUB_MIN_DURATION
+    return MediaInfo(
+        url=url,
+        title=f"Stub {checksum:08x}",
+        duration=STUB_MIN_DURATION + checksum % int(span),
+    )
+
+
+def stub_stream_info(url: str) -> StreamInfo:
+    checksum = zlib.crc32(url.encode("utf-8"))
+    expires_at = int(time.time() + STUB_STREAM_TTL)
+    return StreamInfo(
+        url=f"https://stub.invalid/{checksum:08x}.mp4?expire={expires_at}",
+        ext="mp4",
+        format_id="stub",
+        expires_at=float(expires_at),
+    )
+
+
+class MediaResolver:
+    """
+    Resolves media information off of the event loop on a bounded pool.
+
+    Jobs that are waiting on, or running in, the pool count towards the
+    pending limit until the worker is actually finished with them, even if
+    the caller already gave up because of the timeout.
+
+    Concurrent lookups of the same (canonicalized) url share a single job,
+    and finished lookups are kept in the cache if one was given. Streams
+    are never cached here, as they tend to lapse long before media info.
+    """
+
+    __pool: Executor
+    __extractor: Callable[[str], MediaInfo]
+    __stream_extractor: Callable[[str], StreamInfo]
+    __timeout: float
+    __max_pending: int
+    __pending: int = 0
+    __cache: Optional[MediaInfoCache]
+    __inflight: dict[str, "asyncio.Task[MediaInfo]"]
+
+    def __init__(
+        self,
+        *,
+        workers: int = DEFAULT_WORKERS,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        timeout: float = DEFAULT_TIMEOUT,
+        use_processes: bool = False,
+        cache: Optional[MediaInfoCache] = None,
+        extractor: Callable[[str], MediaInfo] = extract_media_info,
+        stream_extractor: Callable[[str], StreamInfo] = extract_stream_info,
+    ):
+        if use_processes:
+            self.__pool = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.__pool = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="media-resolver"
+            )
+        self.__extractor = extractor
+        self.__stream_extractor = stream_extractor
+        self.__timeout = timeout
+        self.__max_pending = max_pending
+        self.__cache = cache
+        self.__inflight = {}
+
+    def pending(self) -> int:
+        return self.__pending
+
+    def cache(self) -> Optional[MediaInfoCache]:
+        return self.__cache
+
+    async def resolve(self, url: str) -> MediaInfo:
+        key = canonicalize_url(url)
+        if self.__cache is not None:
+            info = await self.__cache.get(key)
+            if info is not None:
+                return info
+
+        inflight = self.__inflight.get(key)
+        if inflight is None:
+            # the lookup runs in its own task, so the requester
+            # going away doesn't cancel it for everyone else
+            inflight = asyncio.get_running_loop().create_task(
+                self.__extract(self.__extractor, url)
+            )
+            inflight.add_done_callback(functools.partial(self.__settle, key))
+            self.__inflight[key] = inflight
+        elif self.__cache is not None:
+            self.__cache.coalesced()
+        return await asyncio.shield(inflight)
+
+    def __settle(self, key: str, task: "asyncio.Task[MediaInfo]"):
+        del self.__inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.__cache is not None:
+            self.__cache.put(key, task.result())
+
+    async def stream(self, url: str) -> StreamInfo:
+        return await self.__extract(self.__stream_extractor, url)
+
+    async def __extract(self, extractor: Callable[[str], T], url: str) -> T:
+        if self.__pending >= self.__max_pending:
+            raise ResolverBusyError(
+                f"{self.__pending} media lookups are already pending"
+            )
+
+        fut: Future[T] = self.__pool.submit(extractor, url)
+        self.__pending += 1
+        loop = asyncio.get_running_loop()
+
+        def __release(_: Future[T]):
+            # done callbacks are ran on the worker thread
+            _ = loop.call_soon_threadsafe(self.__finished)
+
+        fut.add_done_callback(__release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), self.__timeout)
+        except asyncio.TimeoutError as e:
+            raise ResolverTimeoutError(
+                f"media lookup took longer than {self.__timeout}s"
+            ) from e
+
+    def __finished(self):
+        self.__pending -= 1
+
+    def shutdown(self):
+        self.__pool.shutdown(wait=False, cancel_futures=True)
+        if self.__cache is not None:
+            self.__cache.close()
@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+
+class CacheStats(BaseModel):
+    capacity: int
+    size: int = 0
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    coalesced: int = 0
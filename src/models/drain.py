@@ -0,0 +1,97 @@
+import asyncio
+import random
+import socket
+import time
+from typing import Final, Optional
+
+import structlog
+import uvicorn
+from fastapi.datastructures import State
+
+from ..models.theater import TheaterManager
+from ..rpc.responses.reconnect import Reconnect
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+RNG: Final[random.Random] = random.Random()
+DEFAULT_RECONNECT_SPREAD: Final[float] = 10.0
+DEFAULT_DRAIN_GRACE: Final[float] = 5.0
+DRAIN_POLL: Final[float] = 0.05
+
+
+class Drainer:
+    """
+    Hands the sessions of a process that is going away over to the one
+    taking its place. New joins are turned away, every occupant is told
+    to reconnect after a random delay, so they don't all come back at
+    once, along with a token to take its seat back with, and the state of
+    the theaters is written out before the connections are closed.
+    """
+
+    __appstate: State
+    __rooms: TheaterManager
+    __spread: float
+    __grace: float
+
+    def __init__(
+        self,
+        appstate: State,
+        rooms: TheaterManager,
+        *,
+        spread: float = DEFAULT_RECONNECT_SPREAD,
+        grace: float = DEFAULT_DRAIN_GRACE,
+    ):
+        self.__appstate = appstate
+        self.__rooms = rooms
+        self.__spread = spread
+        self.__grace = grace
+
+    async def drain(self):
+        self.__appstate.draining = True
+        tokens = getattr(self.__appstate, "resume_tokens", None)
+        occupants = 0
+        for room in list(self.__rooms.get_all()):
+            for occupant in room.occupants:
+                # only seated occupants have a seat to come back to
+                username = getattr(occupant.state, "username", None)
+                token = (
+                    None
+                    if username is None or tokens is None
+                    else tokens.issue(room.id, username, room.stream)
+                )
+                await Reconnect(
+                    delay=RNG.uniform(0.0, self.__spread), token=token
+                ).send(occupant)
+                occupants += 1
+        LOGGER.info("draining, told occupants to reconnect", amt=occupants)
+
+        journal = getattr(self.__appstate, "journal", None)
+        if journal is not None:
+            try:
+                await journal.compact()
+            except OSError as e:
+                LOGGER.error("could not write out the theaters while draining", err=e)
+
+        # give the writers a moment to get the RECONNECTs out
+        deadline = time.monotonic() + self.__grace
+        while time.monotonic() < deadline and self.__backlog():
+            await asyncio.sleep(DRAIN_POLL)
+
+    def __backlog(self) -> bool:
+        return any(
+            occupant.state.outbox.depth() != 0
+            for room in self.__rooms.get_all()
+            for occupant in room.occupants
+        )
+
+
+class DrainingServer(uvicorn.Server):
+    """Stops listening and drains the theaters before closing connections."""
+
+    drainer: Optional[Drainer] = None
+
+    async def shutdown(self, sockets: Optional[list[socket.socket]] = None) -> None:
+        for server in self.servers:
+            server.close()
+        if self.drainer is not None:
+            await self.drainer.drain()
+        await super().shutdown(sockets=sockets)
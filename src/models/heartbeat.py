@@ -0,0 +1,44 @@
+import time
+from typing import Final
+
+from ..models.scheduler import SCHEDULER
+from ..models.theater import TheaterManager
+
+DEFAULT_TICK: Final[float] = 1.0
+DEFAULT_DRIFT: Final[float] = 0.5
+
+
+class SyncHeartbeat:
+    """
+    Drives the SYNC heartbeats of every theater from a single recurring
+    pass on the shared scheduler. Only the theaters the manager has down
+    as playing to someone are visited, each of them decides on its own
+    whether it is due, and whether anything changed enough to be worth
+    sending.
+    """
+
+    __rooms: TheaterManager
+    __tick: float
+    __drift: float
+
+    def __init__(
+        self,
+        rooms: TheaterManager,
+        *,
+        tick: float = DEFAULT_TICK,
+        drift: float = DEFAULT_DRIFT,
+    ):
+        self.__rooms = rooms
+        self.__tick = tick
+        self.__drift = drift
+
+    def start(self):
+        _ = SCHEDULER.call_later(self.__tick, self.__pass)
+
+    async def __pass(self):
+        now = time.monotonic()
+        try:
+            for room in self.__rooms.playing():
+                await room.sync(now, self.__drift)
+        finally:
+            _ = SCHEDULER.call_later(self.__tick, self.__pass)
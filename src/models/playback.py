@@ -0,0 +1,63 @@
+import time
+
+
+class PlaybackClock:
+    """
+    Authoritative playback position of a theater's current media.
+
+    The position is kept as a base position plus the monotonic time that
+    has passed since it was taken, so reading it is O(1) and nothing has to
+    tick while the media plays. Every discontinuity (start, pause, resume,
+    seek) re-anchors the base and bumps the epoch.
+    """
+
+    __base: float = 0.0
+    __anchored_at: float = 0.0
+    __duration: float = 0.0
+    __paused: bool = False
+    epoch: int = 0
+
+    def start(self, duration: float, position: float = 0.0):
+        self.__duration = duration
+        self.__paused = False
+        self.__anchor(position)
+
+    def stop(self):
+        self.__duration = 0.0
+        self.__paused = False
+        self.__anchor(0.0)
+
+    def pause(self):
+        if self.__paused:
+            return
+        self.__anchor(self.position())
+        self.__paused = True
+
+    def resume(self):
+        if not self.__paused:
+            return
+        self.__paused = False
+        self.__anchor(self.__base)
+
+    def seek(self, position: float):
+        self.__anchor(min(max(position, 0.0), self.__duration))
+
+    def position(self) -> float:
+        if self.__paused:
+            return self.__base
+        elapsed = time.monotonic() - self.__anchored_at
+        return min(self.__base + elapsed, self.__duration)
+
+    def remaining(self) -> float:
+        return self.__duration - self.position()
+
+    def duration(self) -> float:
+        return self.__duration
+
+    def paused(self) -> bool:
+        return self.__paused
+
+    def __anchor(self, position: float):
+        self.__base = position
+        self.__anchored_at = time.monotonic()
+        self.epoch += 1
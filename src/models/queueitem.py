@@ -6,3 +6,6 @@ from .mediainfo import MediaInfo
 class QueueItem(BaseModel):
     media: MediaInfo
     submitted_by: str
+    # the lamport time and the node it was enqueued at. the queue is kept
+    # in this order on every node, and the item is dequeued by it.
+    stamp: tuple[int, str] = (0, "")
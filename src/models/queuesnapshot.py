@@ -0,0 +1,33 @@
+from typing import Final, Optional
+
+from pydantic import TypeAdapter
+
+from ..models.queueitem import QueueItem
+
+QUEUE_ADAPTER: Final[TypeAdapter[tuple[QueueItem, ...]]] = TypeAdapter(
+    tuple[QueueItem, ...]
+)
+
+
+class QueueSnapshot:
+    """
+    Immutable view of a theater's queue as of a version. Theaters only
+    build a new one after the queue changed, so every join in between
+    shares the same items and the same serialized json.
+    """
+
+    items: tuple[QueueItem, ...]
+    version: int
+    __json: Optional[str] = None
+
+    def __init__(self, items: tuple[QueueItem, ...], version: int):
+        self.items = items
+        self.version = version
+
+    def json(self) -> str:
+        if self.__json is None:
+            self.__json = QUEUE_ADAPTER.dump_json(self.items).decode("utf-8")
+        return self.__json
+
+    def __len__(self) -> int:
+        return len(self.items)
@@ -0,0 +1,51 @@
+import time
+from typing import Final
+
+import structlog
+
+from ..models.scheduler import SCHEDULER
+from ..models.theater import TheaterManager
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+DEFAULT_IDLE_TIMEOUT: Final[float] = 15 * 60.0
+DEFAULT_REAP_INTERVAL: Final[float] = 30.0
+
+
+class TheaterReaper:
+    """
+    Removes theaters that have sat empty for longer than the idle timeout,
+    from a recurring pass on the shared scheduler. Pinned theaters, like
+    the default ones, are always left alone.
+    """
+
+    __rooms: TheaterManager
+    __idle_timeout: float
+    __interval: float
+
+    def __init__(
+        self,
+        rooms: TheaterManager,
+        *,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        interval: float = DEFAULT_REAP_INTERVAL,
+    ):
+        self.__rooms = rooms
+        self.__idle_timeout = idle_timeout
+        self.__interval = interval
+
+    def start(self):
+        _ = SCHEDULER.call_later(self.__interval, self.__pass)
+
+    async def __pass(self):
+        now = time.monotonic()
+        try:
+            for room in list(self.__rooms.get_all()):
+                if room.pinned:
+                    continue
+                idle = room.idle_for(now)
+                if idle is None or idle < self.__idle_timeout:
+                    continue
+                LOGGER.info("reaping idle theater", id=room.id, idle=idle)
+                self.__rooms.remove(room.id)
+        finally:
+            _ = SCHEDULER.call_later(self.__interval, self.__pass)
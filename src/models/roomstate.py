@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -5,3 +7,5 @@ class RoomState(BaseModel):
     nowplaying: str
     position: float
     paused: bool
+    # who everyone follows, only ever set in FTL theaters
+    leader: Optional[str] = None
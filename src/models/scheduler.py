@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import time
+from asyncio import Event, Task, TimeoutError, create_task, wait_for
+from typing import Any, Callable, Coroutine, Final, Optional
+
+import structlog
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+
+Callback = Callable[[], Coroutine[None, None, Any]]
+
+
+class Deadline:
+    __slots__ = ("when", "callback", "cancelled")
+
+    when: float
+    callback: Callback
+    cancelled: bool
+
+    def __init__(self, when: float, callback: Callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+
+class Scheduler:
+    """
+    Process-wide deadline scheduler, every theater's timers live on the
+    same heap and are served by a single task that only wakes up when the
+    earliest deadline is due, or when an earlier one gets scheduled.
+
+    Cancelling is lazy, cancelled entries stay on the heap until they
+    either surface or the heap is compacted.
+    """
+
+    __heap: list[tuple[float, int, Deadline]]
+    __seq: "itertools.count[int]"
+    __cancelled: int = 0
+    __wakeup: Optional[Event] = None
+    __running: bool = False
+    __inflight: set[Task[Any]]
+
+    def __init__(self):
+        self.__heap = []
+        self.__seq = itertools.count()
+        self.__inflight = set()
+
+    def call_at(self, when: float, callback: Callback) -> Deadline:
+        deadline = Deadline(when, callback)
+        heapq.heappush(self.__heap, (when, next(self.__seq), deadline))
+        # only wake the runner up if it is now sleeping for too long
+        if self.__wakeup is not None and self.__heap[0][2] is deadline:
+            self.__wakeup.set()
+        return deadline
+
+    def call_later(self, delay: float, callback: Callback) -> Deadline:
+        return self.call_at(time.monotonic() + delay, callback)
+
+    def cancel(self, deadline: Deadline):
+        if deadline.cancelled:
+            return
+        deadline.cancelled = True
+        self.__cancelled += 1
+        if self.__cancelled > 64 and self.__cancelled > len(self.__heap) // 2:
+            self.__compact()
+
+    def reschedule(self, deadline: Deadline, when: float) -> Deadline:
+        self.cancel(deadline)
+        return self.call_at(when, deadline.callback)
+
+    def pending(self) -> int:
+        return len(self.__heap) - self.__cancelled
+
+    def __compact(self):
+        self.__heap = [entry for entry in self.__heap if not entry[2].cancelled]
+        heapq.heapify(self.__heap)
+        self.__cancelled = 0
+
+    def __fire(self, deadline: Deadline):
+        deadline.cancelled = True
+        task = create_task(deadline.callback())
+        self.__inflight.add(task)
+        task.add_done_callback(self.__finished)
+
+    def __finished(self, task: Task[Any]):
+        self.__inflight.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            LOGGER.error("scheduled callback failed", err=task.exception())
+
+    async def run(self):
+        self.__wakeup = Event()
+        self.__running = True
+        while self.__running:
+            now = time.monotonic()
+            while self.__heap and self.__heap[0][0] <= now:
+                _, _, deadline = heapq.heappop(self.__heap)
+                if deadline.cancelled:
+                    self.__cancelled -= 1
+                    continue
+                self.__fire(deadline)
+
+            timeout = None if not self.__heap else self.__heap[0][0] - now
+            self.__wakeup.clear()
+            try:
+                _ = await wait_for(self.__wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
+        self.__wakeup = None
+
+    def stop(self):
+        self.__running = False
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+
+
+SCHEDULER: Final[Scheduler] = Scheduler()
@@ -0,0 +1,12 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class StreamInfo(BaseModel):
+    # what a player can load as is, often signed and only good for a while
+    url: str
+    ext: str
+    format_id: str
+    # unix time the url stops working at, if it says so
+    expires_at: Optional[float] = None
@@ -0,0 +1,9 @@
+from enum import Enum
+
+
+class SyncMode(str, Enum):
+    # everyone follows the server's own playback clock
+    SERVER = "server"
+    # Follow-The-Leader, everyone follows the player of one occupant, and
+    # the server keeps its clock in line with what that player reports
+    LEADER = "leader"
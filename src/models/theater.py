@@ -1,26 +1,57 @@
+import bisect
+import itertools
 import random
 import time
 import weakref
-from asyncio import CancelledError, Task, create_task, sleep
+from asyncio import Event
 from collections import deque
 from dataclasses import dataclass, field
-from typing import Any, Callable, Coroutine, Final, Optional
+from typing import Any, Callable, Coroutine, Final, Iterable, Optional
 
+import structlog
 from fastapi import WebSocket
 from fastapi.datastructures import State
 from pydantic import BaseModel
 from sqids.sqids import Sqids
 
 from ..models.mediainfo import MediaInfo
+from ..models.playback import PlaybackClock
 from ..models.queueitem import QueueItem
+from ..models.queuesnapshot import QueueSnapshot
+from ..models.roomstate import RoomState
+from ..models.syncmode import SyncMode
+from ..rpc.codec import TEXT_CODEC, Codec, Frame
+from ..rpc.metrics import RPC_LATENCY
+from ..rpc.outbox import DEFAULT_WATERMARK, Outbox, OverflowPolicy
+from ..rpc.ratelimit import TokenBucket
 from ..rpc.responses.base import RPCResponse
+from ..rpc.responses.leader import Leader
 from ..rpc.responses.nowplaying import NowPlaying
+from ..rpc.responses.pausing import Pausing
+from ..rpc.responses.resuming import Resuming
+from ..rpc.responses.seeking import Seeking
+from ..rpc.responses.sync import Sync
+from ..models.scheduler import SCHEDULER, Deadline
 
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
 RNG: Final[random.SystemRandom] = random.SystemRandom()
 SQIDS_GEN: Final[Sqids] = Sqids(
     alphabet="ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", min_length=4
 )
 MAX_QUEUE_LEN: Final[int] = 100
+# extra time given to clients to finish up the media before moving on
+MEDIA_END_GRACE: Final[float] = 5.0
+DEFAULT_SYNC_INTERVAL: Final[float] = 5.0
+DEFAULT_PAGE_LIMIT: Final[int] = 50
+MAX_PAGE_LIMIT: Final[int] = 500
+NEXT_CURSOR_HEADER: Final[str] = "X-Next-Cursor"
+# how many changes to theaters are remembered for the change feed
+CHANGELOG_LEN: Final[int] = 4096
+# how many broadcasts a theater keeps around for clients to catch up on
+DEFAULT_EVENT_BUFFER_LEN: Final[int] = 256
+# how long playback changes are batched up after one went out, so a
+# burst of them is settled and sent on as one
+DEFAULT_COALESCE_WINDOW: Final[float] = 0.05
 
 
 class TheaterMinimal(BaseModel):
@@ -32,12 +63,16 @@ class TheaterMinimal(BaseModel):
 
 
 class Timer:
+    """
+    Media-end countdown for a single theater, backed by a deadline on the
+    shared `SCHEDULER` rather than a task of its own.
+    """
+
     __wait_time: float
     __callback: Optional[Callable[[], Coroutine[None, None, Any]]] = None
-    __waiter: Optional[Task[None]] = None
+    __deadline: Optional[Deadline] = None
     __started_at: float = 0.0
-    __paused_at: float = 0.0
-    __done: bool = False
+    __paused: bool = False
 
     def __init__(
         self,
@@ -47,75 +82,50 @@ class Timer:
 
     def set_callback(
         self,
-        callback: Callable[[], Coroutine[None, None, Any]],
+        callback: Optional[Callable[[], Coroutine[None, None, Any]]],
     ):
         self.__callback = callback
 
     def start(self):
-        async def __wrapped_timer(
-            delay: float,
-        ):
-            try:
-                await sleep(delay)
-            except CancelledError as e:
-                raise e
-            if self.__callback is not None:
-                await self.__callback()
-
-        def __set_done(ctx: Task[None]):
-            self.__done = True
+        self.abort()
+        self.__paused = False
+        self.__started_at = time.monotonic()
+        self.__deadline = SCHEDULER.call_at(
+            self.__started_at + self.__wait_time, self.__fire
+        )
 
-        self.__waiter = create_task(__wrapped_timer(self.__wait_time))
-        self.__waiter.add_done_callback(__set_done, context=None)
-        self.__started_at = time.time()
+    async def __fire(self):
+        self.__deadline = None
+        if self.__callback is not None:
+            await self.__callback()
 
     def pause(self):
-        if self.__waiter is None or self.__waiter.done() or self.__waiter.cancelled():
+        if self.__deadline is None:
             return
-        if not self.__waiter.cancel():
-            raise Exception("Timer could not be paused")
-        self.__waiter = None
-        self.__paused_at = time.time()
+        SCHEDULER.cancel(self.__deadline)
+        self.__deadline = None
+        self.__wait_time -= time.monotonic() - self.__started_at
+        self.__paused = True
 
     def resume(self):
-        if (
-            (
-                self.__waiter is None
-                and self.__paused_at == 0.0
-                and self.__started_at == 0.0
-            )
-            or (self.__waiter is not None and self.__waiter.done())
-            or (self.__waiter is not None and self.__waiter.cancelled())
-        ):
+        if not self.__paused:
             return
-        self.__wait_time = self.__wait_time - (self.__paused_at - self.__started_at)
-        self.__started_at = 0.0
-        self.__paused_at = 0.0
         self.start()
 
     def elapsed(self) -> float:
-        return time.time() - self.__started_at
+        return time.monotonic() - self.__started_at
 
     def abort(self):
-        if self.__waiter is None or self.__waiter.done() or self.__waiter.cancelled():
+        if self.__deadline is None:
             return
-        _ = self.__waiter.cancel()
-        self.__waiter = None
+        SCHEDULER.cancel(self.__deadline)
+        self.__deadline = None
 
     def reschedule(self, wait_time: float):
         self.abort()
+        self.__paused = False
         self.__wait_time = wait_time
 
-    async def wait_until_done(self):
-        if self.__waiter is None:
-            # NOTE: if we don't wait here it'll act as a spinlock instead.
-            # which essential will just burn a CPU core.
-            await sleep(1)
-            return
-        print(f"waiting for: {self.__wait_time}")
-        await self.__waiter
-        self.__waiter = None
-
 
 @dataclass
 class Theater:
@@ -123,110 +133,669 @@ class Theater:
     name: str
     passwd: Optional[str]
     auth_req: bool
-    id: str = SQIDS_GEN.encode([RNG.randrange(0, 9999)])
+    # left empty for a random one
+    id: str = ""
     seats: int = 2
     occupants: list[WebSocket] = field(default_factory=list)
     usernames: list[str] = field(default_factory=list)
-    paused: bool = False
+    clock: PlaybackClock = field(default_factory=PlaybackClock)
     queue: deque[QueueItem] = deque([], maxlen=MAX_QUEUE_LEN)
     nowplaying: Optional[QueueItem] = None
     scheduler: Timer = Timer(-0.0)
+    sync_interval: float = DEFAULT_SYNC_INTERVAL
+    # pinned theaters are never reaped, no matter how long they sit empty
+    pinned: bool = False
+    # whose idea of the playback everyone follows
+    mode: SyncMode = SyncMode.SERVER
+    # in FTL theaters, the occupant whose player everyone follows
+    leader: Optional[str] = field(default=None, init=False)
+    closed: bool = field(default=False, init=False)
+    # set by the manager, to keep its indexes up to date
+    on_change: Optional[Callable[["Theater"], None]] = field(
+        default=None, init=False, repr=False
+    )
+    on_playback: Optional[Callable[["Theater"], None]] = field(
+        default=None, init=False, repr=False
+    )
+    # what the occupants were last told by a SYNC heartbeat
+    __synced_epoch: int = field(default=-1, init=False, repr=False)
+    __synced_position: float = field(default=0.0, init=False, repr=False)
+    __synced_at: float = field(default=0.0, init=False, repr=False)
+    __next_sync_at: float = field(default=0.0, init=False, repr=False)
+    # whether the leader reported since the last heartbeat went out
+    __reported: bool = field(default=False, init=False, repr=False)
+    __queue_version: int = field(default=0, init=False, repr=False)
+    # lamport clock the queue items are stamped with, ahead of every
+    # stamp this node has seen so far
+    __lamport: int = field(default=0, init=False, repr=False)
+    # stamp of the election the leader came out of, the latest one wins
+    # on every node, and the node with the greater name if they tie
+    __leader_stamp: tuple[int, str] = field(default=(0, ""), init=False, repr=False)
+    __queue_snapshot: Optional[QueueSnapshot] = field(
+        default=None, init=False, repr=False
+    )
+    # whether this node started the current media, and so is the one
+    # moving the theater on to the next one once it is over
+    __timekeeper: bool = field(default=False, init=False, repr=False)
+    __idle_since: float = field(default_factory=time.monotonic, init=False, repr=False)
+    # broadcasts are numbered, the number goes out in the place of the rid,
+    # and the latest ones are kept for clients that lost their connection.
+    # the numbering starts over in a new stream whenever the theater is
+    # set up anew, in another process or on another node.
+    seq: int = field(default=0, init=False)
+    stream: str = field(default="", init=False)
+    __events: deque[tuple[int, str, str]] = field(
+        default_factory=deque, init=False, repr=False
+    )
+    # shared by the requests of all occupants that are broadcast
+    throttle: Optional[TokenBucket] = field(default=None, init=False, repr=False)
+    # the end of the window playback changes are being batched up in, the
+    # latest of the broadcasts held back since it opened, and whether the
+    # clock was moved without the media end and the journal catching up
+    __coalescing: Optional[Deadline] = field(default=None, init=False, repr=False)
+    __held_playback: Optional[RPCResponse] = field(
+        default=None, init=False, repr=False
+    )
+    __held_seek: Optional[Seeking] = field(default=None, init=False, repr=False)
+    __unsettled: bool = field(default=False, init=False, repr=False)
 
     # HACK: getting around python's instantiation model on dataclasses
     def __post_init__(self):
-        self.id = SQIDS_GEN.encode([RNG.randrange(0, 9999)])
+        if not self.id:
+            self.id = SQIDS_GEN.encode([RNG.randrange(0, 9999)])
         self.scheduler = Timer(-0.0)
         self.queue = deque([], maxlen=MAX_QUEUE_LEN)
+        self.stream = f"{RNG.getrandbits(32):08x}"
+        self.__events = deque(
+            [],
+            maxlen=getattr(self.appstate, "event_buffer_len", DEFAULT_EVENT_BUFFER_LEN),
+        )
+        limits = getattr(self.appstate, "rate_limits", None)
+        if limits is not None:
+            self.throttle = limits.for_theater(time.monotonic())
+
+    @property
+    def paused(self) -> bool:
+        return self.clock.paused()
 
     def enter(self, occupant: WebSocket):
+        outbox = Outbox(
+            occupant,
+            watermark=getattr(self.appstate, "outbox_watermark", DEFAULT_WATERMARK),
+            policy=getattr(self.appstate, "outbox_policy", OverflowPolicy.DISCONNECT),
+            codec=getattr(occupant.state, "codec", TEXT_CODEC),
+        )
+        outbox.start()
+        occupant.state.outbox = outbox
+        limits = getattr(self.appstate, "rate_limits", None)
+        if limits is not None:
+            occupant.state.limiter = limits.for_connection(time.monotonic())
         self.occupants.append(occupant)
+        if self.on_change is not None:
+            self.on_change(self)
 
     def leave(self, occupant: WebSocket):
         self.occupants.remove(occupant)
+        occupant.state.outbox.close()
+        username = getattr(occupant.state, "username", None)
+        if username in self.usernames:
+            self.unseat(username)
+        if len(self.occupants) == 0:
+            self.__idle_since = time.monotonic()
+        if self.on_change is not None:
+            self.on_change(self)
+
+    # how long the theater has been sitting empty, if it is
+    def idle_for(self, now: float) -> Optional[float]:
+        if len(self.occupants) != 0:
+            return None
+        return now - self.__idle_since
+
+    # lets go of everything the theater still holds on to, after
+    # it was taken out of the manager
+    def close(self):
+        self.closed = True
+        self.scheduler.abort()
+        # the timer holds on to the theater through its callback
+        self.scheduler.set_callback(None)
+        if self.__coalescing is not None:
+            SCHEDULER.cancel(self.__coalescing)
+            self.__coalescing = None
+        self.__unsettled = False
+        self.clock.stop()
+        self.nowplaying = None
+        self.queue.clear()
+        self.__queue_snapshot = None
+        replicator = getattr(self.appstate, "replicator", None)
+        if replicator is not None:
+            replicator.forget(self.id)
 
     def seated(self, username: str):
         self.usernames.append(username)
+        if self.mode is SyncMode.LEADER and self.leader is None:
+            self.__lead(username)
 
     def unseat(self, username: str):
         self.usernames.remove(username)
+        # the one who has been seated the longest takes over
+        if username == self.leader and username not in self.usernames:
+            self.__lead(self.usernames[0] if self.usernames else None)
 
-    async def main_loop(self):
-        try:
-            while self.appstate.running:
-                try:
-                    await self.scheduler.wait_until_done()
-                except CancelledError as e:
-                    print(e)
-                finally:
-                    continue
-        except KeyboardInterrupt:
-            print("loop killed")
+    def handover(self, username: str):
+        if username != self.leader:
+            self.__lead(username)
+
+    # leadership only lasts as long as the connections, so it is
+    # passed on to the other nodes but never journaled
+    def __lead(self, username: Optional[str]):
+        replicator = getattr(self.appstate, "replicator", None)
+        stamp = (
+            self.__leader_stamp[0] + 1,
+            "" if replicator is None else replicator.node,
+        )
+        self.__elected(username, stamp)
+        if replicator is not None:
+            replicator.publish(
+                self.id, "leader", {"user": username, "stamp": list(stamp)}
+            )
+
+    # every node tells its own occupants, so the ones that lost an
+    # election never hear about their own pick from the others
+    def __elected(self, username: Optional[str], stamp: tuple[int, str]):
+        self.__leader_stamp = stamp
+        if username == self.leader:
+            return
+        self.leader = username
+        data = Leader(_rid=0, user=username)
+        data.set_rid(self.__number(data._method, data.payload()))
+        self.__fanout(data)
+
+    # takes the leader's word for where the playback is at. the clock is
+    # only re-anchored when the leader paused or resumed, or is further
+    # off than `drift`, so the reports of a leader that is just watching
+    # along cost a comparison. either way, the next heartbeat passes the
+    # position on, which is what keeps the followers from ever having to
+    # ask the leader themselves.
+    def report(self, position: float, paused: bool, drift: float):
+        if self.nowplaying is None:
             return
+        self.__reported = True
+        if paused:
+            self.pause_media()
+        else:
+            self.resume_media()
+        if abs(self.clock.position() - position) > drift:
+            self.seek_media(min(max(position, 0.0), self.clock.duration()))
+        self.__playback_changed()
 
+    # serializes the opcode only once per codec, and hands the frame to
+    # each occupant's outbox, this never waits on any of the sockets.
     async def broadcast_opcode(self, data: RPCResponse):
-        # TODO: convert this to a TaskGroup in py 3.11
-        # evloop = get_running_loop()
-        # tasks: list[Task[None]] = []
+        self.__broadcast(data)
+
+    def __broadcast(self, data: RPCResponse):
+        started = time.perf_counter()
+        data.set_rid(self.__number(data._method, data.payload()))
+        self.__fanout(data)
+        RPC_LATENCY.observe(time.perf_counter() - started, "broadcast", data._method)
+        replicator = getattr(self.appstate, "replicator", None)
+        if replicator is not None:
+            replicator.publish(
+                self.id,
+                "broadcast",
+                {"method": data._method, "payload": data.payload()},
+            )
+
+    # PAUSING, RESUMING and SEEKING. the first of a burst goes out right
+    # away and opens a window, the changes made while it is open only move
+    # the clock, and once it closes the media end and the journal are
+    # brought up to date once, and the state the playback was left in is
+    # broadcast. that is a single PAUSING or SEEKING with the position the
+    # clock is at, or a RESUMING, followed by a SEEKING if it was moved.
+    async def broadcast_playback(self, data: RPCResponse):
+        window = getattr(self.appstate, "coalesce_window", DEFAULT_COALESCE_WINDOW)
+        if window <= 0:
+            return await self.broadcast_opcode(data)
+        if self.__coalescing is None:
+            await self.broadcast_opcode(data)
+            self.__coalescing = SCHEDULER.call_later(window, self.__release)
+            return
+        if isinstance(data, Seeking):
+            self.__held_seek = data
+        else:
+            self.__held_playback = data
+
+    async def __release(self):
+        self.__coalescing = None
+        self.__settle()
+        playback, seek = self.__held_playback, self.__held_seek
+        if playback is None and seek is None:
+            return
+        self.__held_playback = None
+        self.__held_seek = None
+        if self.nowplaying is None:
+            # nothing to take the position from, send them on as they were
+            for held in (playback, seek):
+                if held is not None:
+                    await self.broadcast_opcode(held)
+        elif playback is not None and self.paused:
+            await self.broadcast_opcode(Pausing(position=self.clock.position()))
+        else:
+            if playback is not None:
+                await self.broadcast_opcode(Resuming())
+            if seek is not None:
+                await self.broadcast_opcode(Seeking(position=self.clock.position()))
+        # keep batching for as long as the burst goes on
+        window = getattr(self.appstate, "coalesce_window", DEFAULT_COALESCE_WINDOW)
+        self.__coalescing = SCHEDULER.call_later(window, self.__release)
+
+    # while a window is open, the playback changes leave the media end and
+    # the journal to be brought up to date once it closes
+    def __batching(self) -> bool:
+        if self.__coalescing is None:
+            return False
+        self.__unsettled = True
+        return True
+
+    # one reschedule and one record for the whole batch, the state the
+    # playback is in now is all the other nodes and the journal need
+    def __settle(self):
+        if not self.__unsettled:
+            return
+        self.__unsettled = False
+        if self.nowplaying is None:
+            return
+        if self.paused:
+            self.scheduler.abort()
+            self.__record("pause", {"position": self.clock.position()})
+        else:
+            self.__schedule_media_end()
+            self.__record("resume", {"position": self.clock.position()})
+
+    def __fanout(self, data: RPCResponse):
+        for occupant in self.occupants:
+            outbox: Outbox = occupant.state.outbox
+            _ = outbox.push(data.frame_for(outbox.codec))
+
+    # same as above, for opcodes relayed from another node
+    def __fanout_raw(self, method: str, payload: str):
+        started = time.perf_counter()
+        seq = self.__number(method, payload)
+        frames: dict[bool, Frame] = {}
         for occupant in self.occupants:
-            await data.send(occupant)
-            # tasks.append(evloop.create_task(data.send(occupant)))
-        # _ = await gather(*tasks)
+            outbox: Outbox = occupant.state.outbox
+            frame = frames.get(outbox.codec.binary)
+            if frame is None:
+                frame = outbox.codec.encode(seq, method, payload)
+                frames[outbox.codec.binary] = frame
+            _ = outbox.push(frame)
+        RPC_LATENCY.observe(time.perf_counter() - started, "broadcast", method)
+
+    def __number(self, method: str, payload: str) -> int:
+        self.seq += 1
+        self.__events.append((self.seq, method, payload))
+        return self.seq
+
+    # the broadcasts that came after `seq`, framed for `codec`, or None
+    # when some of them are not kept around anymore
+    def events_since(self, seq: int, codec: Codec) -> Optional[list[Frame]]:
+        missed = self.seq - seq
+        if missed < 0 or missed > len(self.__events):
+            return None
+        return [
+            codec.encode(*event)
+            for event in itertools.islice(
+                self.__events, len(self.__events) - missed, None
+            )
+        ]
+
+    # hands a mutation to the other nodes and to the journal on disk
+    def __record(self, kind: str, data: dict[str, Any]):
+        replicator = getattr(self.appstate, "replicator", None)
+        if replicator is not None:
+            replicator.publish(self.id, kind, data)
+        self.__journal(kind, data)
+
+    def __journal(self, kind: str, data: dict[str, Any]):
+        journal = getattr(self.appstate, "journal", None)
+        if journal is not None:
+            journal.record(self.id, kind, data)
 
     # sets the current media from FIFO queue
     # only call this when the media is finished or
     # you want to force the media to change
     async def pop_queue(self):
+        self.__timekeeper = True
         if len(self.queue) == 0:
-            self.nowplaying = None
-            # QUEST: should we do something with the scheduler here?
+            self.__play(None)
+            self.__record("pop", {"item": None})
             return
 
-        self.nowplaying = self.queue.popleft()
-        self.scheduler.reschedule(self.nowplaying.media.duration + 5.0)
+        self.__play(self.queue.popleft())
+        assert self.nowplaying is not None
+        self.__record("pop", {"item": self.nowplaying.model_dump()})
         self.scheduler.set_callback(self.pop_queue)
-        await self.broadcast_opcode(NowPlaying(_rid=0, media=None))
+        await self.broadcast_opcode(self.__now_playing())
         self.scheduler.start()
 
+    # tells everyone about the media that just came up, together with its
+    # stream and those of the items after it, as far as they were
+    # prefetched, so nobody has to resolve them when the media changes
+    def __now_playing(self) -> NowPlaying:
+        assert self.nowplaying is not None
+        url = self.nowplaying.media.url
+        prefetcher = getattr(self.appstate, "prefetcher", None)
+        if prefetcher is None:
+            return NowPlaying(_rid=0, media=url)
+        return NowPlaying(
+            _rid=0,
+            media=url,
+            stream=prefetcher.get(url),
+            upcoming=[
+                prefetcher.get(item.media.url)
+                for item in itertools.islice(self.queue, prefetcher.depth)
+            ],
+        )
+
+    def __play(self, item: Optional[QueueItem]):
+        self.nowplaying = item
+        # whatever was batched up was about the media before this one
+        self.__held_playback = None
+        self.__held_seek = None
+        self.__unsettled = False
+        if item is None:
+            self.clock.stop()
+            self.scheduler.abort()
+            self.__playback_changed()
+            return
+        self.__queue_changed()
+        self.clock.start(item.media.duration)
+        self.scheduler.reschedule(item.media.duration + MEDIA_END_GRACE)
+        self.__playback_changed()
+
     async def enqueue(self, url: str, title: str, duration: float, submitted_by: str):
-        self.queue.append(
-            QueueItem(
-                media=MediaInfo(url=url, title=title, duration=duration),
-                submitted_by=submitted_by,
-            )
+        replicator = getattr(self.appstate, "replicator", None)
+        self.__lamport += 1
+        item = QueueItem(
+            media=MediaInfo(url=url, title=title, duration=duration),
+            submitted_by=submitted_by,
+            stamp=(self.__lamport, "" if replicator is None else replicator.node),
+        )
+        self.__insert(item)
+        self.__queue_changed()
+        self.__record("enqueue", {"item": item.model_dump()})
+        LOGGER.debug(
+            "enqueued media", theater=self.id, url=url, queue_len=len(self.queue)
         )
-        print(self.queue)
         if self.nowplaying is None:
             await self.pop_queue()
 
     def deque(self, index: int):
         try:
-            del self.queue[index]
+            item = self.queue[index]
         except IndexError:
             return
+        del self.queue[index]
+        self.__queue_changed()
+        self.__record("deque", {"index": index, "stamp": item.stamp})
+
+    # the queue is kept in the order of the stamps, which makes it come out
+    # the same on every node, whatever order the enqueues got to it in. a
+    # local enqueue is stamped after everything seen, and so appended.
+    def __insert(self, item: QueueItem):
+        self.__lamport = max(self.__lamport, item.stamp[0])
+        index = bisect.bisect([queued.stamp for queued in self.queue], item.stamp)
+        if len(self.queue) == self.queue.maxlen:
+            # same as appending to a full queue, the oldest item goes
+            if index == 0:
+                return
+            _ = self.queue.popleft()
+            index -= 1
+        self.queue.insert(index, item)
+
+    def __queue_changed(self):
+        self.__queue_version += 1
+        self.__queue_snapshot = None
+
+    # the snapshot is only rebuilt on the first call after the queue
+    # changed, everything in between gets the very same object
+    def queue_snapshot(self) -> QueueSnapshot:
+        if self.__queue_snapshot is None:
+            self.__queue_snapshot = QueueSnapshot(
+                tuple(self.queue), self.__queue_version
+            )
+        return self.__queue_snapshot
 
     def pause_media(self) -> None:
         if self.paused:
             return
         if self.nowplaying is None:
             return
-        self.scheduler.pause()
-        self.paused = True
+        self.clock.pause()
+        self.__playback_changed()
+        if self.__batching():
+            return
+        self.scheduler.abort()
+        self.__record("pause", {"position": self.clock.position()})
 
     def resume_media(self) -> None:
         if not self.paused:
             return
         if self.nowplaying is None:
             return
-        self.scheduler.resume()
-        self.paused = False
+        self.clock.resume()
+        self.__playback_changed()
+        if self.__batching():
+            return
+        self.__schedule_media_end()
+        self.__record("resume", {"position": self.clock.position()})
 
     def seek_media(self, position: float) -> None:
         if self.nowplaying is None:
             return
+        self.clock.seek(position)
+        if self.__batching():
+            return
+        # a paused theater gets its deadline back once it resumes
+        if not self.paused:
+            self.__schedule_media_end()
+        self.__record("seek", {"position": self.clock.position()})
+
+    # replays a mutation made on another node, together with the opcodes
+    # it broadcasted to its occupants. none of these get replicated again,
+    # but the mutations do go to the journal like the local ones.
+    def apply(self, kind: str, data: dict[str, Any]):
+        if kind == "broadcast":
+            self.__fanout_raw(data["method"], data["payload"])
+            return
+        if kind == "leader":
+            stamp = tuple(data.get("stamp", (0, "")))
+            # an election that lost against the latest one seen here
+            if stamp <= self.__leader_stamp:
+                return
+            self.__elected(data["user"], stamp)
+            # nodes taking over from a leader that left all do so at once,
+            # the stamps leave them with the pick of just one of them
+            if self.leader is None and self.usernames:
+                self.__lead(self.usernames[0])
+            return
+        if kind == "enqueue":
+            self.__insert(QueueItem.model_validate(data["item"]))
+            self.__queue_changed()
+        elif kind == "deque":
+            index = self.__dequeued(data)
+            if index is None:
+                return
+            del self.queue[index]
+            self.__queue_changed()
+        elif kind == "pop":
+            item = data["item"]
+            if item is not None:
+                item = QueueItem.model_validate(item)
+                if item in self.queue:
+                    self.queue.remove(item)
+            # the media end is left to the node that started it
+            self.__timekeeper = False
+            self.__play(item)
+            self.scheduler.abort()
+        elif kind == "pause":
+            self.clock.pause()
+            self.clock.seek(data["position"])
+            self.scheduler.abort()
+            self.__playback_changed()
+        elif kind == "resume":
+            self.clock.seek(data["position"])
+            self.clock.resume()
+            self.__schedule_media_end()
+            self.__playback_changed()
+        elif kind == "seek":
+            self.clock.seek(data["position"])
+            if not self.paused:
+                self.__schedule_media_end()
+        else:
+            raise ValueError(f"unknown mutation {kind}")
+        self.__journal(kind, data)
+
+    # where the item a replicated deque was about is, found by its stamp
+    # rather than by the index it had on the node it came from
+    def __dequeued(self, data: dict[str, Any]) -> Optional[int]:
+        stamp = data.get("stamp")
+        if stamp is None:
+            # journals from before the items were stamped
+            index: int = data["index"]
+            return index if -len(self.queue) <= index < len(self.queue) else None
+        stamp = tuple(stamp)
+        for index, item in enumerate(self.queue):
+            if item.stamp == stamp:
+                return index
+        # it was already dequeued or played here
+        return None
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "queue": [item.model_dump() for item in self.queue],
+            "nowplaying": (
+                None if self.nowplaying is None else self.nowplaying.model_dump()
+            ),
+            "position": self.clock.position(),
+            "paused": self.paused,
+        }
+
+    # takes over another node's state wholesale, after having missed some
+    # of its mutations, and tells the occupants here where playback is at
+    def restore(self, state: dict[str, Any]):
+        self.reset(
+            [QueueItem.model_validate(item) for item in state["queue"]],
+            (
+                None
+                if state["nowplaying"] is None
+                else QueueItem.model_validate(state["nowplaying"])
+            ),
+            state["position"],
+            state["paused"],
+        )
+        self.__journal("restore", state)
+        # the broadcasts so far don't add up to the new state anymore,
+        # anyone catching up from before here needs all of it again
+        self.seq += 1
+        self.__events.clear()
+        if self.nowplaying is not None:
+            self.__fanout(Sync(position=self.clock.position(), paused=self.paused))
+
+    def reset(
+        self,
+        queue: Iterable[QueueItem],
+        nowplaying: Optional[QueueItem],
+        position: float,
+        paused: bool,
+    ):
+        self.queue = deque(queue, maxlen=MAX_QUEUE_LEN)
+        self.__queue_changed()
+        for item in self.queue:
+            self.__lamport = max(self.__lamport, item.stamp[0])
+        self.__timekeeper = False
         self.scheduler.abort()
-        self.scheduler.reschedule((self.nowplaying.media.duration - position) + 5.0)
+        self.nowplaying = nowplaying
+        if nowplaying is None:
+            self.clock.stop()
+        else:
+            self.clock.start(nowplaying.media.duration, position)
+            if paused:
+                self.clock.pause()
+        self.__playback_changed()
+
+    # picks playback back up once the state was read back from disk, `lag`
+    # being how long ago the clock was re-anchored for the last time
+    def recover(self, lag: float):
+        if self.nowplaying is None:
+            return
+        self.__timekeeper = True
+        self.scheduler.set_callback(self.pop_queue)
+        if not self.paused:
+            self.clock.seek(self.clock.position() + lag)
+            self.__schedule_media_end()
+
+    def __schedule_media_end(self):
+        if not self.__timekeeper:
+            return
+        self.scheduler.reschedule(self.clock.remaining() + MEDIA_END_GRACE)
         self.scheduler.start()
 
+    # sends a SYNC heartbeat if this theater is due for one, and its
+    # occupants' idea of the position could be off. that is only the case
+    # when the clock was re-anchored, or it moved away from where the
+    # last heartbeat said it would be by more than the drift threshold.
+    # in FTL theaters, a heartbeat also goes out whenever the leader
+    # reported since the last one, however many reports that was.
+    async def sync(self, now: float, drift: float):
+        if now < self.__next_sync_at:
+            return
+        self.__next_sync_at = now + self.sync_interval
+        reported, self.__reported = self.__reported, False
+        if reported and self.paused:
+            # nothing is left to tell until it is played again
+            self.__playback_changed()
+        if self.nowplaying is None or len(self.occupants) == 0:
+            return
+
+        position = self.clock.position()
+        if not reported and self.clock.epoch == self.__synced_epoch:
+            expected = self.__synced_position
+            if not self.paused:
+                expected += now - self.__synced_at
+            expected = min(expected, self.clock.duration())
+            if abs(position - expected) <= drift:
+                return
+
+        self.__synced_epoch = self.clock.epoch
+        self.__synced_position = position
+        self.__synced_at = now
+        # every node sends its own heartbeats
+        self.__fanout(Sync(position=position, paused=self.paused))
+
+    # whether the heartbeats have anything to keep up to date, that is
+    # while the media is playing, or the leader moved it while paused
+    def heartbeating(self) -> bool:
+        return (
+            self.nowplaying is not None
+            and len(self.occupants) != 0
+            and (not self.paused or self.__reported)
+        )
+
+    def __playback_changed(self):
+        if self.on_playback is not None:
+            self.on_playback(self)
+
+    # exact state of the playback right now, this is O(1) and
+    # can be computed for every join or sync without any worries
+    def room_state(self) -> RoomState:
+        return RoomState(
+            nowplaying="" if self.nowplaying is None else self.nowplaying.media.url,
+            position=self.clock.position() if self.nowplaying is not None else -0.0,
+            paused=self.paused,
+            leader=self.leader,
+        )
+
     # reductive data reference, used for providing information
     # on the theater.
     def as_minimal(self) -> TheaterMinimal:
@@ -240,11 +809,69 @@ class Theater:
 
 
 class TheaterManager:
-    __theaters: dict[str, Theater] = {}
+    """
+    Owns every theater of this process, and keeps the indexes the lobby
+    gets filtered by up to date as theaters come, go and fill up. Each
+    theater's minimal view is serialized once per change, rather than
+    once per listing.
+    """
+
+    __theaters: dict[str, Theater]
+    __owns: Optional[Callable[[str], bool]]
+    # every index only holds ids, the listing order is by id
+    __ids: list[str]
+    __names: list[tuple[str, str]]
+    __by_auth: dict[bool, set[str]]
+    __by_occupancy: dict[int, set[str]]
+    __by_free: dict[bool, set[str]]
+    __occupancy: dict[str, int]
+    # the theaters the SYNC heartbeats are going out in
+    __playing: set[str]
+    __views: dict[str, str]
+    # bumped on every change to any theater's minimal view. the versions
+    # start over with every process, the epoch tells them apart
+    version: int = 0
+    epoch: str
+    __versions: dict[str, int]
+    __changelog: deque[tuple[int, str]]
+    __wakeup: Optional[Event] = None
+
+    # `owns` decides which theater ids belong to this process, when the
+    # theaters are sharded over multiple workers
+    def __init__(self, owns: Optional[Callable[[str], bool]] = None):
+        self.__theaters = {}
+        self.__owns = owns
+        self.__ids = []
+        self.__names = []
+        self.__by_auth = {True: set(), False: set()}
+        self.__by_occupancy = {}
+        self.__by_free = {True: set(), False: set()}
+        self.__occupancy = {}
+        self.__playing = set()
+        self.__views = {}
+        self.__versions = {}
+        self.__changelog = deque([], maxlen=CHANGELOG_LEN)
+        self.epoch = f"{RNG.getrandbits(32):08x}"
 
     def insert(self, theater: Theater) -> None:
+        # reroll the id until it lands on this shard
+        while theater.id in self.__theaters or (
+            self.__owns is not None and not self.__owns(theater.id)
+        ):
+            theater.id = SQIDS_GEN.encode([RNG.randrange(0, 9999)])
         id = theater.id
         self.__theaters[id] = theater
+        bisect.insort(self.__ids, id)
+        bisect.insort(self.__names, (theater.name.casefold(), id))
+        self.__by_auth[theater.auth_req].add(id)
+        self.__index_occupancy(theater)
+        self.__index_playback(theater)
+        theater.on_change = self.__changed
+        theater.on_playback = self.__index_playback
+        self.__bump(id)
+        journal = getattr(theater.appstate, "journal", None)
+        if journal is not None:
+            journal.created(theater)
 
     def get(self, id: str) -> weakref.ReferenceType[Theater]:
         if id not in self.__theaters:
@@ -253,3 +880,157 @@ class TheaterManager:
 
     def get_all(self):
         return self.__theaters.values()
+
+    def remove(self, id: str) -> None:
+        theater = self.__theaters.pop(id, None)
+        if theater is None:
+            raise IndexError("no room with that id")
+        theater.on_change = None
+        theater.on_playback = None
+        self.__playing.discard(id)
+        del self.__ids[bisect.bisect_left(self.__ids, id)]
+        del self.__names[
+            bisect.bisect_left(self.__names, (theater.name.casefold(), id))
+        ]
+        self.__by_auth[theater.auth_req].discard(id)
+        self.__unindex_occupancy(id)
+        del self.__versions[id]
+        self.__bump(id)
+        journal = getattr(theater.appstate, "journal", None)
+        if journal is not None:
+            journal.record(id, "remove", {})
+        theater.close()
+
+    # the theaters with occupants that are watching something right now
+    def playing(self) -> list[Theater]:
+        return [self.__theaters[id] for id in self.__playing]
+
+    def __len__(self) -> int:
+        return len(self.__theaters)
+
+    # serialized `TheaterMinimal` of the theater, as of its last change
+    def view(self, id: str) -> str:
+        return self.__views[id]
+
+    # version of the last change to a single theater's minimal view
+    def version_of(self, id: str) -> int:
+        return self.__versions[id]
+
+    # ids of the theaters changed and removed since a version, or None if
+    # that is too long ago to tell, or was never handed out by this manager
+    def changes(self, since: int) -> Optional[tuple[list[str], list[str]]]:
+        if since > self.version:
+            return None
+        if since == self.version:
+            return [], []
+        if not self.__changelog or self.__changelog[0][0] > since + 1:
+            return None
+        ids: dict[str, None] = {}
+        for version, id in reversed(self.__changelog):
+            if version <= since:
+                break
+            ids[id] = None
+        changed = [id for id in ids if id in self.__theaters]
+        removed = [id for id in ids if id not in self.__theaters]
+        return changed, removed
+
+    # waits until there was a change after the given version
+    async def wait(self, since: int):
+        while self.version <= since:
+            if self.__wakeup is None:
+                self.__wakeup = Event()
+            _ = await self.__wakeup.wait()
+
+    def __bump(self, id: str):
+        self.version += 1
+        if id in self.__theaters:
+            self.__versions[id] = self.version
+        self.__changelog.append((self.version, id))
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+            self.__wakeup = None
+
+    # ids of up to `limit` theaters after the `cursor` id that match all of
+    # the given filters, and the cursor of the next page if there is one
+    def query(
+        self,
+        *,
+        cursor: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_LIMIT,
+        auth_req: Optional[bool] = None,
+        free: Optional[bool] = None,
+        prefix: Optional[str] = None,
+        min_occupancy: Optional[int] = None,
+    ) -> tuple[list[str], Optional[str]]:
+        filters: list[set[str]] = []
+        if auth_req is not None:
+            filters.append(self.__by_auth[auth_req])
+        if free is not None:
+            filters.append(self.__by_free[free])
+        if prefix is not None:
+            filters.append(self.__with_prefix(prefix.casefold()))
+        if min_occupancy is not None and min_occupancy > 0:
+            filters.append(
+                set().union(
+                    *[
+                        ids
+                        for occupancy, ids in self.__by_occupancy.items()
+                        if occupancy >= min_occupancy
+                    ]
+                )
+            )
+
+        start = 0 if cursor is None else bisect.bisect_right(self.__ids, cursor)
+        filters.sort(key=len)
+        if filters and len(filters[0]) < len(self.__ids) - start:
+            # the most selective filter is smaller than what is left to
+            # walk, so only its own ids have to be sorted and checked
+            candidates: Iterable[str] = sorted(
+                id for id in filters[0] if cursor is None or id > cursor
+            )
+            filters = filters[1:]
+        else:
+            candidates = itertools.islice(self.__ids, start, None)
+
+        ids: list[str] = []
+        for id in candidates:
+            if all(id in index for index in filters):
+                if len(ids) == limit:
+                    return ids, ids[-1]
+                ids.append(id)
+        return ids, None
+
+    def __with_prefix(self, prefix: str) -> set[str]:
+        lo = bisect.bisect_left(self.__names, (prefix,))
+        hi = bisect.bisect_left(self.__names, (prefix + "\U0010ffff",))
+        return {id for _, id in self.__names[lo:hi]}
+
+    def __changed(self, theater: Theater):
+        self.__unindex_occupancy(theater.id)
+        self.__index_occupancy(theater)
+        self.__index_playback(theater)
+        self.__bump(theater.id)
+
+    def __index_playback(self, theater: Theater):
+        if theater.heartbeating():
+            self.__playing.add(theater.id)
+        else:
+            self.__playing.discard(theater.id)
+
+    def __index_occupancy(self, theater: Theater):
+        id = theater.id
+        occupancy = len(theater.occupants)
+        self.__occupancy[id] = occupancy
+        self.__by_occupancy.setdefault(occupancy, set()).add(id)
+        self.__by_free[occupancy < theater.seats].add(id)
+        self.__views[id] = theater.as_minimal().model_dump_json()
+
+    def __unindex_occupancy(self, id: str):
+        occupancy = self.__occupancy.pop(id)
+        bucket = self.__by_occupancy[occupancy]
+        bucket.discard(id)
+        if not bucket:
+            del self.__by_occupancy[occupancy]
+        self.__by_free[True].discard(id)
+        self.__by_free[False].discard(id)
+        del self.__views[id]
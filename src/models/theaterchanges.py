@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+from .theater import TheaterMinimal
+
+
+class TheaterChanges(BaseModel):
+    # hand this back as `since` to get the changes after this batch
+    cursor: str
+    # the changes since the cursor are no longer known, the client has
+    # to list the theaters all over again
+    reset: bool
+    changed: list[TheaterMinimal]
+    removed: list[str]
@@ -0,0 +1,296 @@
+import asyncio
+import gc
+import os
+import time
+from pathlib import Path
+from typing import IO, Any, Final, Optional
+
+import structlog
+import ujson
+from fastapi.datastructures import State
+
+from ..models.queueitem import QueueItem
+from ..models.queuesnapshot import QUEUE_ADAPTER
+from ..models.scheduler import SCHEDULER, Deadline
+from ..models.syncmode import SyncMode
+from ..models.theater import Theater, TheaterManager
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+SNAPSHOT_FILE: Final[str] = "snapshot"
+WAL_FILE: Final[str] = "wal"
+DEFAULT_FLUSH_DELAY: Final[float] = 0.05
+DEFAULT_COMPACT_AFTER: Final[int] = 10_000
+# mutations that re-anchor the playback clock
+CLOCK_KINDS: Final[frozenset[str]] = frozenset(
+    {"pop", "pause", "resume", "seek", "restore"}
+)
+
+
+def settings(theater: Theater) -> dict[str, Any]:
+    return {
+        "id": theater.id,
+        "name": theater.name,
+        "passwd": theater.passwd,
+        "auth_req": theater.auth_req,
+        "seats": theater.seats,
+        "pinned": theater.pinned,
+        "sync_interval": theater.sync_interval,
+        "mode": theater.mode.value,
+    }
+
+
+# the queue is kept apart from the rest, behind a tab, so that it can be
+# validated straight from its json and the theater's cached json reused
+def snapshot_line(theater: Theater, at: float) -> str:
+    meta = settings(theater)
+    meta["nowplaying"] = (
+        None if theater.nowplaying is None else theater.nowplaying.model_dump()
+    )
+    meta["position"] = 0.0 if theater.nowplaying is None else theater.clock.position()
+    meta["paused"] = theater.paused
+    meta["at"] = at
+    meta_json = ujson.dumps(meta, ensure_ascii=False, escape_forward_slashes=False)
+    return f"{meta_json}\t{theater.queue_snapshot().json()}"
+
+
+class Journal:
+    """
+    Keeps the theaters on disk as a snapshot plus a write-ahead log of the
+    mutations made since. Mutations are only buffered when recorded, and
+    written out together by a single flush shortly after, so a burst of
+    them costs one write and one fsync.
+
+    Once enough mutations piled up the log is compacted into a new
+    snapshot. Only the theaters that changed since the last snapshot are
+    serialized again, the others keep the line they had.
+    """
+
+    __dir: Path
+    __rooms: TheaterManager
+    __flush_delay: float
+    __compact_after: int
+    __pending: list[str]
+    __wal: Optional[IO[str]] = None
+    __lock: Optional[asyncio.Lock] = None
+    __flush: Optional[Deadline] = None
+    __records: int = 0
+    __dirty: set[str]
+    __lines: dict[str, str]
+    __replaying: bool = False
+    __damaged: bool = False
+
+    def __init__(
+        self,
+        path: str,
+        rooms: TheaterManager,
+        *,
+        flush_delay: float = DEFAULT_FLUSH_DELAY,
+        compact_after: int = DEFAULT_COMPACT_AFTER,
+    ):
+        self.__dir = Path(path)
+        self.__dir.mkdir(parents=True, exist_ok=True)
+        self.__rooms = rooms
+        self.__flush_delay = flush_delay
+        self.__compact_after = compact_after
+        self.__pending = []
+        self.__dirty = set()
+        self.__lines = {}
+
+    def record(self, theater: str, kind: str, data: dict[str, Any]):
+        if self.__replaying:
+            return
+        self.__pending.append(
+            ujson.dumps(
+                [time.time(), theater, kind, data],
+                ensure_ascii=False,
+                escape_forward_slashes=False,
+            )
+        )
+        self.__dirty.add(theater)
+        if self.__flush is None:
+            self.__flush = SCHEDULER.call_later(self.__flush_delay, self.flush)
+
+    def created(self, theater: Theater):
+        self.record(theater.id, "create", settings(theater))
+
+    async def flush(self):
+        self.__flush = None
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            lines = self.__pending
+            self.__pending = []
+            if lines:
+                try:
+                    await asyncio.to_thread(self.__append, lines)
+                except OSError:
+                    self.__pending = lines + self.__pending
+                    raise
+                self.__records += len(lines)
+        if self.needs_compaction():
+            await self.compact()
+
+    async def compact(self):
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            # everything recorded up to here is part of the snapshot
+            covered = self.__pending
+            self.__pending = []
+            # taken before the rewrite, theaters mutated while it runs
+            # are marked dirty again for the next compaction
+            dirty, self.__dirty = self.__dirty, set()
+            at = time.time()
+            lines = {
+                theater.id: (
+                    snapshot_line(theater, at)
+                    if theater.id in dirty or theater.id not in self.__lines
+                    else self.__lines[theater.id]
+                )
+                for theater in self.__rooms.get_all()
+            }
+            try:
+                await asyncio.to_thread(self.__rewrite, list(lines.values()))
+            except OSError:
+                self.__pending = covered + self.__pending
+                self.__dirty |= dirty
+                raise
+            self.__lines = lines
+            self.__records = 0
+            self.__damaged = False
+        LOGGER.info("compacted the theater journal", theaters=len(lines))
+
+    def needs_compaction(self) -> bool:
+        return self.__damaged or self.__records >= self.__compact_after
+
+    # reads every theater back in, from the snapshot and then the log,
+    # and returns how many theaters were recovered
+    def recover(self, appstate: State) -> int:
+        rooms = self.__rooms
+        self.__replaying = True
+        # collecting while millions of objects are created only keeps
+        # rescanning the ones already made, the little that replaying
+        # throws away is left to the first collection after it.
+        gc.disable()
+        # when each theater's clock was re-anchored for the last time
+        anchored: dict[str, float] = {}
+        try:
+            for line in self.__read(SNAPSHOT_FILE):
+                meta_json, _, queue_json = line.partition("\t")
+                meta = ujson.loads(meta_json)
+                theater = self.__open(appstate, rooms, meta)
+                nowplaying = meta["nowplaying"]
+                theater.reset(
+                    QUEUE_ADAPTER.validate_json(queue_json),
+                    (
+                        None
+                        if nowplaying is None
+                        else QueueItem.model_validate(nowplaying)
+                    ),
+                    meta["position"],
+                    meta["paused"],
+                )
+                anchored[theater.id] = meta["at"]
+                self.__lines[theater.id] = line
+
+            for line in self.__read(WAL_FILE):
+                try:
+                    at, id, kind, data = ujson.loads(line)
+                except ValueError:
+                    # torn by a crash in the middle of a write
+                    LOGGER.warn("stopped replaying at a damaged journal entry")
+                    self.__damaged = True
+                    break
+                self.__replay(appstate, rooms, at, id, kind, data, anchored)
+        finally:
+            self.__replaying = False
+            gc.enable()
+
+        now = time.time()
+        for theater in rooms.get_all():
+            theater.recover(max(now - anchored.get(theater.id, now), 0.0))
+        self.__wal = open(self.__dir / WAL_FILE, "a", encoding="utf-8")
+        return len(rooms)
+
+    def close(self):
+        if self.__pending:
+            self.__append(self.__pending)
+            self.__pending = []
+        if self.__wal is not None:
+            self.__wal.close()
+            self.__wal = None
+
+    def __replay(
+        self,
+        appstate: State,
+        rooms: TheaterManager,
+        at: float,
+        id: str,
+        kind: str,
+        data: dict[str, Any],
+        anchored: dict[str, float],
+    ):
+        self.__records += 1
+        self.__dirty.add(id)
+        if kind == "create":
+            _ = self.__open(appstate, rooms, data)
+            return
+        try:
+            theater = rooms.get(id)()
+        except IndexError:
+            return
+        if theater is None:
+            return
+        if kind == "remove":
+            rooms.remove(id)
+            _ = self.__lines.pop(id, None)
+        elif kind == "restore":
+            theater.restore(data)
+        else:
+            theater.apply(kind, data)
+        if kind in CLOCK_KINDS:
+            anchored[id] = at
+
+    def __open(
+        self, appstate: State, rooms: TheaterManager, meta: dict[str, Any]
+    ) -> Theater:
+        theater = Theater(
+            appstate=appstate,
+            id=meta["id"],
+            name=meta["name"],
+            passwd=meta["passwd"],
+            auth_req=meta["auth_req"],
+            seats=meta["seats"],
+            sync_interval=meta["sync_interval"],
+            pinned=meta["pinned"],
+            # journals from before there were modes
+            mode=SyncMode(meta.get("mode", SyncMode.SERVER)),
+        )
+        rooms.insert(theater)
+        return theater
+
+    def __read(self, name: str) -> list[str]:
+        try:
+            with open(self.__dir / name, "r", encoding="utf-8") as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def __append(self, lines: list[str]):
+        if self.__wal is None:
+            self.__wal = open(self.__dir / WAL_FILE, "a", encoding="utf-8")
+        self.__wal.write("\n".join(lines) + "\n")
+        self.__wal.flush()
+        os.fsync(self.__wal.fileno())
+
+    def __rewrite(self, lines: list[str]):
+        tmp = self.__dir / f"{SNAPSHOT_FILE}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n" if lines else "")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.__dir / SNAPSHOT_FILE)
+        # the log only holds what came after the snapshot from here on
+        if self.__wal is not None:
+            self.__wal.close()
+        self.__wal = open(self.__dir / WAL_FILE, "w", encoding="utf-8")
@@ -1,23 +1,44 @@
+import asyncio
 from dataclasses import dataclass
 from typing import Annotated, Final, Optional, cast
 
+import structlog
+import ujson
 from fastapi import (
     APIRouter,
     Depends,
     FastAPI,
+    Header,
     Request,
+    Response,
     WebSocket,
     WebSocketDisconnect,
     WebSocketException,
     status,
 )
+from fastapi.datastructures import State
 from pydantic import BaseModel, ValidationError
 
 from ..models.problem import Problem
-from ..models.theater import Theater, TheaterManager, TheaterMinimal
+from ..models.syncmode import SyncMode
+from ..models.theater import (
+    DEFAULT_PAGE_LIMIT,
+    DEFAULT_SYNC_INTERVAL,
+    MAX_PAGE_LIMIT,
+    NEXT_CURSOR_HEADER,
+    Theater,
+    TheaterManager,
+    TheaterMinimal,
+)
+from ..models.theaterchanges import TheaterChanges
+from ..rpc.codec import BINARY_CODEC, BINARY_SUBPROTOCOL, TEXT_CODEC
 from ..rpc.manager import RPCManager
 
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
 MAX_QUEUE_LEN: Final[int] = 100
+MAX_SEATS: Final[int] = 64
+DEFAULT_POLL_TIMEOUT: Final[float] = 30.0
+MAX_POLL_TIMEOUT: Final[float] = 60.0
 
 ROUTER: Final[APIRouter] = APIRouter()
 
@@ -45,9 +66,23 @@ class TheaterRequest:
     passwd: Optional[str]
     auth_req: bool
     seats: int = 2
+    # left out for the server's default
+    mode: Optional[SyncMode] = None
 
-    def into_theater(self) -> Theater:
-        return Theater(self.name, self.passwd, self.auth_req, seats=self.seats)
+    def into_theater(self, appstate: State) -> Theater:
+        return Theater(
+            appstate,
+            self.name,
+            self.passwd,
+            self.auth_req,
+            seats=self.seats,
+            sync_interval=getattr(appstate, "sync_interval", DEFAULT_SYNC_INTERVAL),
+            mode=(
+                getattr(appstate, "sync_mode", SyncMode.SERVER)
+                if self.mode is None
+                else self.mode
+            ),
+        )
 
 
 async def state_theatermanager(req: Request) -> TheaterManager:
@@ -77,39 +112,171 @@ async def state_rpcmanager(req: WebSocket) -> RPCManager:
 RPCDep = Annotated[RPCManager, Depends(state_rpcmanager)]
 
 
-@ROUTER.post("/theaters")
-async def create_theater(rooms: RoomsDep, content: TheaterRequest):
-    # TODO: unimplemented for now
-    return Problem(
-        "/errors/unimplemented",
-        "API Call is unimplemented",
-        501,
-        "This API Call is not implemented currently and is unavailable",
-        f"/theaters",
+@ROUTER.post("/theaters", status_code=status.HTTP_201_CREATED)
+async def create_theater(req: Request, rooms: RoomsDep, content: TheaterRequest):
+    app: FastAPI = cast(FastAPI, req.app)  # type: ignore[no-any-expr]
+    if not 1 <= content.seats <= MAX_SEATS:
+        return Problem(
+            "/errors/invalid-seats",
+            "Invalid Amount of Seats",
+            400,
+            f"A theater needs to have between 1 and {MAX_SEATS} seats.",
+            "/theaters",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    if getattr(app.state, "draining", False):
+        return Problem(
+            "/errors/restarting",
+            "Server Is Restarting",
+            503,
+            "The server is about to restart and takes no new theaters, try again shortly.",
+            "/theaters",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    max_theaters: int = app.state.max_theaters  # type: ignore[no-any-expr]
+    if len(rooms) >= max_theaters:
+        return Problem(
+            "/errors/too-many-theaters",
+            "Too Many Theaters",
+            503,
+            "The server is hosting as many theaters as it can, try again later.",
+            "/theaters",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    theater = content.into_theater(app.state)
+    rooms.insert(theater)
+    return CreateTheaterResponse(
+        id=theater.id,
+        name=theater.name,
+        passwd=theater.passwd,
+        auth_req=theater.auth_req,
+        seats=theater.seats,
+    )
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def disconnected(req: Request):
+    while (await req.receive())["type"] != "http.disconnect":
+        pass
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+# versions handed out to clients carry the epoch of the manager, so that
+# those of a process that is gone never pass for one of this process
+def stamp(rooms: TheaterManager, version: int) -> str:
+    return f"{rooms.epoch}-{version}"
+
+
+# the version a cursor stands for, -1 if it is not from this process
+def unstamp(rooms: TheaterManager, cursor: str) -> int:
+    epoch, _, version = cursor.partition("-")
+    if epoch != rooms.epoch:
+        return -1
+    try:
+        return int(version)
+    except ValueError:
+        return -1
+
+
+# pages through the theaters in order of their id, a page that is not the
+# last one comes with the id to continue after in the X-Next-Cursor header
+@ROUTER.get("/theaters", response_model=list[TheaterMinimal])
+async def list_theaters(
+    rooms: RoomsDep,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_LIMIT,
+    auth_req: Optional[bool] = None,
+    free: Optional[bool] = None,
+    prefix: Optional[str] = None,
+    min_occupancy: Optional[int] = None,
+) -> Response:
+    # any change to any theater bumps the version, so it
+    # stands for every page and every filter at once
+    etag = f'"{stamp(rooms, rooms.version)}"'
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    ids, next_cursor = rooms.query(
+        cursor=cursor,
+        limit=min(max(limit, 1), MAX_PAGE_LIMIT),
+        auth_req=auth_req,
+        free=free,
+        prefix=prefix,
+        min_occupancy=min_occupancy,
     )
-    # theater = content.into_theater()
-    # rooms.insert(theater)
-    # del content
-    # return rooms.get(theater.id).as_created_response(id)
+    # the views are already serialized, so they only have to be joined
+    body = f"[{','.join([rooms.view(id) for id in ids])}]"
+    headers = {"ETag": etag}
+    if next_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    return Response(body, media_type="application/json", headers=headers)
 
 
-@ROUTER.get("/theaters")
-async def list_theaters(rooms: RoomsDep) -> list[TheaterMinimal]:
-    theaters: list[TheaterMinimal] = []
-    for room in rooms.get_all():
-        theaters.append(room.as_minimal())
-    return theaters
+# long polls for the theaters whose minimal view changed after the cursor,
+# without a cursor it answers right away with the current one
+@ROUTER.get("/theaters/changes", response_model=TheaterChanges)
+async def theater_changes(
+    req: Request,
+    rooms: RoomsDep,
+    since: Optional[str] = None,
+    timeout: float = DEFAULT_POLL_TIMEOUT,
+) -> Response:
+    version = -1 if since is None else unstamp(rooms, since)
+    if version == rooms.version and timeout > 0:
+        # a client that hung up is not waited on any longer
+        waits = {
+            asyncio.ensure_future(rooms.wait(version)),
+            asyncio.ensure_future(disconnected(req)),
+        }
+        _, pending = await asyncio.wait(
+            waits,
+            timeout=min(timeout, MAX_POLL_TIMEOUT),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        for task in pending:
+            _ = task.cancel()
+
+    changes = None if version < 0 else rooms.changes(version)
+    changed, removed = ([], []) if changes is None else changes
+    reset = since is not None and changes is None
+    body = (
+        f'{{"cursor":"{stamp(rooms, rooms.version)}","reset":{"true" if reset else "false"},'
+        f'"changed":[{",".join([rooms.view(id) for id in changed])}],'
+        f'"removed":{ujson.dumps(removed)}}}'
+    )
+    return Response(body, media_type="application/json")
 
 
 @ROUTER.get("/theaters/{id}")
-async def query_theater(rooms: RoomsDep, id: str):
+async def query_theater(
+    rooms: RoomsDep,
+    id: str,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+):
     try:
         theater = rooms.get(id)()
         if theater is None:
             raise TypeError("Theater weakref evaluated to None")
-        return theater.as_minimal()
+        etag = f'"{stamp(rooms, rooms.version_of(id))}"'
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        return Response(
+            rooms.view(id), media_type="application/json", headers={"ETag": etag}
+        )
     except (IndexError, ValidationError, TypeError) as e:
-        # G_LOGGER.warn("theater with id does not exist", id=id, err=e)
+        LOGGER.debug("theater with id does not exist", id=id, err=e)
         return Problem(
             "/errors/not-found",
             "Resource Does Not Exist",
@@ -126,26 +293,40 @@ async def rpc_ws_theater(*, rooms: RoomsDepWS, rpc: RPCDep, ws: WebSocket, id: s
         if theater is None:
             raise TypeError("Theater weakref evaluated to None")
         if len(theater.occupants) >= theater.seats:
-            # G_LOGGER.info(
-            # "no occupancy, theater is full!",
-            # occupancy=len(theater.occupants),
-            # seats=theater.seats,
-            # )
+            LOGGER.debug(
+                "no occupancy, theater is full!",
+                occupancy=len(theater.occupants),
+                seats=theater.seats,
+            )
             return
     except (IndexError, TypeError) as e:
-        # G_LOGGER.warn("user tried to join non-existant theater.", id=id, err=e)
+        LOGGER.debug("user tried to join non-existant theater.", id=id, err=e)
         return await ws.close(status.WS_1001_GOING_AWAY, "this theater does not exist!")
 
-    await ws.accept()
+    if BINARY_SUBPROTOCOL in ws.scope.get("subprotocols", []):
+        ws.state.codec = BINARY_CODEC
+        await ws.accept(subprotocol=BINARY_SUBPROTOCOL)
+    else:
+        ws.state.codec = TEXT_CODEC
+        await ws.accept()
+    # the theater could have been reaped while the client was let in
+    if theater.closed:
+        return await ws.close(status.WS_1001_GOING_AWAY, "this theater does not exist!")
+    # a process on its way out takes no new joins, they belong on the next one
+    if getattr(ws.app.state, "draining", False):
+        return await ws.close(
+            status.WS_1012_SERVICE_RESTART, "the server is restarting"
+        )
+    # TODO: check the password
+    theater.enter(ws)
     try:
-        # TODO: check the password
-        theater.enter(ws)
         while True:
             await rpc.perform_dispatch(theater, ws)
     except WebSocketException as e:
-        pass
-        # G_LOGGER.error("eventstream client dispatcher ran into a problem.", err=e)
+        LOGGER.error("eventstream client dispatcher ran into a problem.", err=e)
     except WebSocketDisconnect as e:
-        pass
-        # G_LOGGER.debug("client disconnected from eventstream.", err=e)
-    theater.leave(ws)
+        LOGGER.debug("client disconnected from eventstream.", err=e)
+    finally:
+        # the seat is given up however the connection ended, anything
+        # else would keep its outbox writer and the theater around
+        theater.leave(ws)
@@ -0,0 +1,149 @@
+from typing import Final, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+BINARY_SUBPROTOCOL: Final[str] = "cinemasync.bin"
+
+# method ids used by the binary framing, this table is part of the
+# protocol. only ever append to it, never reorder or remove entries.
+METHODS: Final[tuple[str, ...]] = (
+    "OK",
+    "ERR",
+    "RESULTS",
+    "HELLO",
+    "JOIN",
+    "NOWPLAYING",
+    "ENQUEUE",
+    "DEQUE",
+    "PAUSING",
+    "RESUMING",
+    "SEEKING",
+    "ENQUEUED",
+    "DEQUEUED",
+    "PAUSE",
+    "RESUME",
+    "SEEK",
+    "ROOMSTATE",
+    "SYNC",
+    "QUEUEPAGE",
+    "RECONNECT",
+    "REJOIN",
+    "LEADER",
+    "REPORT",
+    "HANDOVER",
+)
+METHOD_IDS: Final[dict[str, int]] = {method: i for i, method in enumerate(METHODS)}
+
+MAX_RID: Final[int] = 2**64 - 1
+EMPTY_PAYLOAD: Final[str] = "{}"
+
+Frame = Union[str, bytes]
+
+
+class FrameError(ValueError):
+    pass
+
+
+# the next frame, of either type. which one it should have been is up to
+# the codec, a client sending the other type gets a MALFORMED rather than
+# bringing down the connection, which `receive_text` and `receive_bytes`
+# would by raising a KeyError.
+async def receive_frame(ws: WebSocket) -> Frame:
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    text = message.get("text")
+    if text is not None:
+        return text
+    return message.get("bytes") or b""
+
+
+class TextCodec:
+    """`<rid> <METHOD> <json>` in WebSocket text frames."""
+
+    binary: bool = False
+
+    async def receive(self, ws: WebSocket) -> Frame:
+        return await receive_frame(ws)
+
+    # the rid, the method and where the payload starts, found by searching
+    # for the two spaces rather than splitting up the whole frame, so the
+    # payload is only sliced out once it is known to be wanted
+    def header(self, frame: Frame) -> tuple[int, str, int]:
+        if type(frame) is not str:
+            raise FrameError("expected a text frame")
+        space = frame.find(" ")
+        end = frame.find(" ", space + 1) if space != -1 else -1
+        if end == -1:
+            raise FrameError("not enough spaces in message")
+        try:
+            return int(frame[:space]), frame[space + 1 : end], end + 1
+        except ValueError as e:
+            raise FrameError("rid was not a number") from e
+
+    def payload(self, frame: Frame, offset: int) -> Frame:
+        return frame[offset:]
+
+    def decode(self, frame: Frame) -> tuple[int, str, Frame]:
+        rid, method, offset = self.header(frame)
+        return rid, method, self.payload(frame, offset)
+
+    def encode(self, rid: int, method: str, payload: str) -> Frame:
+        return f"{rid} {method} {payload}"
+
+
+class BinaryCodec:
+    """
+    Header of the rid as an unsigned LEB128 varint and the method id as a
+    single byte, followed by the json payload in WebSocket binary frames.
+    An empty payload stands for an empty object, which is what most of the
+    opcodes carry. Small rids, the common case, make for a 2 byte header.
+    """
+
+    binary: bool = True
+
+    async def receive(self, ws: WebSocket) -> Frame:
+        return await receive_frame(ws)
+
+    def header(self, frame: Frame) -> tuple[int, str, int]:
+        if type(frame) is not bytes:
+            raise FrameError("expected a binary frame")
+        rid = 0
+        shift = 0
+        for i, byte in enumerate(frame):
+            rid |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        else:
+            raise FrameError("frame is shorter than the header")
+        if rid > MAX_RID:
+            raise FrameError("rid does not fit in 64 bits")
+        try:
+            method = METHODS[frame[i + 1]]
+        except IndexError as e:
+            raise FrameError("frame is missing a valid method id") from e
+        return rid, method, i + 2
+
+    def payload(self, frame: Frame, offset: int) -> Frame:
+        return frame[offset:] if len(frame) > offset else EMPTY_PAYLOAD
+
+    def decode(self, frame: Frame) -> tuple[int, str, Frame]:
+        rid, method, offset = self.header(frame)
+        return rid, method, self.payload(frame, offset)
+
+    def encode(self, rid: int, method: str, payload: str) -> Frame:
+        header = bytearray()
+        while rid > 0x7F:
+            header.append((rid & 0x7F) | 0x80)
+            rid >>= 7
+        header.append(rid)
+        header.append(METHOD_IDS[method])
+        if payload != EMPTY_PAYLOAD:
+            header += payload.encode("utf-8")
+        return bytes(header)
+
+
+TEXT_CODEC: Final[TextCodec] = TextCodec()
+BINARY_CODEC: Final[BinaryCodec] = BinaryCodec()
+Codec = Union[TextCodec, BinaryCodec]
@@ -0,0 +1,80 @@
+from typing import Any, Final, Optional, Sequence
+
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets import frames
+from websockets.extensions.base import Extension
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.typing import ExtensionParameter
+
+DEFAULT_THRESHOLD: Final[int] = 1024
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that only compresses messages of at least
+    `threshold` bytes. RFC 7692 lets an endpoint leave any message
+    uncompressed, it just doesn't set RSV1 on it, so clients need no
+    changes. Small frames, which are nearly all of them, skip zlib.
+    """
+
+    threshold: int
+    __skipping: bool = False
+
+    def __init__(self, threshold: int, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.opcode in frames.CTRL_OPCODES:
+            return frame
+        # continuation frames have to follow what the first frame did
+        if frame.opcode is not frames.OP_CONT:
+            self.__skipping = frame.fin and len(frame.data) < self.threshold
+        if self.__skipping:
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    threshold: int
+
+    def __init__(self, threshold: int, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+
+    def process_request_params(
+        self,
+        params: Sequence[ExtensionParameter],
+        accepted_extensions: Sequence[Extension],
+    ) -> tuple[list[ExtensionParameter], PerMessageDeflate]:
+        response, ext = super().process_request_params(params, accepted_extensions)
+        return response, ThresholdPerMessageDeflate(
+            self.threshold,
+            ext.remote_no_context_takeover,
+            ext.local_no_context_takeover,
+            ext.remote_max_window_bits,
+            ext.local_max_window_bits,
+            ext.compress_settings,
+        )
+
+
+class CompressingWebSocketProtocol(WebSocketProtocol):
+    """
+    uvicorn's websockets protocol, with permessage-deflate only applied
+    to large frames. Set `threshold` before the server starts, `None`
+    turns compression off altogether.
+    """
+
+    threshold: Optional[int] = DEFAULT_THRESHOLD
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        if self.threshold is None:
+            self.available_extensions = []
+        else:
+            self.available_extensions = [
+                ThresholdPerMessageDeflateFactory(self.threshold)
+            ]
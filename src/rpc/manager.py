@@ -1,17 +1,42 @@
-from typing import Final
+from time import monotonic, perf_counter
+from typing import Final, Optional
 
+import structlog
 from fastapi import WebSocket
 from pydantic import ValidationError
 
 from ..models.theater import Theater
+from .codec import TEXT_CODEC, Codec, FrameError
 from .handlergroup import RPCHandler
+from .metrics import (
+    DROPPED_MESSAGES,
+    RPC_LATENCY,
+    RPC_REQUESTS,
+    CounterChild,
+    HistogramChild,
+)
 from .requests.base import RPCRequest
+from .responses.err import Err
 
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
 MAX_COMMAND_LEN: Final[int] = 1024
+# how much of an unknown method is echoed back in the ERR
+MAX_METHOD_DETAILS: Final[int] = 32
+
+MALFORMED_FRAME: Final[CounterChild] = DROPPED_MESSAGES.child("malformed_frame")
+TOO_LARGE: Final[CounterChild] = DROPPED_MESSAGES.child("too_large")
+UNKNOWN_METHOD: Final[CounterChild] = DROPPED_MESSAGES.child("unknown_method")
+INVALID_PAYLOAD: Final[CounterChild] = DROPPED_MESSAGES.child("invalid_payload")
+RATE_LIMITED: Final[CounterChild] = DROPPED_MESSAGES.child("rate_limited")
 
 
 class RPCManager:
     __handlers: dict[str, tuple[RPCHandler, type[RPCRequest]]] = {}
+    # the request count and parse, validate and handler latencies of a
+    # method, looked up once per dispatch rather than once per stage
+    __metrics: dict[
+        str, tuple[CounterChild, HistogramChild, HistogramChild, HistogramChild]
+    ] = {}
 
     def get_handlers(self) -> dict[str, tuple[RPCHandler, type[RPCRequest]]]:
         return self.__handlers
@@ -22,34 +47,123 @@ class RPCManager:
         self.__handlers = self.__handlers | handlers
 
     async def perform_dispatch(self, room: Theater, ws: WebSocket):
-        data = await ws.receive_text()
+        codec: Codec = getattr(ws.state, "codec", TEXT_CODEC)
+        data = await codec.receive(ws)
+        started = perf_counter()
 
-        if len(data) > MAX_COMMAND_LEN:
-            # LOGGER.warn("command is too large", _len=len(data), max=MAX_COMMAND_LEN)
-            return
         try:
-            rid, method, payload_json = data.split(" ", maxsplit=2)
-        except ValueError:
-            # LOGGER.warn("not enough spaces in message", err=e)
-            return
+            rid, method, offset = codec.header(data)
+        except FrameError as e:
+            LOGGER.debug("malformed frame", err=e)
+            return await reject(
+                ws,
+                0,
+                MALFORMED_FRAME,
+                "MALFORMED",
+                8,
+                "The frame could not be read.",
+                f"{e}",
+            )
+        if len(data) > MAX_COMMAND_LEN:
+            LOGGER.debug("command is too large", _len=len(data), max=MAX_COMMAND_LEN)
+            return await reject(
+                ws,
+                rid,
+                TOO_LARGE,
+                "TOOLARGE",
+                11,
+                "The request is too large.",
+                f"{len(data)} is over {MAX_COMMAND_LEN}",
+            )
 
         handler_info = self.__handlers.get(method)
-        if not handler_info:
-            # LOGGER.warn("no handler exists for the specified method", method=method)
-            return
-        handler, clsname = handler_info
+        if handler_info is None:
+            # casing does not matter, but it should be capitalized
+            handler_info = self.__handlers.get(method.upper())
+            if handler_info is None:
+                LOGGER.debug(
+                    "no handler exists for the specified method", method=method
+                )
+                return await reject(
+                    ws,
+                    rid,
+                    UNKNOWN_METHOD,
+                    "UNKNOWNMETHOD",
+                    9,
+                    "There is no such method.",
+                    method[:MAX_METHOD_DETAILS],
+                )
+            method = method.upper()
 
-        try:
-            rid = int(rid)
-        except ValueError:
-            # LOGGER.warn("rid was not a number", err=e)
-            return
+        limiter = getattr(ws.state, "limiter", None)
+        if limiter is not None:
+            wait = limiter.admit(method, room.throttle, monotonic())
+            if wait:
+                return await reject(
+                    ws,
+                    rid,
+                    RATE_LIMITED,
+                    "RATELIMITED",
+                    12,
+                    "Too many requests, slow down.",
+                    f"try again in {wait:.3f}s",
+                )
+        handler, clsname = handler_info
+        parsed = perf_counter()
 
         try:
-            payload = clsname.model_validate_json(json_data=payload_json)
+            payload = clsname.decode(codec.payload(data, offset), rid)
         except ValidationError as e:
-            # LOGGER.warn("malformed json in payload", err=e)
-            return
-        payload.set_rid(rid)
+            LOGGER.debug("malformed json in payload", method=method, err=e)
+            return await reject(
+                ws,
+                rid,
+                INVALID_PAYLOAD,
+                "INVALIDPAYLOAD",
+                10,
+                "The payload is not valid for the method.",
+                describe(e),
+            )
+        validated = perf_counter()
 
         await handler(room, ws, payload)
+        metrics = self.__metrics.get(method)
+        if metrics is None:
+            metrics = (
+                RPC_REQUESTS.child(method),
+                RPC_LATENCY.child("parse", method),
+                RPC_LATENCY.child("validate", method),
+                RPC_LATENCY.child("handler", method),
+            )
+            self.__metrics[method] = metrics
+        requests, parse, validate, handle = metrics
+        requests.inc()
+        parse.observe(parsed - started)
+        validate.observe(validated - parsed)
+        handle.observe(perf_counter() - validated)
+
+
+# what was wrong with each field, in a line, as the details of an ERR
+def describe(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in error['loc']) or 'payload'}: {error['msg']}"
+        for error in e.errors(include_url=False)
+    )
+
+
+# requests that never make it to a handler are still answered, with the
+# rid they were sent with if it could be read, so clients are not left
+# waiting on a reply that is never coming
+async def reject(
+    ws: WebSocket,
+    rid: int,
+    dropped: CounterChild,
+    error: str,
+    code: int,
+    reason: str,
+    details: Optional[str] = None,
+):
+    dropped.inc()
+    e = Err(err=error, code=code, reason=reason, details=details)
+    e.set_rid(rid)
+    await e.send(ws)
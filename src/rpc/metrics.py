@@ -0,0 +1,237 @@
+from bisect import bisect_left
+from typing import ClassVar, Final, TypeVar, Union
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS: Final[tuple[float, ...]] = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+CONTENT_TYPE: Final[str] = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return f"{{{','.join(pairs)}}}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    value: float
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self):
+        self.value += 1
+
+
+class Counter:
+    """
+    Monotonic count per combination of label values. There is no locking,
+    everything runs on the event loop. Hot paths should hold on to the
+    child of the labels they count, which leaves an attribute increment.
+    """
+
+    kind: ClassVar[str] = "counter"
+    name: str
+    help: str
+    labels: Labels
+    children: dict[Labels, CounterChild]
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.children = {}
+
+    def child(self, *labels: str) -> CounterChild:
+        child = self.children.get(labels)
+        if child is None:
+            child = CounterChild()
+            self.children[labels] = child
+        return child
+
+    def inc(self, *labels: str):
+        self.child(*labels).inc()
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, child in self.children.items():
+            suffix = format_labels(self.labels, labels)
+            lines.append(f"{self.name}{suffix} {format_value(child.value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """Value that is set, rather than counted, usually right before a scrape."""
+
+    kind: ClassVar[str] = "gauge"
+
+    def set(self, value: float, *labels: str):
+        self.child(*labels).value = value
+
+    def clear(self):
+        self.children = {}
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    bounds: tuple[float, ...]
+    # per bucket, the last one being +Inf
+    counts: list[int]
+    sum: float
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets. An observation is
+    a bisect and two additions, the buckets are only made cumulative when
+    rendered. Like with counters, hot paths hold on to their child.
+    """
+
+    kind: ClassVar[str] = "histogram"
+    name: str
+    help: str
+    labels: Labels
+    bounds: tuple[float, ...]
+    children: dict[Labels, HistogramChild]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Labels = (),
+        bounds: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.bounds = bounds
+        self.children = {}
+
+    def child(self, *labels: str) -> HistogramChild:
+        child = self.children.get(labels)
+        if child is None:
+            child = HistogramChild(self.bounds)
+            self.children[labels] = child
+        return child
+
+    def observe(self, value: float, *labels: str):
+        self.child(*labels).observe(value)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, child in self.children.items():
+            count = 0
+            for bound, amt in zip(self.bounds + (float("inf"),), child.counts):
+                count += amt
+                le = f'le="{format_value(bound)}"'
+                bucket = format_labels(self.labels, labels, le)
+                lines.append(f"{self.name}_bucket{bucket} {count}")
+            suffix = format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{suffix} {format_value(child.sum)}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+Metric = Union[Counter, Gauge, Histogram]
+M = TypeVar("M", Counter, Gauge, Histogram)
+
+
+class Registry:
+    """Every metric of the process, rendered in the Prometheus text format."""
+
+    __metrics: list[Metric]
+
+    def __init__(self):
+        self.__metrics = []
+
+    def counter(self, name: str, help: str, labels: Labels = ()) -> Counter:
+        return self.__register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Labels = ()) -> Gauge:
+        return self.__register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Labels = ()) -> Histogram:
+        return self.__register(Histogram(name, help, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.__metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def __register(self, metric: M) -> M:
+        self.__metrics.append(metric)
+        return metric
+
+
+METRICS: Final[Registry] = Registry()
+
+RPC_REQUESTS: Final[Counter] = METRICS.counter(
+    "cinema_rpc_requests_total", "RPC requests handed to a handler.", ("method",)
+)
+RPC_LATENCY: Final[Histogram] = METRICS.histogram(
+    "cinema_rpc_latency_seconds",
+    "Time spent in each stage of dispatching an RPC request, and broadcasting.",
+    ("stage", "method"),
+)
+DROPPED_MESSAGES: Final[Counter] = METRICS.counter(
+    "cinema_dropped_messages_total",
+    "Inbound and outbound messages that were dropped.",
+    ("reason",),
+)
+THEATER_OCCUPANCY: Final[Gauge] = METRICS.gauge(
+    "cinema_theater_occupancy", "Occupants connected to a theater.", ("theater",)
+)
+THEATER_OUTBOX_DEPTH: Final[Gauge] = METRICS.gauge(
+    "cinema_theater_outbox_depth",
+    "Frames waiting to be written out to the occupants of a theater.",
+    ("theater",),
+)
+STREAM_PREFETCHES: Final[Counter] = METRICS.counter(
+    "cinema_stream_prefetches_total",
+    "Streams of upcoming media looked up ahead of time, by how that went.",
+    ("result",),
+)
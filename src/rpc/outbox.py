@@ -0,0 +1,100 @@
+from asyncio import CancelledError, Queue, QueueFull, Task, create_task
+from enum import Enum
+from typing import Final, Optional
+
+import structlog
+from fastapi import WebSocket, status
+
+from .codec import TEXT_CODEC, Codec, Frame
+from .metrics import DROPPED_MESSAGES
+
+LOGGER: Final[structlog.stdlib.BoundLogger] = structlog.getLogger()
+DEFAULT_WATERMARK: Final[int] = 256
+
+
+class OverflowPolicy(str, Enum):
+    # throw away frames that don't fit, the client will be out of sync
+    DROP = "drop"
+    # hang up on the client, so it can reconnect and catch back up
+    DISCONNECT = "disconnect"
+
+
+class Outbox:
+    """
+    Bounded queue of outbound frames for a single connection, drained by a
+    dedicated writer task so a stalled socket only ever holds up itself.
+    """
+
+    __ws: WebSocket
+    __frames: "Queue[Frame]"
+    __policy: OverflowPolicy
+    __writer: Optional[Task[None]] = None
+    __closed: bool = False
+    codec: Codec
+    dropped: int = 0
+
+    def __init__(
+        self,
+        ws: WebSocket,
+        *,
+        watermark: int = DEFAULT_WATERMARK,
+        policy: OverflowPolicy = OverflowPolicy.DISCONNECT,
+        codec: Codec = TEXT_CODEC,
+    ):
+        self.__ws = ws
+        self.codec = codec
+        self.__frames = Queue(maxsize=watermark)
+        self.__policy = policy
+
+    def start(self):
+        self.__writer = create_task(self.__drain())
+
+    def push(self, frame: Frame) -> bool:
+        if self.__closed:
+            DROPPED_MESSAGES.inc("outbox_closed")
+            return False
+        try:
+            self.__frames.put_nowait(frame)
+        except QueueFull:
+            self.dropped += 1
+            DROPPED_MESSAGES.inc("outbox_overflow")
+            if self.__policy is OverflowPolicy.DISCONNECT:
+                LOGGER.info(
+                    "client fell behind the outbound watermark, disconnecting",
+                    depth=self.__frames.qsize(),
+                )
+                self.close()
+                _ = create_task(self.__hangup())
+            return False
+        return True
+
+    def depth(self) -> int:
+        return self.__frames.qsize()
+
+    def close(self):
+        self.__closed = True
+        if self.__writer is not None and not self.__writer.done():
+            _ = self.__writer.cancel()
+        self.__writer = None
+
+    async def __hangup(self):
+        try:
+            await self.__ws.close(status.WS_1013_TRY_AGAIN_LATER, "fell too far behind")
+        except Exception as e:
+            LOGGER.debug("could not close lagging client", err=e)
+
+    async def __drain(self):
+        try:
+            while True:
+                frame = await self.__frames.get()
+                if type(frame) is bytes:
+                    await self.__ws.send_bytes(frame)
+                else:
+                    await self.__ws.send_text(frame)
+        except CancelledError:
+            raise
+        except Exception as e:
+            # the socket is gone, the reading side will notice
+            # on its own and remove the occupant from the theater
+            LOGGER.debug("outbound writer stopped", err=e)
+            self.__closed = True
@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+from typing import Final, Optional
+
+# what every connection gets, over all of its requests
+DEFAULT_CONNECTION_RATE: Final[float] = 20.0
+DEFAULT_CONNECTION_BURST: Final[float] = 40.0
+# what a theater gets, over the requests of all of its occupants that
+# fan out to every one of them
+DEFAULT_THEATER_RATE: Final[float] = 10.0
+DEFAULT_THEATER_BURST: Final[float] = 20.0
+DEFAULT_METHOD_LIMITS: Final[str] = (
+    "HELLO=1/3,REJOIN=1/3,ENQUEUE=1/5,DEQUE=2/5,PAUSE=2/5,RESUME=2/5,SEEK=5/10,"
+    "ROOMSTATE=1/5,REPORT=2/5,HANDOVER=1/3"
+)
+# the requests that end up broadcast to the whole theater
+BROADCASTING: Final[frozenset[str]] = frozenset(
+    ("ENQUEUE", "DEQUE", "PAUSE", "RESUME", "SEEK")
+)
+
+
+@dataclass(frozen=True)
+class Limit:
+    # tokens added per second
+    rate: float
+    # tokens the bucket holds at most, the size of a burst
+    burst: float
+
+
+class TokenBucket:
+    """
+    Lets through `rate` requests a second on average, and bursts of up to
+    `burst` of them. The tokens are topped up from the monotonic clock
+    whenever the bucket is checked, there is no timer behind it.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    rate: float
+    burst: float
+    tokens: float
+    stamp: float
+
+    def __init__(self, limit: Limit, now: float):
+        self.rate = limit.rate
+        # anything less would never let a single request through
+        self.burst = max(limit.burst, 1.0)
+        self.tokens = self.burst
+        self.stamp = now
+
+    # tops the bucket up, and says how long it is until a token is
+    # available, which is 0 if one already is
+    def refill(self, now: float) -> float:
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        self.stamp = now
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class ConnectionLimiter:
+    """
+    The buckets of a single connection, one for all of its requests and
+    one for each method with a limit of its own. They are all made up
+    front, checking a request only does arithmetic on them.
+    """
+
+    __connection: Optional[TokenBucket]
+    __methods: dict[str, TokenBucket]
+
+    def __init__(self, limits: "RateLimits", now: float):
+        self.__connection = (
+            None if limits.connection is None else TokenBucket(limits.connection, now)
+        )
+        self.__methods = {
+            method: TokenBucket(limit, now) for method, limit in limits.methods.items()
+        }
+
+    # takes a token from every bucket the request counts against, the
+    # theater's included, or none at all if one of them is empty. returns
+    # 0 when the request can go ahead, otherwise how long to wait for.
+    def admit(self, method: str, theater: Optional[TokenBucket], now: float) -> float:
+        connection = self.__connection
+        bucket = self.__methods.get(method)
+        if method not in BROADCASTING:
+            theater = None
+
+        wait = 0.0
+        if connection is not None:
+            wait = connection.refill(now)
+        if bucket is not None:
+            wait = max(wait, bucket.refill(now))
+        if theater is not None:
+            wait = max(wait, theater.refill(now))
+        if wait:
+            return wait
+
+        if connection is not None:
+            connection.tokens -= 1.0
+        if bucket is not None:
+            bucket.tokens -= 1.0
+        if theater is not None:
+            theater.tokens -= 1.0
+        return 0.0
+
+
+class RateLimits:
+    """The configured limits, a rate of 0 turns that limit off."""
+
+    connection: Optional[Limit]
+    theater: Optional[Limit]
+    methods: dict[str, Limit]
+
+    def __init__(
+        self,
+        *,
+        connection: Optional[Limit] = Limit(
+            DEFAULT_CONNECTION_RATE, DEFAULT_CONNECTION_BURST
+        ),
+        theater: Optional[Limit] = Limit(DEFAULT_THEATER_RATE, DEFAULT_THEATER_BURST),
+        methods: Optional[dict[str, Limit]] = None,
+    ):
+        self.connection = connection if connection and connection.rate > 0 else None
+        self.theater = theater if theater and theater.rate > 0 else None
+        methods = parse_limits(DEFAULT_METHOD_LIMITS) if methods is None else methods
+        self.methods = {
+            method: limit for method, limit in methods.items() if limit.rate > 0
+        }
+
+    def for_connection(self, now: float) -> ConnectionLimiter:
+        return ConnectionLimiter(self, now)
+
+    def for_theater(self, now: float) -> Optional[TokenBucket]:
+        return None if self.theater is None else TokenBucket(self.theater, now)
+
+
+# `METHOD=rate/burst` pairs, separated by commas, like `SEEK=5/10,PAUSE=2/5`
+def parse_limits(spec: str) -> dict[str, Limit]:
+    limits: dict[str, Limit] = {}
+    for pair in spec.split(","):
+        if not pair.strip():
+            continue
+        method, _, limit = pair.partition("=")
+        rate, _, burst = limit.partition("/")
+        limits[method.strip().upper()] = Limit(
+            float(rate), float(burst) if burst else max(float(rate), 1.0)
+        )
+    return limits
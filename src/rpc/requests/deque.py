@@ -1,14 +1,24 @@
 from fastapi import WebSocket
 
 from ...models.theater import Theater
+from ..codec import Frame
 from ..responses.dequeued import Dequeued
-from .base import RPCRequest
+from .base import RPCRequest, json_int, json_object
 from .groups import GROUP_V0
 
 
 class Deque(RPCRequest):
     index: int
 
+    @classmethod
+    def decode(cls, payload: Frame, rid: int) -> "Deque":
+        fields = json_object(payload)
+        if fields is not None and fields.keys() == {"index"}:
+            index = fields["index"]
+            if json_int(index):
+                return cls.assemble(rid, {"index": index})
+        return super().decode(payload, rid)
+
 
 @GROUP_V0.register(method="DEQUE", clsname=Deque)
 async def deque(room: Theater, ws: WebSocket, payload: Deque):
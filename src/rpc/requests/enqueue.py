@@ -1,8 +1,14 @@
 from typing import cast
 
 from fastapi import WebSocket
-from yt_dlp import DownloadError, YoutubeDL
 
+from ...media.resolver import (
+    FetchInfoError,
+    MediaResolver,
+    PartialInfoError,
+    ResolverBusyError,
+    ResolverTimeoutError,
+)
 from ...models.theater import Theater
 from ..responses.enqueued import Enqueued
 from .base import RPCRequest
@@ -16,48 +22,48 @@ class Enqueue(RPCRequest):
 @GROUP_V0.register(method="ENQUEUE", clsname=Enqueue)
 async def enqueue(room: Theater, ws: WebSocket, payload: Enqueue):
     # TODO: check authz
-    with YoutubeDL() as ytdl:
-        try:
-            info = ytdl.extract_info(payload.url, download=False)
-        except DownloadError as e:
-            return await payload.err(
-                ws,
-                "FETCHINFO",
-                3,
-                "Could not fetch infomation on the requested media.",
-                f"{e}",
-            )
-        if info is None:
-            return
-        if type(info) is not dict:
-            return
-        # not having duration is a hard-error, we rely
-        # on this information too much not to have it
-        try:
-            duration = info["duration"]
-        except KeyError as e:
-            return await payload.err(
-                ws,
-                "PARTIALINFO",
-                3,
-                "The requested media did not have a known length.",
-                f"{e}",
-            )
-
-        title = info.get("title", "")
-        if type(title) is not str:
-            title = ""
-        try:
-            if type(duration) is not float:
-                duration = float(duration)
-        except ValueError as e:
-            return
-        username = cast(str, ws.state.username)  # type: ignore[no-any-expr]
-        await payload.ok(ws)
-        await payload.prop(
-            room, Enqueued(_rid=0, url=payload.url, media=None, submitted_by=username)
+    resolver = cast(MediaResolver, room.appstate.resolver)  # type: ignore[no-any-expr]
+    try:
+        info = await resolver.resolve(payload.url)
+    except ResolverBusyError as e:
+        return await payload.err(
+            ws,
+            "BUSY",
+            5,
+            "The server is looking up too much media right now, try again later.",
+            f"{e}",
+        )
+    except ResolverTimeoutError as e:
+        return await payload.err(
+            ws,
+            "TIMEOUT",
+            4,
+            "Fetching information on the requested media took too long.",
+            f"{e}",
+        )
+    except FetchInfoError as e:
+        return await payload.err(
+            ws,
+            "FETCHINFO",
+            3,
+            "Could not fetch infomation on the requested media.",
+            f"{e}",
         )
-        # this step has to be done last as it might propagate a
-        # NOWPLAYING opcode to all listeners when there was nothing
-        # in the queue before
-        await room.enqueue(payload.url, title, duration, username)
+    except PartialInfoError as e:
+        return await payload.err(
+            ws,
+            "PARTIALINFO",
+            3,
+            "The requested media did not have a known length.",
+            f"{e}",
+        )
+
+    username = cast(str, ws.state.username)  # type: ignore[no-any-expr]
+    await payload.ok(ws)
+    await payload.prop(
+        room, Enqueued(_rid=0, url=payload.url, media=None, submitted_by=username)
+    )
+    # this step has to be done last as it might propagate a
+    # NOWPLAYING opcode to all listeners when there was nothing
+    # in the queue before
+    await room.enqueue(payload.url, info.title, info.duration, username)
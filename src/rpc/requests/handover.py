@@ -0,0 +1,30 @@
+from fastapi import WebSocket
+
+from ...models.theater import Theater
+from .base import RPCRequest
+from .groups import GROUP_V0
+
+
+class Handover(RPCRequest):
+    user: str
+
+
+@GROUP_V0.register(method="HANDOVER", clsname=Handover)
+async def handover(room: Theater, ws: WebSocket, payload: Handover):
+    if room.leader is None or getattr(ws.state, "username", None) != room.leader:
+        return await payload.err(
+            ws,
+            "NOTLEADER",
+            13,
+            "Only the leader of the room can do this.",
+        )
+    if payload.user not in room.usernames:
+        return await payload.err(
+            ws,
+            "NOSUCHUSER",
+            14,
+            "There is nobody by that name in the room.",
+            payload.user,
+        )
+    await payload.ok(ws)
+    room.handover(payload.user)
@@ -1,5 +1,4 @@
-from copy import deepcopy
-from typing import Optional
+from typing import Final, Optional
 
 from fastapi import WebSocket
 from pydantic import BaseModel
@@ -8,41 +7,67 @@ from ...models.queueitem import QueueItem
 from ...models.roomstate import RoomState
 from ...models.theater import Theater
 from ..responses.join import Join
+from ..responses.queuepage import QueuePage
+from ..responses.rawresults import RawResults
 from .base import RPCRequest
 from .groups import GROUP_V0
 
+MAX_QUEUE_PAGE_SIZE: Final[int] = 25
+
 
 class HelloResults(BaseModel):
     occupants: list[str]
     queue: Optional[list[QueueItem]] = None
+    queue_len: Optional[int] = None
     roomstate: RoomState
+    # number of the last broadcast made before joining
+    seq: Optional[int] = None
+    # for taking the seat back with REJOIN after losing the connection
+    token: Optional[str] = None
 
 
 class Hello(RPCRequest):
     name: str
     passwd: Optional[str] = None
+    # asks for the queue to be streamed in QUEUEPAGE chunks of this
+    # size after the results, instead of as part of them
+    page_size: Optional[int] = None
 
 
 @GROUP_V0.register(method="HELLO", clsname=Hello)
 async def hello(room: Theater, ws: WebSocket, payload: Hello):
     # TODO: check password here
+    queue = room.queue_snapshot()
+    tokens = getattr(room.appstate, "resume_tokens", None)
     results = HelloResults(
         occupants=room.usernames,
-        queue=list(deepcopy(room.queue)),
-        roomstate=RoomState(
-            nowplaying=(
-                lambda: "" if room.nowplaying is None else room.nowplaying.media.url
-            )(),
-            position=(
-                lambda: -0.0
-                if room.nowplaying is None
-                else room.nowplaying.media.duration
-            )(),
-            paused=room.paused,
+        queue_len=len(queue),
+        roomstate=room.room_state(),
+        seq=room.seq,
+        token=(
+            None
+            if tokens is None
+            else tokens.issue(room.id, payload.name, room.stream, expiring=False)
         ),
     )
-    print(results)
     ws.state.username = payload.name
-    await payload.res(ws, results)
+    # the queue is spliced in already serialized, rather than having
+    # it copied and serialized all over again for every single join
+    output_json = results.model_dump_json(exclude={"queue"})
+    queue_json = queue.json() if payload.page_size is None else "null"
+    resp = RawResults(output_json=f'{{"queue":{queue_json},{output_json[1:]}')
+    resp.set_rid(payload._rid)
+    await resp.send(ws)
+    if payload.page_size is not None:
+        page_size = min(max(payload.page_size, 1), MAX_QUEUE_PAGE_SIZE)
+        # an empty queue still comes as a page, the client waits on the last
+        for offset in range(0, max(len(queue), 1), page_size):
+            page = QueuePage(
+                offset=offset,
+                items=list(queue.items[offset : offset + page_size]),
+                last=offset + page_size >= len(queue),
+            )
+            page.set_rid(payload._rid)
+            await page.send(ws)
     await payload.prop(room, Join(_rid=0, user=payload.name))
     room.seated(payload.name)
@@ -3,19 +3,33 @@ from typing import Optional
 from fastapi import WebSocket
 
 from ...models.theater import Theater
+from ..codec import Frame
 from ..responses.pausing import Pausing
-from .base import RPCRequest
+from .base import RPCRequest, json_number, json_object
 from .groups import GROUP_V0
 
 
 class Pause(RPCRequest):
     position: Optional[float] = None
 
+    @classmethod
+    def decode(cls, payload: Frame, rid: int) -> "Pause":
+        fields = json_object(payload)
+        if fields is not None and fields.keys() <= {"position"}:
+            position = fields.get("position")
+            if position is None:
+                return cls.assemble(rid, {"position": None}, set(fields))
+            if json_number(position):
+                return cls.assemble(rid, {"position": float(position)})
+        return super().decode(payload, rid)
+
 
 @GROUP_V0.register(method="PAUSE", clsname=Pause)
 async def pause(room: Theater, ws: WebSocket, payload: Pause):
     # TODO: check authz
     room.pause_media()
     await payload.ok(ws)
-    # TODO: pass along position hint
-    await payload.prop(room, Pausing(_rid=0, position=None))
+    # the client's position hint is ignored, the
+    # theater's own clock is the authority on this
+    position = None if room.nowplaying is None else room.clock.position()
+    await room.broadcast_playback(Pausing(_rid=0, position=position))
@@ -0,0 +1,85 @@
+from typing import Optional
+
+from fastapi import WebSocket
+from pydantic import BaseModel
+
+from ...models.roomstate import RoomState
+from ...models.theater import Theater
+from ..codec import TEXT_CODEC, Codec
+from ..responses.join import Join
+from ..responses.rawresults import RawResults
+from ..tokens import ResumeTokens
+from .base import RPCRequest
+from .groups import GROUP_V0
+
+
+class RejoinResults(BaseModel):
+    occupants: list[str]
+    queue_len: int
+    roomstate: RoomState
+    seq: int
+    token: str
+    replayed: bool
+
+
+class Rejoin(RPCRequest):
+    token: str
+    # number of the last broadcast the client got, to be caught up from
+    last_seq: Optional[int] = None
+
+
+@GROUP_V0.register(method="REJOIN", clsname=Rejoin)
+async def rejoin(room: Theater, ws: WebSocket, payload: Rejoin):
+    # the seat the connection already has would be taken a second time
+    if getattr(ws.state, "username", None) is not None:
+        return await payload.err(
+            ws,
+            "ALREADYSEATED",
+            15,
+            "This connection already has a seat in the room.",
+        )
+    tokens: Optional[ResumeTokens] = getattr(room.appstate, "resume_tokens", None)
+    claims = None if tokens is None else tokens.verify(payload.token)
+    if (
+        tokens is None
+        or claims is None
+        or claims.theater != room.id
+        or (claims.expires is None and claims.stream != room.stream)
+    ):
+        return await payload.err(
+            ws,
+            "BADTOKEN",
+            7,
+            "The session can not be resumed, say HELLO instead.",
+        )
+    ws.state.username = claims.username
+
+    codec: Codec = getattr(ws.state, "codec", TEXT_CODEC)
+    missed = (
+        None
+        if payload.last_seq is None or claims.stream != room.stream
+        else room.events_since(payload.last_seq, codec)
+    )
+    results = RejoinResults(
+        occupants=room.usernames,
+        queue_len=len(room.queue),
+        roomstate=room.room_state(),
+        seq=room.seq,
+        token=tokens.issue(room.id, claims.username, room.stream, expiring=False),
+        replayed=missed is not None,
+    )
+    output_json = results.model_dump_json()
+    # a client that can't be caught up gets all of the queue again, one
+    # that did not ask to be keeps its copy and only gets the length
+    if payload.last_seq is not None and missed is None:
+        output_json = f'{{"queue":{room.queue_snapshot().json()},{output_json[1:]}'
+    resp = RawResults(output_json=output_json)
+    resp.set_rid(payload._rid)
+    await resp.send(ws)
+    for frame in missed or []:
+        _ = ws.state.outbox.push(frame)
+    # no JOIN goes out while the name is still seated, to everyone else it
+    # never really left. once it was let go of, it is back all the same.
+    if claims.username not in room.usernames:
+        await payload.prop(room, Join(_rid=0, user=claims.username))
+    room.seated(claims.username)
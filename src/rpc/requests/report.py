@@ -0,0 +1,51 @@
+from fastapi import WebSocket
+
+from ...models.heartbeat import DEFAULT_DRIFT
+from ...models.theater import Theater
+from ..codec import Frame
+from ..responses.pausing import Pausing
+from ..responses.resuming import Resuming
+from .base import RPCRequest, json_number, json_object
+from .groups import GROUP_V0
+
+
+class Report(RPCRequest):
+    position: float
+    paused: bool
+
+    @classmethod
+    def decode(cls, payload: Frame, rid: int) -> "Report":
+        fields = json_object(payload)
+        if fields is not None and fields.keys() == {"position", "paused"}:
+            position, paused = fields["position"], fields["paused"]
+            if json_number(position) and type(paused) is bool:
+                return cls.assemble(
+                    rid, {"position": float(position), "paused": paused}
+                )
+        return super().decode(payload, rid)
+
+
+@GROUP_V0.register(method="REPORT", clsname=Report)
+async def report(room: Theater, ws: WebSocket, payload: Report):
+    if room.leader is None or getattr(ws.state, "username", None) != room.leader:
+        return await payload.err(
+            ws,
+            "NOTLEADER",
+            13,
+            "Only the leader of the room can do this.",
+        )
+    was_paused = room.paused
+    room.report(
+        payload.position,
+        payload.paused,
+        getattr(room.appstate, "sync_drift", DEFAULT_DRIFT),
+    )
+    await payload.ok(ws)
+    # the position is left to the heartbeats, but everyone should stop or
+    # start along with the leader right away
+    if room.nowplaying is not None and room.paused != was_paused:
+        await room.broadcast_playback(
+            Pausing(_rid=0, position=room.clock.position())
+            if room.paused
+            else Resuming(_rid=0)
+        )
@@ -1,13 +1,19 @@
 from fastapi import WebSocket
 
 from ...models.theater import Theater
+from ..codec import Frame
 from ..responses.resuming import Resuming
-from .base import RPCRequest
+from .base import RPCRequest, json_object
 from .groups import GROUP_V0
 
 
 class Resume(RPCRequest):
-    pass
+    # always empty, and pydantic would ignore anything sent along anyway
+    @classmethod
+    def decode(cls, payload: Frame, rid: int) -> "Resume":
+        if json_object(payload) is not None:
+            return cls.assemble(rid, {})
+        return super().decode(payload, rid)
 
 
 @GROUP_V0.register(method="RESUME", clsname=Resume)
@@ -15,4 +21,4 @@ async def resume(room: Theater, ws: WebSocket, payload: Resume):
     # TODO: check authz
     room.resume_media()
     await payload.ok(ws)
-    await payload.prop(room, Resuming(_rid=0))
+    await room.broadcast_playback(Resuming(_rid=0))
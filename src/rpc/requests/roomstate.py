@@ -0,0 +1,14 @@
+from fastapi import WebSocket
+
+from ...models.theater import Theater
+from .base import RPCRequest
+from .groups import GROUP_V0
+
+
+class RoomStateQuery(RPCRequest):
+    pass
+
+
+@GROUP_V0.register(method="ROOMSTATE", clsname=RoomStateQuery)
+async def roomstate(room: Theater, ws: WebSocket, payload: RoomStateQuery):
+    await payload.res(ws, room.room_state())
@@ -1,19 +1,38 @@
 from fastapi import WebSocket
 
 from ...models.theater import Theater
+from ..codec import Frame
 from ..responses.seeking import Seeking
-from .base import RPCRequest
+from .base import RPCRequest, json_number, json_object
 from .groups import GROUP_V0
 
 
 class Seek(RPCRequest):
     position: float
 
+    @classmethod
+    def decode(cls, payload: Frame, rid: int) -> "Seek":
+        fields = json_object(payload)
+        if fields is not None and fields.keys() == {"position"}:
+            position = fields["position"]
+            if json_number(position):
+                return cls.assemble(rid, {"position": float(position)})
+        return super().decode(payload, rid)
+
 
 @GROUP_V0.register(method="SEEK", clsname=Seek)
 async def seek(room: Theater, ws: WebSocket, payload: Seek):
     # TODO: check authz
-    # TODO: validate that position is within the duration
+    if room.nowplaying is not None and not (
+        0.0 <= payload.position <= room.nowplaying.media.duration
+    ):
+        return await payload.err(
+            ws,
+            "OUTOFRANGE",
+            6,
+            "The position is outside of the currently playing media.",
+            f"{payload.position} is not within 0 and {room.nowplaying.media.duration}",
+        )
     room.seek_media(payload.position)
     await payload.ok(ws)
-    await payload.prop(room, Seeking(_rid=0, position=payload.position))
+    await room.broadcast_playback(Seeking(_rid=0, position=payload.position))
@@ -1,13 +1,106 @@
+from math import isfinite
+from typing import Optional
+
+import ujson
 from fastapi import WebSocket
 from pydantic import BaseModel
 
+from ..codec import BINARY_CODEC, EMPTY_PAYLOAD, TEXT_CODEC, Codec, Frame
+
+
+# helpers for the hand written payloads of the fixed-shape opcodes,
+# these have to produce the same output as pydantic would.
+def json_str(value: Optional[str]) -> str:
+    if value is None:
+        return "null"
+    return ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False)
+
+
+def json_float(value: Optional[float]) -> str:
+    if value is None or not isfinite(value):
+        return "null"
+    return repr(value)
+
+
+# sends a reply that is nothing but its method and rid, like OK, which is
+# the reply to most requests. the frame is cheaper than building the
+# response to produce it, pydantic's private attributes take the most.
+async def send_bare(ws: WebSocket, rid: int, method: str):
+    outbox = getattr(ws.state, "outbox", None)
+    if outbox is not None:
+        _ = outbox.push(outbox.codec.encode(rid, method, EMPTY_PAYLOAD))
+        return
+    codec: Codec = getattr(ws.state, "codec", TEXT_CODEC)
+    if codec.binary:
+        await ws.send_bytes(codec.encode(rid, method, EMPTY_PAYLOAD))
+    else:
+        await ws.send_text(codec.encode(rid, method, EMPTY_PAYLOAD))
+
 
 class RPCResponse(BaseModel):
     _method = "BASE"
     _rid = 0
+    _payload: Optional[str] = None
+    _frame: Optional[str] = None
+    _binary_frame: Optional[bytes] = None
+
+    # subclasses with a small fixed shape override this to skip pydantic
+    def payload_json(self) -> str:
+        return self.model_dump_json()
+
+    # frames are only built once per response and codec, no matter how
+    # many occupants it ends up being sent to. the private attributes are
+    # read straight out of pydantic's storage, going through `__getattr__`
+    # for them costs more than building the whole frame.
+    def __payload(self) -> str:
+        private = self.__pydantic_private__
+        payload = private.get("_payload")
+        if payload is None:
+            payload = self.payload_json()
+            private["_payload"] = payload
+        return payload
+
+    def payload(self) -> str:
+        return self.__payload()
+
+    def to_frame(self) -> str:
+        private = self.__pydantic_private__
+        frame = private.get("_frame")
+        if frame is None:
+            frame = TEXT_CODEC.encode(
+                private.get("_rid", 0), self._method, self.__payload()
+            )
+            private["_frame"] = frame
+        return frame
+
+    def to_binary_frame(self) -> bytes:
+        private = self.__pydantic_private__
+        frame = private.get("_binary_frame")
+        if frame is None:
+            frame = BINARY_CODEC.encode(
+                private.get("_rid", 0), self._method, self.__payload()
+            )
+            private["_binary_frame"] = frame
+        return frame
+
+    def frame_for(self, codec: Codec) -> Frame:
+        if codec.binary:
+            return self.to_binary_frame()
+        return self.to_frame()
 
     async def send(self, ws: WebSocket):
-        await ws.send_text(f"{self._rid} {self._method} {self.model_dump_json()}")
+        # connections seated in a theater are written to by their own
+        # writer task, so replies stay ordered with the broadcasts
+        outbox = getattr(ws.state, "outbox", None)
+        if outbox is not None:
+            _ = outbox.push(self.frame_for(outbox.codec))
+        elif getattr(ws.state, "codec", TEXT_CODEC).binary:
+            await ws.send_bytes(self.to_binary_frame())
+        else:
+            await ws.send_text(self.to_frame())
 
     def set_rid(self, rid: int) -> None:
-        self._rid = rid
+        private = self.__pydantic_private__
+        private["_rid"] = rid
+        private["_frame"] = None
+        private["_binary_frame"] = None
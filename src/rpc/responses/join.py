@@ -1,6 +1,6 @@
 from typing import Final
 
-from .base import RPCResponse
+from .base import RPCResponse, json_str
 
 
 class Join(RPCResponse):
@@ -8,3 +8,6 @@ class Join(RPCResponse):
     _rid: int = 0
 
     user: str
+
+    def payload_json(self) -> str:
+        return f'{{"user":{json_str(self.user)}}}'
@@ -0,0 +1,14 @@
+from typing import Final, Optional
+
+from .base import RPCResponse, json_str
+
+
+class Leader(RPCResponse):
+    _method: Final[str] = "LEADER"
+    _rid: int = 0
+
+    # nobody, once the last occupant left
+    user: Optional[str]
+
+    def payload_json(self) -> str:
+        return f'{{"user":{json_str(self.user)}}}'
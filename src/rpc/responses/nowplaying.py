@@ -1,8 +1,27 @@
 from typing import Final, Optional
 
-from .base import RPCResponse
+from ...models.streaminfo import StreamInfo
+from .base import RPCResponse, json_str
+
+
+def stream_json(stream: Optional[StreamInfo]) -> str:
+    return "null" if stream is None else stream.model_dump_json()
 
 
 class NowPlaying(RPCResponse):
     _method: Final[str] = "NOWPLAYING"
     media: Optional[str]
+    # the prefetched streams of the media, and of the items after it in
+    # order, None for the ones that were not resolved in time
+    stream: Optional[StreamInfo] = None
+    upcoming: Optional[list[Optional[StreamInfo]]] = None
+
+    def payload_json(self) -> str:
+        if self.upcoming is None:
+            upcoming = "null"
+        else:
+            upcoming = "[%s]" % ",".join([stream_json(s) for s in self.upcoming])
+        return (
+            f'{{"media":{json_str(self.media)},"stream":{stream_json(self.stream)},'
+            f'"upcoming":{upcoming}}}'
+        )
@@ -6,3 +6,6 @@ from .base import RPCResponse
 class Ok(RPCResponse):
     _method: Final[str] = "OK"
     _rid: int
+
+    def payload_json(self) -> str:
+        return "{}"
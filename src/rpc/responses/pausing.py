@@ -1,6 +1,6 @@
 from typing import Final, Optional
 
-from .base import RPCResponse
+from .base import RPCResponse, json_float
 
 
 class Pausing(RPCResponse):
@@ -8,3 +8,6 @@ class Pausing(RPCResponse):
     _rid: int = 0
 
     position: Optional[float]
+
+    def payload_json(self) -> str:
+        return f'{{"position":{json_float(self.position)}}}'
@@ -0,0 +1,13 @@
+from typing import Final
+
+from ...models.queueitem import QueueItem
+from .base import RPCResponse
+
+
+class QueuePage(RPCResponse):
+    _method: Final[str] = "QUEUEPAGE"
+    _rid: int = 0
+
+    offset: int
+    items: list[QueueItem]
+    last: bool
@@ -0,0 +1,15 @@
+from typing import Final
+
+from .base import RPCResponse
+
+
+class RawResults(RPCResponse):
+    """`Results` whose output was already serialized by the caller."""
+
+    _method: Final[str] = "RESULTS"
+    _rid: int = 0
+
+    output_json: str
+
+    def payload_json(self) -> str:
+        return f'{{"output":{self.output_json}}}'
@@ -0,0 +1,14 @@
+from typing import Final, Optional
+
+from .base import RPCResponse, json_float, json_str
+
+
+class Reconnect(RPCResponse):
+    _method: Final[str] = "RECONNECT"
+    _rid: int = 0
+
+    delay: float
+    token: Optional[str] = None
+
+    def payload_json(self) -> str:
+        return f'{{"delay":{json_float(self.delay)},"token":{json_str(self.token)}}}'
@@ -1,5 +1,6 @@
 from typing import Any, Final, Union
 
+import ujson
 from pydantic import BaseModel, field_serializer
 
 from .base import RPCResponse
@@ -13,4 +14,17 @@ class Results(RPCResponse):
 
     @field_serializer("output")
     def serialize_nested_output_field(self, output):
-        return output.model_dump()
+        if isinstance(output, BaseModel):
+            return output.model_dump()
+        return output
+
+    # dumps the nested model straight to json, rather than going
+    # through a python dict and validating it all over again
+    def payload_json(self) -> str:
+        if isinstance(self.output, BaseModel):
+            output = self.output.model_dump_json()
+        else:
+            output = ujson.dumps(
+                self.output, ensure_ascii=False, escape_forward_slashes=False
+            )
+        return f'{{"output":{output}}}'
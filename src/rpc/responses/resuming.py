@@ -6,3 +6,6 @@ from .base import RPCResponse
 class Resuming(RPCResponse):
     _method: Final[str] = "RESUMING"
     _rid: int = 0
+
+    def payload_json(self) -> str:
+        return "{}"
@@ -1,6 +1,6 @@
 from typing import Final
 
-from .base import RPCResponse
+from .base import RPCResponse, json_float
 
 
 class Seeking(RPCResponse):
@@ -8,3 +8,6 @@ class Seeking(RPCResponse):
     _rid: int = 0
 
     position: float
+
+    def payload_json(self) -> str:
+        return f'{{"position":{json_float(self.position)}}}'
@@ -0,0 +1,15 @@
+from typing import Final
+
+from .base import RPCResponse, json_float
+
+
+class Sync(RPCResponse):
+    _method: Final[str] = "SYNC"
+    _rid: int = 0
+
+    position: float
+    paused: bool
+
+    def payload_json(self) -> str:
+        paused = "true" if self.paused else "false"
+        return f'{{"position":{json_float(self.position)},"paused":{paused}}}'
@@ -0,0 +1,107 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Final, Optional
+
+import ujson
+
+DEFAULT_TOKEN_TTL: Final[float] = 5 * 60.0
+SECRET_FILE: Final[str] = "resume.key"
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+# the secret kept in the state directory, made up the first time around,
+# so the process that takes over from a draining one still knows it
+def load_secret(path: str) -> bytes:
+    directory = Path(path)
+    directory.mkdir(parents=True, exist_ok=True)
+    try:
+        return (directory / SECRET_FILE).read_bytes()
+    except FileNotFoundError:
+        pass
+    tmp = directory / f"{SECRET_FILE}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        _ = f.write(secrets.token_bytes(32))
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        # linking fails if another worker got there first, theirs is kept
+        os.link(tmp, directory / SECRET_FILE)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+    return (directory / SECRET_FILE).read_bytes()
+
+
+@dataclass
+class ResumeClaims:
+    theater: str
+    username: str
+    # the event stream of the theater at the time the token was issued
+    stream: str
+    # tokens without an expiry only last as long as their stream
+    expires: Optional[float]
+
+
+class ResumeTokens:
+    """
+    Issues and checks the tokens that let a client pick its seat in a
+    theater back up on another process, without going through HELLO and
+    having the whole queue sent over again. A token is the theater, the
+    username, the theater's event stream and an expiry, signed with a
+    secret every process shares.
+
+    Tokens given out along with a seat don't expire, instead they are only
+    good for as long as the theater's event stream lasts, those given out
+    when draining do expire but work with any stream.
+    """
+
+    __secret: bytes
+    __ttl: float
+
+    def __init__(self, secret: Optional[bytes] = None, ttl: float = DEFAULT_TOKEN_TTL):
+        self.__secret = secrets.token_bytes(32) if secret is None else secret
+        self.__ttl = ttl
+
+    def issue(
+        self, theater: str, username: str, stream: str, *, expiring: bool = True
+    ) -> str:
+        expires = time.time() + self.__ttl if expiring else None
+        claims = b64encode(
+            ujson.dumps(
+                [theater, username, stream, expires], ensure_ascii=False
+            ).encode("utf-8")
+        )
+        return f"{claims}.{self.__sign(claims)}"
+
+    # what the token was issued for, if it is genuine and did not expire yet
+    def verify(self, token: str) -> Optional[ResumeClaims]:
+        claims, _, signature = token.partition(".")
+        try:
+            if not hmac.compare_digest(self.__sign(claims), signature):
+                return None
+            theater, username, stream, expires = ujson.loads(b64decode(claims))
+            if expires is not None and expires < time.time():
+                return None
+        except (ValueError, TypeError):
+            return None
+        return ResumeClaims(theater, username, stream, expires)
+
+    def __sign(self, claims: str) -> str:
+        return b64encode(
+            hmac.new(self.__secret, claims.encode("ascii"), hashlib.sha256).digest()
+        )